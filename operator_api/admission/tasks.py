@@ -7,6 +7,7 @@ from django.db import transaction, IntegrityError
 
 from contractor.interfaces import LocalViewInterface
 from operator_api.crypto import hex_value
+from ledger.accounting_partitions import ADMISSIONS, StageBudget, ledger_partition, partition_tokens
 from ledger.models import Wallet, RootCommitment, Token
 from ledger.models.blacklist import BlacklistEntry
 from auditor.serializers import AdmissionSerializer
@@ -19,15 +20,20 @@ logger.setLevel(logging.INFO)
 
 @shared_task
 @notification_on_error
-def process_admissions():
+def process_admissions(token_id=None):
 
     if not LocalViewInterface.get_contract_parameters():
         logger.error('Contract parameters not yet populated.')
         return
 
+    latest_eon_number = LocalViewInterface.latest().eon_number()
+
     # This lock is needed because new wallets can be introduced, which would affect the checkpoint.
-    with RootCommitment.global_lock():
-        process_admissions_for_latest_eon()
+    for token in partition_tokens(token_id):
+        with ledger_partition(ADMISSIONS, [token], latest_eon_number) as acquired:
+            if acquired:
+                with StageBudget('process_admissions', [token]) as budget:
+                    process_admissions_for_latest_eon(tokens=[token], budget=budget)
 
 
 def should_void_admission(wallet, operator_eon_number, is_checkpoint_created):
@@ -55,7 +61,10 @@ def should_void_admission(wallet, operator_eon_number, is_checkpoint_created):
     return False
 
 
-def process_admissions_for_latest_eon():
+def process_admissions_for_latest_eon(tokens=None, budget=None):
+    if tokens is None:
+        tokens = Token.objects.all()
+
     latest_eon_number = LocalViewInterface.latest().eon_number()
     checkpoint_created = RootCommitment.objects.filter(
         eon_number=latest_eon_number).exists()
@@ -67,9 +76,10 @@ def process_admissions_for_latest_eon():
 
     with transaction.atomic():
         pending_approval = Wallet.objects.select_for_update().filter(
-            registration_operator_authorization__isnull=True)
+            registration_operator_authorization__isnull=True,
+            token__in=tokens)
 
-        for token in Token.objects.all():
+        for token in tokens:
             wallet_offsets[token.id] = Wallet.objects.filter(
                 registration_operator_authorization__isnull=False, token=token).count()
 
@@ -84,6 +94,9 @@ def process_admissions_for_latest_eon():
                 return
 
         for wallet in pending_approval:
+            # the remaining wallets are admitted by the next heartbeat
+            if budget is not None and budget.exhausted():
+                break
             try:
                 if wallet.registration_operator_authorization is not None:
                     logger.error(
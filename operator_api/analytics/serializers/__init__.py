@@ -1 +1 @@
-from .analytics import WalletStatusSerializer, StandardStatusSerializer, ChallengeStatusSerializer
+from .analytics import WalletStatusSerializer, StandardStatusSerializer, ChallengeStatusSerializer, TransactionQueueStatusSerializer, AccountingStageStatusSerializer
@@ -24,3 +24,23 @@ class StandardStatusSerializer(serializers.Serializer):
 
 class ChallengeStatusSerializer(StandardStatusSerializer):
     rebuted = serializers.IntegerField(min_value=0, read_only=True)
+
+
+class TransactionQueueStatusSerializer(serializers.Serializer):
+    queue_depth = serializers.IntegerField(min_value=0, read_only=True)
+    unsent = serializers.IntegerField(min_value=0, read_only=True)
+    mined = serializers.IntegerField(min_value=0, read_only=True)
+    with_deadline = serializers.IntegerField(min_value=0, read_only=True)
+    overdue = serializers.IntegerField(min_value=0, read_only=True)
+    confirmed = serializers.IntegerField(min_value=0, read_only=True)
+    missed_deadlines = serializers.IntegerField(min_value=0, read_only=True)
+    mean_blocks_to_mine = serializers.FloatField(read_only=True)
+    mean_seconds_to_confirm = serializers.FloatField(read_only=True)
+
+
+class AccountingStageStatusSerializer(serializers.Serializer):
+    heartbeats = serializers.IntegerField(min_value=0, read_only=True)
+    overlapping_heartbeats = serializers.IntegerField(min_value=0, read_only=True)
+    mean_heartbeat_seconds = serializers.FloatField(read_only=True)
+    last_heartbeat_seconds = serializers.FloatField(read_only=True)
+    stages = serializers.DictField(child=serializers.DictField(), read_only=True)
@@ -10,4 +10,8 @@ urlpatterns = [
     url(r'^deposits$', views.DepositsView.as_view(), name='analytics-deposits'),
     url(r'^withdrawals$', views.WithdrawalsView.as_view(),
         name='analytics-withdrawals'),
+    url(r'^ethereum-transactions$', views.TransactionQueueView.as_view(),
+        name='analytics-ethereum-transactions'),
+    url(r'^accounting-stages$', views.AccountingStagesView.as_view(),
+        name='analytics-accounting-stages'),
 ]
@@ -4,9 +4,11 @@ from django.conf import settings
 from django.db.models import Count, Sum
 
 from contractor.interfaces import LocalViewInterface
+from contractor.tasks.send_queued_transactions import transaction_queue_metrics
+from ledger.accounting_partitions import accounting_stage_metrics
 from ledger.models import Wallet, Transfer, Challenge, Deposit, Withdrawal
 from operator_api.models import MockModel
-from .serializers import WalletStatusSerializer, StandardStatusSerializer, ChallengeStatusSerializer
+from .serializers import WalletStatusSerializer, StandardStatusSerializer, ChallengeStatusSerializer, TransactionQueueStatusSerializer, AccountingStageStatusSerializer
 from drf_yasg.utils import swagger_auto_schema
 from django.utils.decorators import method_decorator
 
@@ -129,3 +131,35 @@ class WithdrawalsView(generics.GenericAPIView):
             status=200,
             data=StandardStatusSerializer(data_model).data
         )
+
+
+@method_decorator(name='get', decorator=swagger_auto_schema(
+    operation_description="Retrieve queue depth and delivery times of the hub's on-chain transactions.",
+))
+class TransactionQueueView(generics.GenericAPIView):
+    serializer_class = TransactionQueueStatusSerializer
+    queryset = ''
+
+    def get(self, request, *args, **kwargs):
+        data_model = MockModel(**transaction_queue_metrics())
+
+        return Response(
+            status=200,
+            data=TransactionQueueStatusSerializer(data_model).data
+        )
+
+
+@method_decorator(name='get', decorator=swagger_auto_schema(
+    operation_description="Retrieve run counts and latencies of the hub's accounting stages.",
+))
+class AccountingStagesView(generics.GenericAPIView):
+    serializer_class = AccountingStageStatusSerializer
+    queryset = ''
+
+    def get(self, request, *args, **kwargs):
+        data_model = MockModel(**accounting_stage_metrics())
+
+        return Response(
+            status=200,
+            data=AccountingStageStatusSerializer(data_model).data
+        )
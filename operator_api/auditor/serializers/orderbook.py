@@ -1,9 +1,7 @@
-from functools import cmp_to_key
-
 from rest_framework import serializers
 from auditor.util import SwapDataRequest
 from ledger.models import Transfer
-from swapper.matcher import price_comparison_function
+from swapper.matcher import price_sorting_key
 from .order import OrderSerializer
 from contractor.interfaces import LocalViewInterface
 
@@ -25,8 +23,8 @@ class OrderBookSerializer(serializers.Serializer):
             swap=True,
             eon_number=eon_number)
 
-        all_sell_orders = sorted(all_sell_orders, key=cmp_to_key(
-            price_comparison_function(inverse=True)))
+        all_sell_orders = sorted(
+            all_sell_orders, key=price_sorting_key(inverse=True))
 
         all_buy_orders = Transfer.objects.filter(
             wallet__token=swap_data_request.right_token,
@@ -38,8 +36,8 @@ class OrderBookSerializer(serializers.Serializer):
             swap=True,
             eon_number=eon_number)
 
-        all_buy_orders = sorted(all_buy_orders, key=cmp_to_key(
-            price_comparison_function(inverse=False)))
+        all_buy_orders = sorted(
+            all_buy_orders, key=price_sorting_key(inverse=False))
 
         return {
             'sell_orders': OrderSerializer(combine_order_volumes(all_sell_orders), many=True, read_only=True).data,
@@ -5,4 +5,4 @@
 # wait for cache server
 ./wait_for_it.sh ${CACHE_REDIS_HOST}:${CACHE_REDIS_PORT} --timeout=0 --                     \
 ./wait_for_it.sh ${OPERATOR_API_HOST}:${OPERATOR_API_PORT} --timeout=0 --                                           \
-celery -A operator_api worker -l info --concurrency 1 -n accounting-worker@%h -Q accounting
+celery -A operator_api worker -l info --concurrency ${HUB_ACCOUNTING_WORKER_CONCURRENCY:-4} -n accounting-worker@%h -Q accounting
@@ -7,10 +7,12 @@ from contractor.models import (
     ContractParameters,
     ContractState,
     ContractLedgerState,
-    EthereumTransaction)
+    EthereumTransaction,
+    InFlightTransaction)
 
 # Register your models here.
 admin.site.register(ContractParameters, ContractParametersAdmin)
 admin.site.register(ContractState, ContractStateAdmin)
 admin.site.register(ContractLedgerState, ContractLedgerStateAdmin)
 admin.site.register(EthereumTransaction)
+admin.site.register(InFlightTransaction)
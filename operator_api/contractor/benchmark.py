@@ -0,0 +1,579 @@
+import json
+import logging
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from django.conf import settings
+from django.core.cache import cache
+from django.test.utils import override_settings
+from eth_abi import decode_abi, encode_abi
+from eth_utils import decode_hex, encode_hex, function_abi_to_4byte_selector, keccak, to_checksum_address
+from contractor.abi import load_abi
+from contractor.decoders import NOCUSTContractEventDecoder
+from contractor.interfaces import LocalViewInterface
+from contractor.interfaces.json_rpc_batch import FakeJSONRPCTransport
+from contractor.interfaces.running_state_buffer import RUNNING_STATES_KEY, RUNNING_STATE_BLOCKS_KEY, CONFIRMED_HEAD_KEY
+from contractor.models import ContractState, ChallengeEntry
+from contractor.tasks import populate_contract_parameters, fully_synchronize_contract_state
+from contractor.tasks.respond_to_challenges import ChallengeResponder
+from contractor.tasks.fetch_blocks import encode_log
+from contractor.tasks.synchronize_contract_state import CONTRACT_LOG_CHECKPOINT_KEY, SyncWindow
+from ledger.challenge_proofs import CHALLENGE_PROOF_BUNDLE_TIMEOUT, ChallengeProofBundle, challenge_proof_bundle_key
+from ledger.models import Token, Wallet, Deposit, Challenge, ExclusiveBalanceAllotment, TokenCommitment
+from ledger.tasks import register_eth_token
+from operator_api import crypto
+from operator_api.celery import operator_celery
+from operator_api.models.mutex_model import strict_redis_client
+
+
+# Logs are stored as json lines in the encoded form that chain synchronization decodes,
+# see contractor.tasks.fetch_blocks.encode_log
+
+
+def random_abi_value(generator, abi_type):
+    if abi_type.endswith(']'):
+        element_type, length = abi_type[:abi_type.rindex('[')], abi_type[abi_type.rindex('[') + 1:-1]
+        length = int(length) if length else generator.randint(0, 16)
+        return [random_abi_value(generator, element_type) for _ in range(length)]
+    if abi_type == 'address':
+        return encode_hex(generator.getrandbits(160).to_bytes(20, 'big'))
+    if abi_type == 'bool':
+        return generator.random() < 0.5
+    if abi_type.startswith('bytes'):
+        return generator.getrandbits(8 * int(abi_type[5:])).to_bytes(int(abi_type[5:]), 'big')
+    if abi_type.startswith('uint'):
+        return generator.getrandbits(int(abi_type[4:] or 256))
+    raise ValueError('Unsupported abi type {}'.format(abi_type))
+
+
+# random logs of the contract events, with the same share of every event
+def synthetic_contract_logs(log_count, seed=None):
+    generator = random.Random(seed)
+    events = list(NOCUSTContractEventDecoder().events.items())
+    logs = []
+
+    for index in range(log_count):
+        topic, event = events[index % len(events)]
+        topics, data_types, data_values = [topic], [], []
+        for param in event.get(u'inputs'):
+            value = random_abi_value(generator, param.get(u'type'))
+            if param.get(u'indexed'):
+                topics.append(encode_hex(encode_abi([param.get(u'type')], [value])))
+            else:
+                data_types.append(param.get(u'type'))
+                data_values.append(value)
+
+        logs.append({
+            'address': None,
+            'topics': topics,
+            'data': encode_hex(encode_abi(data_types, data_values)),
+            'blockNumber': index,
+            'transactionHash': encode_hex(generator.getrandbits(256).to_bytes(32, 'big')),
+            'transactionIndex': 0,
+            'blockHash': encode_hex(generator.getrandbits(256).to_bytes(32, 'big')),
+            'logIndex': 0,
+            'removed': False
+        })
+
+    return logs
+
+
+def export_contract_logs(contract_interface, from_block, to_block):
+    return [encode_log(log.__dict__) for log in contract_interface.get_contract_logs(from_block, to_block)]
+
+
+def write_logs(path, logs):
+    with open(path, 'w') as logs_file:
+        for log in logs:
+            logs_file.write(json.dumps(log) + '\n')
+
+
+def read_logs(path):
+    with open(path) as logs_file:
+        return [json.loads(line) for line in logs_file if line.strip()]
+
+
+# the decoding done before events were compiled, kept as the baseline of the benchmark
+def reference_decode(events, log):
+    event = events.get(log[u'topics'][0])
+    if event is None:
+        return None
+
+    data_types = [param.get(u'type') for param in event.get(
+        'inputs') if not param.get(u'indexed')]
+    data = decode_abi(data_types, decode_hex(
+        log.get(u'data'))) if log.get(u'data') != '0x0' else []
+
+    decoded_inputs = {}
+    data_ctr, topics_ctr = 0, 1
+    for param in event.get(u'inputs'):
+        if param.get(u'indexed'):
+            value = log[u'topics'][topics_ctr]
+            topics_ctr += 1
+        else:
+            value = data[data_ctr]
+            data_ctr += 1
+
+        if u'[]' in param.get(u'type'):
+            value = list(value)
+
+        decoded_inputs[param.get(u'name')] = value
+
+    return {
+        u'name': event.get(u'name'),
+        u'data': decoded_inputs,
+        u'txid': log[u'transactionHash']
+    }
+
+
+# Decodes the same logs with the reference and the compiled decoder, checks both agree
+# and reports the throughput of each
+class EventDecodingBenchmark(object):
+    def __init__(self, decoder=None):
+        self.decoder = decoder or NOCUSTContractEventDecoder()
+
+    def run(self, logs, rounds=5):
+        reference_seconds, compiled_seconds = float('inf'), float('inf')
+        for _ in range(rounds):
+            started = time.perf_counter()
+            reference = [decoded for decoded in (reference_decode(self.decoder.events, log) for log in logs)
+                         if decoded is not None]
+            reference_seconds = min(
+                reference_seconds, time.perf_counter() - started)
+
+            started = time.perf_counter()
+            compiled = self.decoder.decode_many(logs)
+            compiled_seconds = min(
+                compiled_seconds, time.perf_counter() - started)
+
+        if compiled != reference:
+            raise ValueError('Compiled decoding does not match the reference decoding.')
+
+        return {
+            'logs': len(logs),
+            'decoded': len(compiled),
+            'reference_logs_per_second': len(logs) / reference_seconds if reference_seconds else 0,
+            'compiled_logs_per_second': len(logs) / compiled_seconds if compiled_seconds else 0,
+            'speedup': reference_seconds / compiled_seconds if compiled_seconds else 0,
+        }
+
+
+def zero_abi_value(abi_type):
+    if abi_type.endswith(']'):
+        length = abi_type[abi_type.rindex('[') + 1:-1]
+        return [zero_abi_value(abi_type[:abi_type.rindex('[')])] * int(length or 0)
+    if abi_type == 'address':
+        return '0x' + '00' * 20
+    if abi_type == 'bool':
+        return False
+    if abi_type.startswith('bytes'):
+        return b'\x00' * int(abi_type[5:] or 0)
+    return 0
+
+
+# A deterministic chain of the NOCUST contract, answering the json-rpc methods used by chain
+# synchronization. Every block after genesis holds deposits_per_block deposits of ETH to the
+# given recipients, and the contract ledger state adds them up.
+class SyntheticChain(object):
+    def __init__(self, block_count, recipients, deposits_per_block=1, genesis_block=1, blocks_per_eon=180, seed=0):
+        self.genesis_block = genesis_block
+        self.head = genesis_block + block_count
+        self.blocks_per_eon = blocks_per_eon
+        self.recipients = recipients
+        self.deposits_per_block = deposits_per_block
+        self.seed = seed
+        self.contract_address = to_checksum_address(settings.HUB_LQD_CONTRACT_ADDRESS)
+        self.deposit_event = next(event for event in NOCUSTContractEventDecoder().events.items()
+                                  if event[1].get(u'name') == 'Deposit')
+        self.cumulative_deposits = [0]
+        for block_number in range(genesis_block + 1, self.head + 1):
+            self.cumulative_deposits.append(self.cumulative_deposits[-1] + sum(
+                self.deposit_amount(block_number, index) for index in range(deposits_per_block)))
+        self.functions = {
+            encode_hex(function_abi_to_4byte_selector(function)): function
+            for function in load_abi('NOCUSTCommitChain.json') if function.get('type') == 'function'}
+
+    def block_hash(self, block_number):
+        return encode_hex(keccak(text='{}:{}'.format(self.seed, block_number)))
+
+    def transaction_hash(self, block_number, index):
+        return encode_hex(keccak(text='{}:{}:{}'.format(self.seed, block_number, index)))
+
+    def deposit_amount(self, block_number, index):
+        return 10 ** 15 * (1 + (block_number * 7 + index) % 13)
+
+    def deposits_until(self, block_number):
+        return self.cumulative_deposits[max(0, min(block_number, self.head) - self.genesis_block)]
+
+    def block_number(self, block_identifier):
+        if block_identifier in ('latest', 'pending'):
+            return self.head
+        if block_identifier == 'earliest':
+            return 0
+        return int(block_identifier, 16)
+
+    def block(self, block_number):
+        if block_number > self.head:
+            return None
+        return {
+            'number': hex(block_number),
+            'hash': self.block_hash(block_number),
+            'parentHash': self.block_hash(block_number - 1),
+            'nonce': '0x' + '00' * 8,
+            'sha3Uncles': '0x' + '00' * 32,
+            'logsBloom': '0x' + '00' * 256,
+            'transactionsRoot': '0x' + '00' * 32,
+            'stateRoot': '0x' + '00' * 32,
+            'receiptsRoot': '0x' + '00' * 32,
+            'miner': '0x' + '00' * 20,
+            'difficulty': '0x1',
+            'totalDifficulty': hex(block_number + 1),
+            'extraData': '0x',
+            'size': '0x3e8',
+            'gasLimit': '0x7a1200',
+            'gasUsed': '0x0',
+            'timestamp': hex(1500000000 + 15 * block_number),
+            'transactions': [self.transaction_hash(block_number, index)
+                             for index in range(self.block_deposits(block_number))],
+            'uncles': [],
+        }
+
+    def block_deposits(self, block_number):
+        return self.deposits_per_block if self.genesis_block < block_number <= self.head else 0
+
+    def logs(self, block_number):
+        topic, event = self.deposit_event
+        logs = []
+        for index in range(self.block_deposits(block_number)):
+            recipient = self.recipients[(block_number + index) % len(self.recipients)]
+            logs.append({
+                'address': self.contract_address,
+                'topics': [topic,
+                           encode_hex(encode_abi(['address'], [self.contract_address])),
+                           encode_hex(encode_abi(['address'], [recipient]))],
+                'data': encode_hex(encode_abi(['uint256'], [self.deposit_amount(block_number, index)])),
+                'blockNumber': hex(block_number),
+                'blockHash': self.block_hash(block_number),
+                'transactionHash': self.transaction_hash(block_number, index),
+                'transactionIndex': hex(index),
+                'logIndex': hex(index),
+                'removed': False,
+            })
+        return logs
+
+    def receipt(self, transaction_hash):
+        for block_number in range(self.genesis_block + 1, self.head + 1):
+            for index in range(self.block_deposits(block_number)):
+                if self.transaction_hash(block_number, index) == transaction_hash:
+                    return {
+                        'transactionHash': transaction_hash,
+                        'transactionIndex': hex(index),
+                        'blockNumber': hex(block_number),
+                        'blockHash': self.block_hash(block_number),
+                        'from': '0x' + '00' * 20,
+                        'to': self.contract_address,
+                        'cumulativeGasUsed': '0x0',
+                        'gasUsed': '0x0',
+                        'contractAddress': None,
+                        'logs': [log for log in self.logs(block_number)
+                                 if log.get('transactionHash') == transaction_hash],
+                        'logsBloom': '0x' + '00' * 256,
+                        'status': '0x1',
+                    }
+        return None
+
+    def contract_call(self, name, arguments, block_number):
+        if name == 'genesis':
+            return [self.genesis_block]
+        if name == 'BLOCKS_PER_EON':
+            return [self.blocks_per_eon]
+        if name == 'EONS_KEPT':
+            return [3]
+        if name == 'getServerContractStateVariables':
+            eon_number = 1 + (block_number - self.genesis_block) // self.blocks_per_eon
+            return [b'\x00' * 32, eon_number, b'\x00' * 32, True, False, 0]
+        if name == 'getServerContractLedgerStateVariables':
+            deposits = self.deposits_until(block_number)
+            return [0, 0, deposits, deposits]
+        return None
+
+    def eth_call(self, params):
+        call, block_identifier = params
+        data = decode_hex(call.get('data'))
+        function = self.functions.get(encode_hex(data[:4]))
+        if function is None:
+            raise ValueError('execution reverted')
+
+        output_types = [output.get('type') for output in function.get('outputs')]
+        arguments = decode_abi([argument.get('type') for argument in function.get('inputs')], data[4:])
+        values = self.contract_call(function.get('name'), arguments, self.block_number(block_identifier))
+        if values is None:
+            values = [zero_abi_value(output_type) for output_type in output_types]
+        return encode_hex(encode_abi(output_types, values))
+
+    def eth_get_logs(self, params):
+        log_filter = params[0]
+        from_block = self.block_number(log_filter.get('fromBlock', 'latest'))
+        to_block = min(self.block_number(log_filter.get('toBlock', 'latest')), self.head)
+        return [log for block_number in range(from_block, to_block + 1) for log in self.logs(block_number)]
+
+    def handlers(self):
+        return {
+            'net_version': lambda params: '1337',
+            'eth_chainId': lambda params: hex(1337),
+            'eth_blockNumber': lambda params: hex(self.head),
+            'eth_getBlockByNumber': lambda params: self.block(self.block_number(params[0])),
+            'eth_getBlockByHash': lambda params: next(
+                (self.block(n) for n in range(self.head + 1) if self.block_hash(n) == params[0]), None),
+            'eth_getLogs': self.eth_get_logs,
+            'eth_getTransactionReceipt': lambda params: self.receipt(params[0]),
+            'eth_call': self.eth_call,
+        }
+
+
+# Serves a json-rpc transport over http on the loopback interface, waiting latency seconds
+# before answering each request the way a remote node would
+class JSONRPCStubServer(object):
+    def __init__(self, transport: FakeJSONRPCTransport, latency=0.0):
+        self.transport = transport
+        self.latency = latency
+        self.lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                payload = json.loads(self.rfile.read(int(self.headers.get('Content-Length'))))
+                time.sleep(stub.latency)
+                with stub.lock:
+                    response = json.dumps(stub.transport(payload)).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(response)))
+                self.end_headers()
+                self.wfile.write(response)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{}'.format(self.server.server_address[1])
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def reset_chain_sync_state():
+    LocalViewInterface.contract_parameters = None
+    strict_redis_client.delete(
+        CONTRACT_LOG_CHECKPOINT_KEY, RUNNING_STATES_KEY, RUNNING_STATE_BLOCKS_KEY, CONFIRMED_HEAD_KEY)
+    LocalViewInterface.invalidate()
+
+
+# Synchronizes a synthetic chain served over http from a stub node, from genesis to its head,
+# and reports the throughput and the number of json-rpc requests it took.
+# The contract parameters, tokens and wallets are written to the current database and the sync
+# keys of redis are reset, so this must run against a scratch database and redis.
+class ChainSyncBenchmark(object):
+    def __init__(self, block_count=500, recipient_count=16, deposits_per_block=1, latency=0.0, in_process=True):
+        self.block_count = block_count
+        self.recipient_count = recipient_count
+        self.deposits_per_block = deposits_per_block
+        self.latency = latency
+        self.in_process = in_process
+
+    def create_wallets(self, recipients):
+        token = Token.objects.get(address__iexact=crypto.remove_0x_prefix(settings.HUB_LQD_CONTRACT_ADDRESS))
+        for recipient in recipients:
+            Wallet.objects.create(
+                address=crypto.remove_0x_prefix(recipient),
+                token=token,
+                registration_eon_number=0)
+
+    def run(self):
+        recipients = [to_checksum_address(encode_hex(keccak(text='recipient {}'.format(index))[:20]))
+                      for index in range(self.recipient_count)]
+        chain = SyntheticChain(
+            block_count=self.block_count,
+            recipients=recipients,
+            deposits_per_block=self.deposits_per_block)
+        transport = FakeJSONRPCTransport(chain.handlers())
+
+        operator_celery.conf.update(
+            task_always_eager=True,
+            task_eager_propagates=True)
+
+        with JSONRPCStubServer(transport, latency=self.latency) as server, \
+                override_settings(
+                    HUB_ETHEREUM_NODE_URL=server.url,
+                    HUB_ETHEREUM_NETWORK_IS_POA=False,
+                    HUB_SYNC_FETCH_IN_PROCESS=self.in_process):
+            reset_chain_sync_state()
+            populate_contract_parameters()
+            register_eth_token()
+            self.create_wallets(recipients)
+
+            requests, round_trips = transport.requests, transport.round_trips
+            started = time.perf_counter()
+            fully_synchronize_contract_state()
+            elapsed = time.perf_counter() - started
+            requests, round_trips = transport.requests - requests, transport.round_trips - round_trips
+
+            blocks = LocalViewInterface.latest_block() - chain.genesis_block
+            report = {
+                'blocks': blocks,
+                'confirmed_blocks': ContractState.objects.filter(confirmed=True).count(),
+                'deposits': Deposit.objects.count(),
+                'seconds': elapsed,
+                'blocks_per_second': blocks / elapsed if elapsed else 0,
+                'rpc_requests_per_block': requests / blocks if blocks else 0,
+                'rpc_round_trips_per_block': round_trips / blocks if blocks else 0,
+                'lookahead': SyncWindow.lookahead,
+            }
+            reset_chain_sync_state()
+
+        return report
+
+
+# Stands in for the contract interface while answering challenges, every read of challenge records
+# takes latency seconds like a round trip to the node would and answers are only counted
+class ChallengeResponseStubInterface(object):
+    def __init__(self, eon_number, latency=0.0):
+        self.eon_number = eon_number
+        self.latency = latency
+        self.answers = []
+        self.round_trips = 0
+
+    def get_challenge_record(self, token_address, recipient, sender, block_identifier='latest'):
+        return self.get_challenge_records([(token_address, recipient, sender)], block_identifier)[0]
+
+    def get_challenge_records(self, keys, block_identifier='latest'):
+        self.round_trips += 1
+        time.sleep(self.latency)
+        return [ChallengeEntry([1, 0, self.eon_number - 1, 0, 0, 0, 0, 0]) for _ in keys]
+
+    def queue_answer_state_update_challenge(self, challenge, **kwargs):
+        self.answers.append(challenge.id)
+        return challenge.id
+
+
+class UnsavedChallengeResponder(ChallengeResponder):
+    def mark_rebuted(self, challenge):
+        challenge.rebuted = True
+
+
+# Answers challenge_count simultaneous state update challenges against one checkpoint, serially and
+# with the worker pool, from bundles of synthetic allotments cached the way precompute_challenge_proofs
+# caches them. Nothing is written to the database, the cached bundles are removed afterwards.
+class ChallengeResponseBenchmark(object):
+    # far beyond any real eon, so the cached bundles never collide with the bundles of a running hub
+    eon_number = 2 ** 40
+
+    def __init__(self, challenge_count=10000, workers=None, latency=0.0, seed=0):
+        self.challenge_count = challenge_count
+        self.workers = workers or settings.HUB_CHALLENGE_RESPONSE_WORKERS
+        self.latency = latency
+        self.generator = random.Random(seed)
+
+    def random_checksums(self, count):
+        return ''.join('{:064x}'.format(self.generator.getrandbits(256)) for _ in range(count))
+
+    def synthetic_challenges(self):
+        token = Token(id=1, address=crypto.remove_0x_prefix(settings.HUB_LQD_CONTRACT_ADDRESS))
+        depth = max(1, self.challenge_count.bit_length())
+        token_commitment = TokenCommitment(
+            token=token,
+            membership_hashes=self.random_checksums(4))
+
+        challenges, bundles = [], {}
+        left = 0
+        for index in range(self.challenge_count):
+            wallet = Wallet(
+                id=index + 1,
+                address=crypto.remove_0x_prefix(
+                    encode_hex(keccak(text='challenger {}'.format(index))[:20])),
+                token=token)
+            amount = self.generator.randint(0, 10 ** 18)
+            allotment = ExclusiveBalanceAllotment(
+                wallet=wallet,
+                eon_number=self.eon_number,
+                left=left,
+                right=left + amount,
+                merkle_proof_hashes=self.random_checksums(depth),
+                merkle_proof_values=','.join(str(self.generator.randint(0, 10 ** 18)) for _ in range(depth)),
+                merkle_proof_trail=index)
+            left += amount
+
+            bundle = ChallengeProofBundle(allotment, token_commitment)
+            bundle.passive_values = (b'\0' * 32, 0, 0)
+            bundle.transfer_proofs = {}
+            bundles[challenge_proof_bundle_key(wallet.id, self.eon_number)] = bundle
+
+            challenges.append(Challenge(
+                id=index + 1,
+                wallet=wallet,
+                recipient=wallet,
+                eon_number=self.eon_number,
+                block=index))
+        return challenges, bundles
+
+    def answer(self, challenges, workers):
+        contract_interface = ChallengeResponseStubInterface(
+            eon_number=self.eon_number, latency=self.latency)
+        responder = UnsavedChallengeResponder(
+            contract_interface=contract_interface, workers=workers)
+
+        started = time.perf_counter()
+        answered = responder.respond(challenges)
+        elapsed = time.perf_counter() - started
+
+        if len(answered) != len(challenges):
+            raise ValueError('Answered {} of {} challenges.'.format(
+                len(answered), len(challenges)))
+        return elapsed, contract_interface
+
+    def run(self):
+        challenges, bundles = self.synthetic_challenges()
+        cache.set_many(bundles, timeout=CHALLENGE_PROOF_BUNDLE_TIMEOUT)
+
+        responder_logger = logging.getLogger(ChallengeResponder.__module__)
+        level = responder_logger.level
+        responder_logger.setLevel(logging.ERROR)
+        try:
+            with override_settings(NOTIFICATION_HOOK_URL=None):
+                serial_seconds, _ = self.answer(challenges, workers=1)
+                for challenge in challenges:
+                    challenge.rebuted = False
+                pool_seconds, contract_interface = self.answer(challenges, workers=self.workers)
+                answers = contract_interface.answers
+        finally:
+            responder_logger.setLevel(level)
+            cache.delete_many(list(bundles.keys()))
+
+        # workers take the challenges in deadline order
+        displacement = max(abs(position - (challenge_id - 1)) for position, challenge_id in enumerate(answers))
+
+        return {
+            'challenges': len(challenges),
+            'workers': self.workers,
+            'latency': self.latency,
+            'serial_seconds': serial_seconds,
+            'serial_challenges_per_second': len(challenges) / serial_seconds if serial_seconds else 0,
+            'pool_seconds': pool_seconds,
+            'pool_challenges_per_second': len(challenges) / pool_seconds if pool_seconds else 0,
+            'speedup': serial_seconds / pool_seconds if pool_seconds else 0,
+            'max_deadline_displacement': displacement,
+            'challenge_record_round_trips': contract_interface.round_trips,
+        }
@@ -1,21 +1,71 @@
 from celery.utils.log import get_task_logger
 from eth_utils import keccak, encode_hex, decode_hex
-from eth_abi import decode_abi
+from eth_abi.decoding import ContextFramesBytesIO, TupleDecoder
+from eth_abi.registry import registry
 
 
 logger = get_task_logger(__name__)
 
 
-class EthereumEventDecoder:
-    events = {}
+# An event of the abi with everything needed to decode its logs worked out once:
+# the non-indexed types and their tuple decoder, and where each input is read from.
+class CompiledEvent(object):
+    def __init__(self, event):
+        self.name = event.get(u'name')
+        self.data_types = tuple(param.get(u'type') for param in event.get(
+            u'inputs') if not param.get(u'indexed'))
+        self.data_decoder = TupleDecoder(decoders=[
+            registry.get_decoder(data_type) for data_type in self.data_types])
+
+        # (input name, read from topics, position in topics or data, is an array)
+        self.inputs = []
+        data_ctr, topics_ctr = 0, 1
+        for param in event.get(u'inputs'):
+            if param.get(u'indexed'):
+                self.inputs.append(
+                    (param.get(u'name'), True, topics_ctr, False))
+                topics_ctr += 1
+            else:
+                self.inputs.append(
+                    (param.get(u'name'), False, data_ctr, u'[]' in param.get(u'type')))
+                data_ctr += 1
+
+    def decode_data(self, data):
+        if not self.data_types or data == '0x0':
+            return ()
+        return self.data_decoder(ContextFramesBytesIO(decode_hex(data)))
+
+    def decode(self, log):
+        topics = log[u'topics']
+        data = self.decode_data(log.get(u'data'))
+
+        decoded_inputs = {}
+        for name, indexed, position, is_array in self.inputs:
+            if indexed:
+                decoded_inputs[name] = topics[position]
+            elif is_array:
+                decoded_inputs[name] = list(data[position])
+            else:
+                decoded_inputs[name] = data[position]
+
+        return {
+            u'name': self.name,
+            u'data': decoded_inputs,
+            u'txid': log[u'transactionHash']
+        }
 
+
+class EthereumEventDecoder:
     def __init__(self, abi):
+        self.events = {}
+        self.compiled_events = {}
         events = [event for event in abi if event.get(
             'type').lower() == 'event']
         for event in events:
             types = [param.get(u'type') for param in event.get('inputs')]
             topic = EthereumEventDecoder.topic(event[u'name'], types)
             self.events[topic] = event
+            self.compiled_events[topic] = CompiledEvent(event)
 
     @staticmethod
     def topic(name, types):
@@ -24,43 +74,22 @@ class EthereumEventDecoder:
 
     def decode(self, log):
         topic = log[u'topics'][0]
-        if topic not in self.events:
+        compiled_event = self.compiled_events.get(topic)
+        if compiled_event is None:
             logger.error("UNKNOWN EVENT TOPIC: {}\n{}".format(
                 topic, self.events))
             return None
 
-        event = self.events.get(topic)
-
-        data_types = [param.get(u'type') for param in event.get(
-            'inputs') if not param.get(u'indexed')]
-        data = decode_abi(data_types, decode_hex(
-            log.get(u'data'))) if log.get(u'data') != '0x0' else []
-
-        decoded_inputs = {}
-        data_ctr, topics_ctr = 0, 1
-        for param in event.get(u'inputs'):
-            if param.get(u'indexed'):
-                value = log[u'topics'][topics_ctr]
-                topics_ctr += 1
-            else:
-                value = data[data_ctr]
-                data_ctr += 1
-
-            if u'[]' in param.get(u'type'):
-                value = list(value)
-
-            decoded_inputs[param.get(u'name')] = value
-
-        return {
-            u'name': event.get(u'name'),
-            u'data': decoded_inputs,
-            u'txid': log[u'transactionHash']
-        }
+        return compiled_event.decode(log)
 
     def decode_many(self, logs):
+        compiled_events = self.compiled_events
         result = []
         for log in logs:
-            sub_result = self.decode(log)
-            if sub_result is not None:
-                result.append(sub_result)
+            compiled_event = compiled_events.get(log[u'topics'][0])
+            if compiled_event is None:
+                logger.error("UNKNOWN EVENT TOPIC: {}\n{}".format(
+                    log[u'topics'][0], self.events))
+                continue
+            result.append(compiled_event.decode(log))
         return result
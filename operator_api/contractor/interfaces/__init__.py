@@ -1,3 +1,6 @@
+from .running_state_buffer import RunningStateBuffer
 from .local_view_interface import LocalViewInterface
+from .eon_clock import EonClock
+from .nonce_allocator import NonceAllocator
 from .ethereum_interface import EthereumInterface
 from .nocust_contract_interface import NOCUSTContractInterface
@@ -0,0 +1,30 @@
+from .local_view_interface import LocalViewInterface
+
+
+# Block and eon arithmetic over the contract parameters cached by LocalViewInterface,
+# so converting a block to its eon never touches the database once the parameters are loaded
+class EonClock:
+    @staticmethod
+    def eon_number_and_sub_block(block_number) -> (int, int):
+        parameters = LocalViewInterface.get_contract_parameters()
+        if not parameters:
+            return 0, 0
+
+        blocks_passed = block_number - parameters.genesis_block
+        return blocks_passed // parameters.blocks_per_eon + 1, blocks_passed % parameters.blocks_per_eon
+
+    @staticmethod
+    def eon_number(block_number) -> int:
+        return EonClock.eon_number_and_sub_block(block_number)[0]
+
+    @staticmethod
+    def sub_block(block_number) -> int:
+        return EonClock.eon_number_and_sub_block(block_number)[1]
+
+    # blocks [first, end) of an eon
+    @staticmethod
+    def eon_block_range(eon_number) -> (int, int):
+        parameters = LocalViewInterface.get_contract_parameters()
+        first_block = parameters.genesis_block + \
+            (eon_number - 1) * parameters.blocks_per_eon
+        return first_block, first_block + parameters.blocks_per_eon
@@ -1,7 +1,6 @@
 import logging
 
-from multiprocessing.pool import Pool
-from celery.utils.log import get_task_logger, current_process
+from celery.utils.log import get_task_logger
 from django.conf import settings
 from web3 import Web3, HTTPProvider
 from web3.middleware import geth_poa_middleware
@@ -10,11 +9,10 @@ logger = get_task_logger(__name__)
 logger.setLevel(logging.INFO)
 
 
-def get_transaction_receipt(txid):
-    return EthereumInterface().get_transaction_receipt(txid)
-
-
 class EthereumInterface:
+    # size of the next eth_getLogs range, shrunk when the node refuses a range and grown back on success
+    log_range_size = settings.HUB_MAX_LOG_RANGE
+
     def __init__(self):
         self.web3 = Web3(HTTPProvider(settings.HUB_ETHEREUM_NODE_URL))
         if settings.HUB_ETHEREUM_NETWORK_IS_POA:
@@ -38,34 +36,46 @@ class EthereumInterface:
     def get_transaction_receipt_hex(self, transaction_hash):
         return self.web3.eth.getTransactionReceipt(transaction_hash)
 
-    def get_logs(self, block):
-        result = []
-        if block and block.get(u'hash'):
-            for txid in block.get(u'transactions'):
-                receipt = self.get_transaction_receipt(txid)
-                if receipt is None:
-                    logger.error('No receipt for txid {}'.format(txid))
-                elif receipt.get(u'logs'):
-                    result.extend(receipt.get(u'logs'))
-        return result
-
-    def concurrently_get_logs(self, block):
+    # all logs of a block with a single eth_getLogs call, dropping any log of a competing block
+    def get_logs(self, block, address=None):
+        if not block or not block.get(u'hash'):
+            return []
+        logs = self.get_logs_in_range(
+            block.get(u'number'), block.get(u'number'), address=address)
+        return [log for log in logs if log.get(u'blockHash') == block.get(u'hash')]
+
+    def get_logs_in_range(self, from_block, to_block, address=None, topics=None):
+        filter_params = {
+            'fromBlock': from_block,
+            'toBlock': to_block,
+        }
+        if address is not None:
+            filter_params['address'] = address
+        if topics is not None:
+            filter_params['topics'] = topics
+        return self.web3.eth.getLogs(filter_params)
+
+    def get_logs_adaptively(self, from_block, to_block, address=None, topics=None):
         result = []
-        if block and block.get(u'hash'):
-            logger.info('Retrieving receipts in parallel')
-
-            # TODO remove this hack when celery/billiard comes to its senses..
-            old_val = current_process()._config.get('daemon')
-            current_process()._config['daemon'] = False
-            with Pool(processes=10) as p:
-                receipts = p.map(get_transaction_receipt,
-                                 block.get(u'transactions'))
-            logger.info('{} receipts retrieved.'.format(len(receipts)))
-            current_process()._config['daemon'] = old_val
-
-            for receipt in receipts:
-                if receipt.get(u'logs'):
-                    result.extend(receipt.get(u'logs'))
+        start = from_block
+        while start <= to_block:
+            end = min(start + EthereumInterface.log_range_size - 1, to_block)
+            try:
+                logs = self.get_logs_in_range(start, end, address, topics)
+            except ValueError as e:
+                # nodes answer ranges with too many results with an rpc error
+                if end == start:
+                    raise
+                EthereumInterface.log_range_size = max(
+                    1, (end - start + 1) // 2)
+                logger.warning('Log range [{},{}] refused, retrying with {} blocks: {}'.format(
+                    start, end, EthereumInterface.log_range_size, e))
+                continue
+
+            result.extend(logs)
+            start = end + 1
+            EthereumInterface.log_range_size = min(
+                2 * EthereumInterface.log_range_size, settings.HUB_MAX_LOG_RANGE)
         return result
 
     def send_raw_transaction(self, transaction):
@@ -0,0 +1,154 @@
+import asyncio
+import itertools
+import threading
+import requests
+from django.conf import settings
+from eth_abi import decode_abi
+from eth_utils import decode_hex
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+
+class JSONRPCError(ValueError):
+    pass
+
+
+# posts json-rpc payloads to the ethereum node, keeping the connection alive between batches
+class HTTPJSONRPCTransport(object):
+    def __init__(self, endpoint_uri=None, timeout=None):
+        self.endpoint_uri = endpoint_uri or settings.HUB_ETHEREUM_NODE_URL
+        self.timeout = timeout or settings.HUB_BLOCK_FETCH_TIMEOUT
+        self.session = requests.Session()
+
+    def __call__(self, payload):
+        response = self.session.post(
+            self.endpoint_uri, json=payload, timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+
+# posts json-rpc payloads from an asyncio event loop running in a background thread
+# all requests share one aiohttp session, so connections to the node are pooled
+class AsyncJSONRPCTransport(object):
+    def __init__(self, endpoint_uri=None, timeout=None, connections=100):
+        self.endpoint_uri = endpoint_uri or settings.HUB_ETHEREUM_NODE_URL
+        self.timeout = timeout or settings.HUB_BLOCK_FETCH_TIMEOUT
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+        self.session = asyncio.run_coroutine_threadsafe(
+            self.create_session(connections), self.loop).result()
+
+    @staticmethod
+    def is_available():
+        return aiohttp is not None
+
+    async def create_session(self, connections):
+        return aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=connections),
+            timeout=aiohttp.ClientTimeout(total=self.timeout))
+
+    async def post(self, payload):
+        async with self.session.post(self.endpoint_uri, json=payload) as response:
+            response.raise_for_status()
+            return await response.json()
+
+    # returns a concurrent.futures.Future of the decoded response
+    def submit(self, payload):
+        return asyncio.run_coroutine_threadsafe(self.post(payload), self.loop)
+
+    def __call__(self, payload):
+        return self.submit(payload).result()
+
+
+# answers json-rpc payloads locally from a map of method name to handler(params)
+# stands in for the ethereum node where no node can be reached, e.g. in tests and benchmarks.
+# batches over max_batch_size are refused with a single error, as nodes do
+class FakeJSONRPCTransport(object):
+    def __init__(self, handlers, max_batch_size=None):
+        self.handlers = handlers
+        self.max_batch_size = max_batch_size
+        self.requests = 0
+        self.round_trips = 0
+
+    def respond(self, request):
+        self.requests += 1
+        handler = self.handlers.get(request.get('method'))
+        if handler is None:
+            return {'jsonrpc': '2.0', 'id': request.get('id'),
+                    'error': {'code': -32601, 'message': 'Method not found'}}
+        try:
+            return {'jsonrpc': '2.0', 'id': request.get('id'), 'result': handler(request.get('params'))}
+        except Exception as exception:
+            return {'jsonrpc': '2.0', 'id': request.get('id'),
+                    'error': {'code': -32000, 'message': str(exception)}}
+
+    def __call__(self, payload):
+        self.round_trips += 1
+        if isinstance(payload, list) and self.max_batch_size is not None and len(payload) > self.max_batch_size:
+            return {'jsonrpc': '2.0', 'id': None,
+                    'error': {'code': -32600, 'message': 'Batch too large'}}
+        if isinstance(payload, list):
+            return [self.respond(request) for request in payload]
+        return self.respond(payload)
+
+
+# several json-rpc requests sent to the node in a single round trip
+# results come back in the order the requests were added, failed requests as JSONRPCError instances
+class JSONRPCBatch(object):
+    request_ids = itertools.count(1)
+
+    def __init__(self, transport=None):
+        self.transport = transport or HTTPJSONRPCTransport()
+        self.requests = []
+        self.decoders = []
+
+    def add(self, method, params, decoder=None):
+        self.requests.append({
+            'jsonrpc': '2.0',
+            'id': next(JSONRPCBatch.request_ids),
+            'method': method,
+            'params': params,
+        })
+        self.decoders.append(decoder)
+
+    def eth_call(self, to, data, output_types, block_identifier='latest'):
+        if isinstance(block_identifier, int):
+            block_identifier = hex(block_identifier)
+        self.add(
+            'eth_call',
+            [{'to': to, 'data': data}, block_identifier],
+            decoder=lambda result: decode_abi(output_types, decode_hex(result)))
+
+    def execute(self):
+        if not self.requests:
+            return []
+        return self.results(self.transport(self.requests))
+
+    # matches the responses to a posted batch with its requests, for callers that post the requests themselves
+    def results(self, responses):
+        # a node refusing the whole batch, e.g. over-sized or rate limited, answers with a single error
+        if isinstance(responses, dict):
+            responses = {request.get('id'): {'error': responses.get('error')} for request in self.requests}
+        else:
+            responses = {response.get('id'): response for response in responses}
+
+        results = []
+        for request, decoder in zip(self.requests, self.decoders):
+            response = responses.get(request.get('id'))
+            if response is None:
+                results.append(JSONRPCError('No response to {}'.format(request.get('method'))))
+            elif 'error' in response:
+                results.append(JSONRPCError(response.get('error')))
+            else:
+                try:
+                    results.append(decoder(response.get('result')) if decoder else response.get('result'))
+                except Exception as exception:
+                    results.append(JSONRPCError(str(exception)))
+
+        self.requests = []
+        self.decoders = []
+        return results
@@ -1,8 +1,57 @@
+import uuid
 from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
 from contractor.models import ContractParameters, ContractState
+from .running_state_buffer import RunningStateBuffer
 
+CONTRACT_STATE_VERSION_KEY = 'contract_state_version'
+# cached views outlive their version only until it changes, the timeout just bounds stale redis keys
+CONTRACT_STATE_VIEW_TIMEOUT = 60 * 60
 
+
+# Views of the latest and confirmed contract states are cached per version of the stored states,
+# in this process and in redis. The version is replaced whenever chain synchronization saves a block.
 class LocalViewInterface:
+    # CACHED VIEWS
+    cached_version = None
+    cached_views = {}
+
+    @staticmethod
+    def contract_state_version():
+        version = cache.get(CONTRACT_STATE_VERSION_KEY)
+        if version is None:
+            cache.add(CONTRACT_STATE_VERSION_KEY,
+                      uuid.uuid4().hex, timeout=None)
+            version = cache.get(CONTRACT_STATE_VERSION_KEY)
+        return version
+
+    # called once contract states were written, after the surrounding transaction commits
+    @staticmethod
+    def invalidate():
+        transaction.on_commit(lambda: cache.set(
+            CONTRACT_STATE_VERSION_KEY, uuid.uuid4().hex, timeout=None))
+
+    @staticmethod
+    def cached_view(name, query):
+        version = LocalViewInterface.contract_state_version()
+        if version != LocalViewInterface.cached_version:
+            LocalViewInterface.cached_version = version
+            LocalViewInterface.cached_views = {}
+
+        if name in LocalViewInterface.cached_views:
+            return LocalViewInterface.cached_views.get(name)
+
+        key = 'contract_state_view_{}_{}'.format(version, name)
+        view = cache.get(key)
+        if view is None:
+            # a missing state is cached as well, (None,) tells it apart from a cache miss
+            view = (query(),)
+            cache.set(key, view, timeout=CONTRACT_STATE_VIEW_TIMEOUT)
+
+        LocalViewInterface.cached_views[name] = view[0]
+        return view[0]
+
     # CONTRACT PARAMETERS
     contract_parameters: ContractParameters = None
     @staticmethod
@@ -23,7 +72,17 @@ class LocalViewInterface:
     # LATEST STATE
     @staticmethod
     def latest() -> ContractState:
-        return ContractState.objects.order_by('block').last()
+        return LocalViewInterface.cached_view(
+            'latest',
+            LocalViewInterface.query_latest)
+
+    @staticmethod
+    def query_latest() -> ContractState:
+        stored = ContractState.objects.order_by('block').last()
+        running = RunningStateBuffer().running()
+        if running is None or stored is not None and stored.block >= running.block:
+            return stored
+        return running
 
     @staticmethod
     def latest_block() -> int:
@@ -34,25 +93,32 @@ class LocalViewInterface:
 
     @staticmethod
     def latest_sub_block() -> (int, int):
-        blocks_per_eon = LocalViewInterface.get_contract_parameters().blocks_per_eon
-        blocks_passed = LocalViewInterface.latest_block() - LocalViewInterface.genesis_block()
-
-        return blocks_passed // blocks_per_eon + 1, blocks_passed % blocks_per_eon
+        from .eon_clock import EonClock
+        return EonClock.eon_number_and_sub_block(LocalViewInterface.latest_block())
 
     # LATEST CONFIRMED STATE
     @staticmethod
     def confirmed(eon_number=None) -> ContractState:
         if eon_number is not None:
-            blocks_passed_upper = LocalViewInterface.genesis_block()\
-                + eon_number * LocalViewInterface.get_contract_parameters().blocks_per_eon
-            blocks_passed_lower = blocks_passed_upper\
-                - LocalViewInterface.get_contract_parameters().blocks_per_eon
+            return LocalViewInterface.cached_view(
+                'confirmed_{}'.format(eon_number),
+                lambda: LocalViewInterface.query_confirmed(eon_number))
+        else:
+            return LocalViewInterface.cached_view(
+                'confirmed',
+                LocalViewInterface.query_confirmed)
+
+    @staticmethod
+    def query_confirmed(eon_number=None) -> ContractState:
+        if eon_number is not None:
+            from .eon_clock import EonClock
+            eon_first_block, eon_end_block = EonClock.eon_block_range(eon_number)
 
             return ContractState.objects\
                 .filter(
                     confirmed=True,
-                    block__gte=blocks_passed_lower,
-                    block__lt=blocks_passed_upper)\
+                    block__gte=eon_first_block,
+                    block__lt=eon_end_block)\
                 .order_by('block')\
                 .last()
         else:
@@ -72,7 +138,10 @@ class LocalViewInterface:
     # FETCHED
     @staticmethod
     def running(block_number) -> ContractState:
-        return ContractState.objects.filter(block=block_number).first()
+        running = RunningStateBuffer().running(block_number)
+        if running is None:
+            return ContractState.objects.filter(block=block_number).first()
+        return running
 
     @staticmethod
     def running_block(block_number):
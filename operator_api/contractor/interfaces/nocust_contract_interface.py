@@ -3,14 +3,18 @@ import traceback
 import time
 
 from django.conf import settings
-from django.db.models import Max
+from django.db import transaction as db_transaction
 from eth_utils import add_0x_prefix, remove_0x_prefix, decode_hex
 from contractor.abi import load_abi
-from contractor.interfaces import LocalViewInterface
-from contractor.models import ChallengeEntry, ContractState, EthereumTransaction, ContractLedgerState
+from contractor.decoders import NOCUSTContractEventDecoder
+from contractor.interfaces import LocalViewInterface, EonClock
+from contractor.models import ChallengeEntry, ContractState, EthereumTransaction, ContractLedgerState, InFlightTransaction
 from operator_api.crypto import same_hex_value
+from operator_api.email import send_admin_email
 from ledger.models import WithdrawalRequest, Challenge, Token, RootCommitment
 from .ethereum_interface import EthereumInterface
+from .json_rpc_batch import JSONRPCBatch, HTTPJSONRPCTransport
+from .nonce_allocator import NonceAllocator
 from celery.utils.log import get_task_logger
 from operator_api import crypto
 
@@ -21,46 +25,68 @@ nocust_contract_abi = load_abi('NOCUSTCommitChain.json')
 token_contract_abi = load_abi('ERC20.json')
 
 
+def function_output_types(abi, name):
+    function = next(entry for entry in abi if entry.get(
+        'type') == 'function' and entry.get('name') == name)
+    return [output.get('type') for output in function.get('outputs')]
+
+
+contract_state_variables_types = function_output_types(
+    nocust_contract_abi, 'getServerContractStateVariables')
+contract_ledger_state_variables_types = function_output_types(
+    nocust_contract_abi, 'getServerContractLedgerStateVariables')
+challenge_record_types = function_output_types(
+    nocust_contract_abi, 'getChallenge')
+
+
+# checkpoints and challenge answers are only accepted during their eon
+def eon_deadline_block(eon_number):
+    return EonClock.eon_block_range(eon_number)[1] - 1
+
+
+def decode_transaction_receipt(receipt):
+    if receipt is None or receipt.get('blockNumber') is None:
+        return None
+    return dict(receipt, blockNumber=int(receipt.get('blockNumber'), 16))
+
+
 # class NOCUSTInterface(EthereumInterface, metaclass=Singleton):
 class NOCUSTContractInterface(EthereumInterface):
-    def __init__(self):
+    def __init__(self, rpc_transport=None):
         super(NOCUSTContractInterface, self).__init__()
         self.contract = self.web3.eth.contract(
             address=settings.HUB_LQD_CONTRACT_ADDRESS,
             abi=nocust_contract_abi)
+        # used for batched json-rpc requests, one keep-alive connection to the node by default
+        self.rpc_transport = rpc_transport or HTTPJSONRPCTransport()
+        self._chain_id = None
         self.web3.eth.defaultAccount = settings.HUB_OWNER_ACCOUNT_ADDRESS
         # self.web3.eth.enable_unaudited_features()
 
-    def queue_transaction_by_owner(self, transaction, tag):
-        latest_remote_nonce = self.web3.eth.getTransactionCount(
-            settings.HUB_OWNER_ACCOUNT_ADDRESS)
-        with EthereumTransaction.global_lock():
-            latest_local_nonce = 0
-            if EthereumTransaction.objects\
-                    .filter(from_address=remove_0x_prefix(settings.HUB_OWNER_ACCOUNT_ADDRESS))\
-                    .exists():
-                latest_local_nonce = EthereumTransaction.objects \
-                    .filter(from_address=remove_0x_prefix(settings.HUB_OWNER_ACCOUNT_ADDRESS)) \
-                    .aggregate(Max('nonce')) \
-                    .get('nonce__max') + 1
-
-            transaction_nonce = max(
-                latest_remote_nonce,
-                latest_local_nonce)
+    def chain_id(self):
+        if self._chain_id is None:
+            self._chain_id = self.web3.net.version
+        return self._chain_id
+
+    # deadline_block is the last block the transaction is of use in, the scheduler prices gas by it
+    def queue_transaction_by_owner(self, transaction, tag, deadline_block=None):
+        transaction_dictionary = transaction.buildTransaction({
+            'chainId': self.chain_id(),
+            'from': settings.HUB_OWNER_ACCOUNT_ADDRESS,
+            'gas': 5000000,
+            'gasPrice': self.web3.toWei('5', 'gwei'),
+            'nonce': 0
+        })
+
+        # the nonce is allocated in the database transaction storing it, and in any transaction of the caller,
+        # a nonce rolled back with them is reused or filled by the next reconciliation
+        with db_transaction.atomic():
+            transaction_nonce = NonceAllocator().allocate(
+                remote_nonce=lambda: self.web3.eth.getTransactionCount(settings.HUB_OWNER_ACCOUNT_ADDRESS))
 
             logger.info('Queuing TX #{}'.format(transaction_nonce))
 
-
-
-            transaction_dictionary = transaction.buildTransaction({
-                'chainId': self.web3.net.version,
-                'from': settings.HUB_OWNER_ACCOUNT_ADDRESS,
-                'gas': 5000000,
-                'gasPrice': self.web3.toWei('5', 'gwei'),
-                'nonce': transaction_nonce
-            })
-
-            return EthereumTransaction.objects.create(
+            ethereum_transaction = EthereumTransaction.objects.create(
                 chain_id=transaction_dictionary.get('chainId'),
                 from_address=remove_0x_prefix(
                     settings.HUB_OWNER_ACCOUNT_ADDRESS),
@@ -68,8 +94,13 @@ class NOCUSTContractInterface(EthereumInterface):
                 gas=transaction_dictionary.get('gas'),
                 data=remove_0x_prefix(transaction_dictionary.get('data')),
                 value=transaction_dictionary.get('value'),
-                nonce=transaction_dictionary.get('nonce'),
+                nonce=transaction_nonce,
                 tag=tag)
+            InFlightTransaction.objects.create(
+                transaction=ethereum_transaction,
+                queued_block=LocalViewInterface.latest_block(),
+                deadline_block=deadline_block)
+        return ethereum_transaction
 
     def sign_for_delivery_as_owner(self, transaction: EthereumTransaction, gas_price: int):
         transaction_dictionary = {
@@ -96,9 +127,16 @@ class NOCUSTContractInterface(EthereumInterface):
     #     signed_txn = self.web3.eth.account.signTransaction(txn, private_key=settings.HUB_OWNER_ACCOUNT_KEY)
     #     return self.send_raw_transaction(signed_txn.rawTransaction)
 
-    def get_logs(self, block):
-        logs = super(NOCUSTContractInterface, self).get_logs(block)
-        return [log for log in logs if log.get(u'address').lower() == settings.HUB_LQD_CONTRACT_ADDRESS.lower()]
+    def get_logs(self, block, address=None):
+        return super(NOCUSTContractInterface, self).get_logs(block, address=self.contract.address)
+
+    # contract event logs of a block range, restricted to the events the decoder knows about
+    def get_contract_logs(self, from_block, to_block):
+        return self.get_logs_adaptively(
+            from_block,
+            to_block,
+            address=self.contract.address,
+            topics=[list(NOCUSTContractEventDecoder().events.keys())])
 
     def get_last_checkpoint_submission_eon(self, block_identifier='latest'):
         return self.contract \
@@ -126,7 +164,8 @@ class NOCUSTContractInterface(EthereumInterface):
             transaction=self.contract.functions.submitCheckpoint(
                 decode_hex(checkpoint.basis),
                 decode_hex(checkpoint.merkle_root)),
-            tag=checkpoint.tag())
+            tag=checkpoint.tag(),
+            deadline_block=eon_deadline_block(checkpoint.eon_number))
 
     def get_has_missed_checkpoint_submission(self, block_identifier='latest'):
         return self.contract\
@@ -423,7 +462,8 @@ class NOCUSTContractInterface(EthereumInterface):
                     passive_checksum
                 ],
                 v),
-            tag=challenge.tag(0))
+            tag=challenge.tag(0),
+            deadline_block=eon_deadline_block(challenge.eon_number))
 
     def queue_answer_delivery_challenge(self, challenge: Challenge, tx_trail, allotment_chain, membership_chain, values, l_r, deltas, tx_set_root, tx_chain, passive_checksum, passive_amount, passive_marker):
         return self.queue_transaction_by_owner(
@@ -445,7 +485,8 @@ class NOCUSTContractInterface(EthereumInterface):
                     passive_checksum
                 ],
                 tx_chain),
-            tag=challenge.tag(tx_trail))
+            tag=challenge.tag(tx_trail),
+            deadline_block=eon_deadline_block(challenge.eon_number))
 
     def queue_answer_swap_challenge(self, challenge: Challenge, token_pair, balance_at_start_of_eon, tx_trail, allotment_chain, membership_chain, values, l_r, deltas, tx_set_root, tx_chain, passive_checksum, passive_amount, passive_marker):
         return self.queue_transaction_by_owner(
@@ -472,7 +513,8 @@ class NOCUSTContractInterface(EthereumInterface):
                     crypto.uint256(0)  # always zero
                 ]
             ),
-            tag=challenge.tag(tx_trail))
+            tag=challenge.tag(tx_trail),
+            deadline_block=eon_deadline_block(challenge.eon_number))
 
     # queue a transaction to slash withdrawals for a wallet-token pair
     # tag used to track transaction
@@ -525,6 +567,32 @@ class NOCUSTContractInterface(EthereumInterface):
             .call(block_identifier=block_identifier)
         return ChallengeEntry(on_chain_record)
 
+    # receipts of many transactions in a single json-rpc batch, None for transactions not yet mined
+    # failed reads are returned as JSONRPCError instances
+    def get_transaction_receipts(self, transaction_hashes):
+        batch = JSONRPCBatch(self.rpc_transport)
+        for transaction_hash in transaction_hashes:
+            batch.add(
+                'eth_getTransactionReceipt',
+                [add_0x_prefix(transaction_hash)],
+                decoder=decode_transaction_receipt)
+        return batch.execute()
+
+    # records of many challenges read in a single json-rpc batch, keyed by (token address, recipient, sender)
+    # failed reads are returned as JSONRPCError instances
+    def get_challenge_records(self, keys, block_identifier='latest'):
+        batch = JSONRPCBatch(self.rpc_transport)
+        for token_address, recipient, sender in keys:
+            batch.eth_call(
+                to=self.contract.address,
+                data=self.contract.encodeABI(
+                    fn_name='getChallenge',
+                    args=[add_0x_prefix(token_address), add_0x_prefix(sender), add_0x_prefix(recipient)]),
+                output_types=challenge_record_types,
+                block_identifier=block_identifier)
+        return [result if isinstance(result, Exception) else ChallengeEntry(result)
+                for result in batch.execute()]
+
     def get_blocks_per_eon(self, block_identifier='latest'):
         return self.contract\
             .functions\
@@ -581,16 +649,43 @@ class NOCUSTContractInterface(EthereumInterface):
                 v)\
             .call(block_identifier=block_identifier)
 
+    # contract state and the ledger state of every token at a block, read with one json-rpc batch
     def fetch_contract_state_at_block(self, block_number):
+        batch, tokens = self.contract_state_batch(block_number)
+        return self.contract_state_from_results(block_number, tokens, batch.execute())
+
+    # queues the eth_calls of a contract state snapshot, the batch can be executed by the caller
+    def contract_state_batch(self, block_number):
+        current_eon = EonClock.eon_number(block_number)
+        tokens = [token for token in Token.objects.all()
+                  if token.block < block_number]
+
+        batch = JSONRPCBatch(self.rpc_transport)
+        batch.eth_call(
+            to=self.contract.address,
+            data=self.contract.encodeABI(
+                fn_name='getServerContractStateVariables'),
+            output_types=contract_state_variables_types,
+            block_identifier=block_number)
+        for token in tokens:
+            batch.eth_call(
+                to=self.contract.address,
+                data=self.contract.encodeABI(
+                    fn_name='getServerContractLedgerStateVariables',
+                    args=[current_eon, add_0x_prefix(token.address)]),
+                output_types=contract_ledger_state_variables_types,
+                block_identifier=block_number)
+
+        # the block header links the snapshot to its parent, the synchronizer checks reorganizations with it
+        batch.add('eth_getBlockByNumber', [hex(block_number), False])
+
+        return batch, tokens
+
+    def contract_state_from_results(self, block_number, tokens, results):
         try:
-            local_params = LocalViewInterface.get_contract_parameters()
-            current_eon = 1 + \
-                (block_number - local_params.genesis_block) // local_params.blocks_per_eon
-
-            contract_state_variables = self.contract\
-                .functions\
-                .getServerContractStateVariables()\
-                .call(block_identifier=block_number)
+            contract_state_variables, *contract_ledger_state_variables, block_header = results
+            if isinstance(contract_state_variables, Exception):
+                raise contract_state_variables
 
             basis = contract_state_variables[0]
             last_checkpoint_submission_eon = contract_state_variables[1]
@@ -614,39 +709,42 @@ class NOCUSTContractInterface(EthereumInterface):
             is_checkpoint_submitted_for_current_eon=is_checkpoint_submitted_for_current_eon,
             has_missed_checkpoint_submission=has_missed_checkpoint_submission,
             live_challenge_count=live_challenge_count)
+        contract_state.block_hash, contract_state.parent_hash = None, None
+        contract_state.transaction_hashes = []
+        if isinstance(block_header, dict):
+            contract_state.block_hash = block_header.get('hash')
+            contract_state.parent_hash = block_header.get('parentHash')
+            # the header lists the hashes of the block's transactions, the receipt watcher matches them
+            contract_state.transaction_hashes = block_header.get(
+                'transactions', [])
+        else:
+            logger.error('Could not query header of block {}: {}'.format(
+                block_number, block_header))
 
         contract_ledger_states = []
-        for token in Token.objects.all():
-            if token.block >= block_number:
-                continue
-
-            try:
-                contract_state_ledger_variables = self.contract\
-                    .functions\
-                    .getServerContractLedgerStateVariables(current_eon, add_0x_prefix(token.address))\
-                    .call(block_identifier=block_number)
-
-                pending_withdrawals = contract_state_ledger_variables[0]
-                confirmed_withdrawals = contract_state_ledger_variables[1]
-                deposits = contract_state_ledger_variables[2]
-                total_balance = contract_state_ledger_variables[3]
-
-                contract_ledger_states.append(ContractLedgerState(
-                    token=token,
-                    pending_withdrawals=pending_withdrawals,
-                    confirmed_withdrawals=confirmed_withdrawals,
-                    deposits=deposits,
-                    total_balance=total_balance))
-            except Exception as exception:
-                traceback.print_exc()
+        for token, contract_state_ledger_variables in zip(tokens, contract_ledger_state_variables):
+            if isinstance(contract_state_ledger_variables, Exception):
                 logger.error('Could not query contract ledger state for {}: {}'.format(
-                    token.address, str(exception)))
+                    token.address, str(contract_state_ledger_variables)))
                 contract_ledger_states.append(ContractLedgerState(
                     token=token,
                     pending_withdrawals=0,
                     confirmed_withdrawals=0,
                     deposits=0,
                     total_balance=0))
+                continue
+
+            pending_withdrawals = contract_state_ledger_variables[0]
+            confirmed_withdrawals = contract_state_ledger_variables[1]
+            deposits = contract_state_ledger_variables[2]
+            total_balance = contract_state_ledger_variables[3]
+
+            contract_ledger_states.append(ContractLedgerState(
+                token=token,
+                pending_withdrawals=pending_withdrawals,
+                confirmed_withdrawals=confirmed_withdrawals,
+                deposits=deposits,
+                total_balance=total_balance))
 
         return contract_state, contract_ledger_states
 
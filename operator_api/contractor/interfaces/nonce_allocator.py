@@ -0,0 +1,104 @@
+import logging
+from celery.utils.log import get_task_logger
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Max
+from eth_utils import remove_0x_prefix
+from contractor.models import EthereumTransaction, InFlightTransaction
+from .local_view_interface import LocalViewInterface
+from operator_api.models.mutex_model import strict_redis_client
+
+logger = get_task_logger(__name__)
+logger.setLevel(logging.INFO)
+
+# raises the counter to a floor, never lowers it
+RAISE_NONCE_SCRIPT = """
+local current = tonumber(redis.call('GET', KEYS[1]) or '-1')
+local floor = tonumber(ARGV[1])
+if floor > current then
+    redis.call('SET', KEYS[1], floor)
+    return floor
+end
+return current
+"""
+
+
+# Hands out the nonces of an account from a redis counter holding its next free nonce, so queueing
+# a transaction takes no rpc call and no scan of the queued transactions. The counter is raised to
+# the nonces the chain and the database already account for when it is missing.
+#
+# A nonce is allocated inside the database transaction storing its transaction, which holds a shared
+# advisory lock of the account until it ends. When reconcile can take that lock exclusively no nonce
+# is being stored, so every allocated nonce without a row was rolled back: the counter is reset to the
+# nonces accounted for, and rolled back nonces below stored ones are filled with empty transactions.
+class NonceAllocator(object):
+    def __init__(self, address=None, redis_client=None):
+        self.address = remove_0x_prefix(
+            address or settings.HUB_OWNER_ACCOUNT_ADDRESS)
+        self.redis = redis_client or strict_redis_client
+        self.key = 'next_nonce_{}'.format(self.address.lower())
+        self.lock_key = int(self.address.lower()[:15], 16)
+        self.raise_nonce = self.redis.register_script(RAISE_NONCE_SCRIPT)
+
+    def local_floor(self):
+        latest_local_nonce = EthereumTransaction.objects\
+            .filter(from_address=self.address)\
+            .aggregate(Max('nonce'))\
+            .get('nonce__max')
+        return 0 if latest_local_nonce is None else latest_local_nonce + 1
+
+    # remote_nonce is the transaction count of the account on chain
+    def raise_to_floor(self, remote_nonce):
+        next_nonce = self.raise_nonce(
+            keys=[self.key], args=[max(remote_nonce, self.local_floor())])
+        return int(next_nonce)
+
+    def reconcile(self, remote_nonce):
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT pg_try_advisory_xact_lock(%s)', [self.lock_key])
+                idle = cursor.fetchone()[0]
+            if not idle:
+                logger.info('Nonces of {} being allocated, not resetting.'.format(self.address))
+                return self.raise_to_floor(remote_nonce)
+
+            local_floor = self.local_floor()
+            stored_nonces = set(EthereumTransaction.objects
+                                .filter(from_address=self.address, nonce__gte=remote_nonce, nonce__lt=local_floor)
+                                .values_list('nonce', flat=True))
+            for nonce in range(remote_nonce, local_floor):
+                if nonce not in stored_nonces:
+                    self.fill_gap(nonce)
+
+            next_nonce = max(remote_nonce, local_floor)
+            self.redis.set(self.key, next_nonce)
+            return next_nonce
+
+    # an empty transfer to the account itself, so the transactions after a rolled back nonce can be mined
+    def fill_gap(self, nonce):
+        logger.warning('Filling rolled back nonce {} of {}.'.format(nonce, self.address))
+        ethereum_transaction = EthereumTransaction.objects.create(
+            chain_id=EthereumTransaction.objects.filter(from_address=self.address).first().chain_id,
+            from_address=self.address,
+            to_address=self.address,
+            gas=21000,
+            data='00',
+            value=0,
+            nonce=nonce,
+            tag='nonce_gap_{}'.format(nonce))
+        InFlightTransaction.objects.create(
+            transaction=ethereum_transaction,
+            queued_block=LocalViewInterface.latest_block())
+
+    def peek(self):
+        next_nonce = self.redis.get(self.key)
+        return int(next_nonce) if next_nonce is not None else None
+
+    # remote_nonce is a callable, only asked for the on-chain count when the counter is missing.
+    # must be called inside the database transaction storing the transaction of the nonce
+    def allocate(self, remote_nonce):
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_advisory_xact_lock_shared(%s)', [self.lock_key])
+        if not self.redis.exists(self.key):
+            self.raise_to_floor(remote_nonce())
+        return self.redis.incr(self.key) - 1
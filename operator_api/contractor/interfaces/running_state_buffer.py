@@ -0,0 +1,123 @@
+import json
+import logging
+from celery.utils.log import get_task_logger
+from django.conf import settings
+from contractor.models import ContractState, ContractLedgerState
+from operator_api.models.mutex_model import strict_redis_client
+
+logger = get_task_logger(__name__)
+logger.setLevel(logging.INFO)
+
+RUNNING_STATES_KEY = 'running_states'
+RUNNING_STATE_BLOCKS_KEY = 'running_state_blocks'
+CONFIRMED_HEAD_KEY = 'confirmed_state_head'
+
+
+# Unconfirmed contract states of the most recent blocks, kept in redis instead of the database.
+# Entries are stored by block hash and linked to their parent hash, so a block that does not extend
+# the buffered chain is detected as a reorganization and the stale fork is dropped.
+# Only confirmed states are written to the database, see commit_block.
+class RunningStateBuffer(object):
+    def __init__(self, redis_client=None, size=None):
+        self.redis = redis_client or strict_redis_client
+        self.size = size or settings.HUB_RUNNING_STATE_BUFFER_SIZE
+
+    def hashes_at(self, block_number, until_block_number=None):
+        return [block_hash.decode() for block_hash in self.redis.zrangebyscore(
+            RUNNING_STATE_BLOCKS_KEY,
+            block_number,
+            block_number if until_block_number is None else until_block_number)]
+
+    def entry(self, block_hash):
+        entry = self.redis.hget(RUNNING_STATES_KEY, block_hash)
+        return json.loads(entry) if entry is not None else None
+
+    def remove(self, block_hashes):
+        if not block_hashes:
+            return
+        pipeline = self.redis.pipeline()
+        pipeline.zrem(RUNNING_STATE_BLOCKS_KEY, *block_hashes)
+        pipeline.hdel(RUNNING_STATES_KEY, *block_hashes)
+        pipeline.execute()
+
+    # returns False if the state replaced a fork of the buffered chain
+    def push(self, contract_state_dictionary, ledger_state_dictionaries):
+        block_number = contract_state_dictionary.get('block')
+        block_hash = contract_state_dictionary.get('block_hash')
+        parent_hash = contract_state_dictionary.get('parent_hash')
+
+        # blocks at or above this one were fetched from a chain this block replaces
+        self.remove(self.hashes_at(block_number, '+inf'))
+
+        # the fork may reach back to any buffered block, and the buffer only holds blocks past the
+        # confirmed head, so the whole buffer is dropped and refilled by the following runs
+        extends_chain = True
+        parent_hashes = self.hashes_at(block_number - 1)
+        if parent_hashes and parent_hash not in parent_hashes:
+            logger.warning('Running block {} {} does not extend buffered parents {}.'.format(
+                block_number, block_hash, parent_hashes))
+            self.remove(self.hashes_at('-inf', '+inf'))
+            extends_chain = False
+
+        pipeline = self.redis.pipeline()
+        pipeline.hset(RUNNING_STATES_KEY, block_hash, json.dumps({
+            'state': contract_state_dictionary,
+            'ledger_states': ledger_state_dictionaries,
+        }))
+        pipeline.zadd(RUNNING_STATE_BLOCKS_KEY, {block_hash: block_number})
+        pipeline.execute()
+
+        self.remove(self.hashes_at('-inf', '({}'.format(block_number - self.size + 1)))
+        return extends_chain
+
+    def running_state_dictionaries(self, block_number=None):
+        if block_number is None:
+            latest = self.redis.zrevrange(RUNNING_STATE_BLOCKS_KEY, 0, 0)
+            block_hashes = [block_hash.decode() for block_hash in latest]
+        else:
+            block_hashes = self.hashes_at(block_number)
+        if not block_hashes:
+            return None
+        return self.entry(block_hashes[-1])
+
+    # unsaved contract state of a buffered block, or of the latest buffered block
+    def running(self, block_number=None) -> ContractState:
+        entry = self.running_state_dictionaries(block_number)
+        if entry is None:
+            return None
+        return ContractState.from_dictionary_form(entry.get('state'))
+
+    def running_ledger_states(self, contract_state: ContractState) -> '[ContractLedgerState]':
+        entry = self.running_state_dictionaries(contract_state.block)
+        if entry is None:
+            return []
+        return [ContractLedgerState.from_dictionary_form(ledger_state, contract_state)
+                for ledger_state in entry.get('ledger_states')]
+
+    # confirmed blocks must extend the last confirmed block
+    def check_confirmed(self, contract_state_dictionary):
+        block_number = contract_state_dictionary.get('block')
+        block_hash = contract_state_dictionary.get('block_hash')
+        parent_hash = contract_state_dictionary.get('parent_hash')
+
+        head = self.redis.get(CONFIRMED_HEAD_KEY)
+        if head is not None:
+            head_block_number, head_hash = json.loads(head)
+            if head_block_number == block_number - 1 and parent_hash is not None and head_hash != parent_hash:
+                raise ValueError('Confirmed block {} {} does not extend confirmed block {} {}.'.format(
+                    block_number, block_hash, head_block_number, head_hash))
+
+        running_hashes = self.hashes_at(block_number)
+        if running_hashes and block_hash not in running_hashes:
+            logger.warning('Confirmed block {} {} replaced running block {}.'.format(
+                block_number, block_hash, running_hashes))
+
+    # confirmed blocks leave the buffer and become the confirmed head, once their state is stored
+    def confirm(self, contract_state_dictionary):
+        block_number = contract_state_dictionary.get('block')
+        block_hash = contract_state_dictionary.get('block_hash')
+
+        self.remove(self.hashes_at('-inf', block_number))
+        if block_hash is not None:
+            self.redis.set(CONFIRMED_HEAD_KEY, json.dumps(
+                [block_number, block_hash]))
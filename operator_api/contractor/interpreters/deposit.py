@@ -4,7 +4,7 @@ from operator_api.util import Singleton
 from ledger.models import Wallet, Deposit, BlacklistEntry
 from operator_api.crypto import remove_0x_prefix, hex_address
 from celery.utils.log import get_task_logger
-from .event import EventInterpreter
+from .event import EventInterpreter, wallets_by_token_and_address, wallet_locks
 from synchronizer.utils import send_notification, CONFIRMED_DEPOSIT
 from auditor.serializers import DepositSerializer
 
@@ -43,3 +43,44 @@ class DepositInterpreter(EventInterpreter, metaclass=Singleton):
                 data=DepositSerializer(
                     deposit, read_only=True).data
             )
+
+    # resolves the wallets of all deposits at once and inserts the deposits in bulk
+    def interpret_many(self, decoded_logs, block_number, eon_number, verbose=False):
+        wallets = wallets_by_token_and_address(
+            (hex_address(log.get('data').get(u'token')), hex_address(log.get('data').get(u'recipient')))
+            for log in decoded_logs)
+
+        deposits = []
+        for log in decoded_logs:
+            decoded_event = log.get('data')
+            wallet_address = hex_address(decoded_event.get(u'recipient'))
+            wallet = wallets.get(
+                (hex_address(decoded_event.get(u'token')).lower(), wallet_address.lower()))
+            if wallet is None:
+                logger.warning(
+                    "UNKNOWN WALLET PERFORMING DEPOSIT {}".format(wallet_address))
+                BlacklistEntry.objects.get_or_create(
+                    address=wallet_address)
+                continue
+
+            deposit = Deposit(
+                wallet=wallet,
+                amount=decoded_event.get(u'amount'),
+                eon_number=eon_number,
+                block=block_number,
+                txid=remove_0x_prefix(log.get('txid')))
+            deposit.full_clean(exclude=['wallet'])
+            deposits.append(deposit)
+
+        with wallet_locks([deposit.wallet for deposit in deposits]):
+            Deposit.objects.bulk_create(deposits, batch_size=500)
+
+        for deposit in deposits:
+            # send deposit added notification to sender
+            send_notification(
+                stream_prefix="wallet",
+                stream_id="{}/{}".format(deposit.wallet.token.address, deposit.wallet.address),
+                event_name=CONFIRMED_DEPOSIT,
+                data=DepositSerializer(
+                    deposit, read_only=True).data
+            )
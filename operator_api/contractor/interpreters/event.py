@@ -1,6 +1,9 @@
 from abc import ABCMeta, abstractmethod
 from celery.utils.log import get_task_logger
+from django.db.models.functions import Lower
 from hexbytes import HexBytes
+from ledger.models import Wallet
+from operator_api.models import MutexModel
 
 logger = get_task_logger(__name__)
 
@@ -11,3 +14,37 @@ class EventInterpreter(object):
     @abstractmethod
     def interpret(self, decoded_event, txid, block_number, eon_number, verbose=False):
         pass
+
+    # interprets the decoded logs of one event type in a block, in order
+    def interpret_many(self, decoded_logs, block_number, eon_number, verbose=False):
+        for log in decoded_logs:
+            self.interpret(
+                decoded_event=log.get('data'),
+                txid=log.get('txid'),
+                block_number=block_number,
+                eon_number=eon_number,
+                verbose=verbose)
+
+
+# wallets of many (token address, wallet address) pairs with a single query, keyed by the lowercase pair
+def wallets_by_token_and_address(pairs):
+    pairs = {(token_address.lower(), wallet_address.lower()) for token_address, wallet_address in pairs}
+    if not pairs:
+        return {}
+
+    wallets = Wallet.objects\
+        .select_related('token')\
+        .annotate(
+            address_lower=Lower('address'),
+            token_address_lower=Lower('token__address'))\
+        .filter(
+            address_lower__in={wallet_address for _, wallet_address in pairs},
+            token_address_lower__in={token_address for token_address, _ in pairs})
+
+    return {(wallet.token_address_lower, wallet.address_lower): wallet for wallet in wallets
+            if (wallet.token_address_lower, wallet.address_lower) in pairs}
+
+
+# holds the locks of several wallets, all taken at once so concurrent holders cannot deadlock
+def wallet_locks(wallets):
+    return MutexModel.lock_many(*wallets, auto_renewal=True)
@@ -5,7 +5,7 @@ from ledger.models import Wallet, WithdrawalRequest
 from operator_api.crypto import remove_0x_prefix, hex_address
 from contractor.interfaces import NOCUSTContractInterface
 from celery.utils.log import get_task_logger
-from .event import EventInterpreter
+from .event import EventInterpreter, wallets_by_token_and_address, wallet_locks
 from synchronizer.utils import send_notification, REQUESTED_WITHDRAWAL
 from auditor.serializers import WithdrawalRequestSerializer
 
@@ -46,3 +46,49 @@ class WithdrawalRequestInterpreter(EventInterpreter, metaclass=Singleton):
 
         if verbose:
             print(withdrawal_request)
+
+    # resolves the wallets of all requests at once and inserts the requests in bulk
+    def interpret_many(self, decoded_logs, block_number, eon_number, verbose=False):
+        wallets = wallets_by_token_and_address(
+            (hex_address(log.get('data').get(u'token')), hex_address(log.get('data').get(u'requestor')))
+            for log in decoded_logs)
+
+        withdrawal_requests = []
+        for log in decoded_logs:
+            decoded_event = log.get('data')
+            wallet = wallets.get((
+                hex_address(decoded_event.get(u'token')).lower(),
+                hex_address(decoded_event.get(u'requestor')).lower()))
+            if wallet is None:
+                # TODO this is a problem
+                logger.error("UNKNOWN WALLET REQUESTING WITHDRAWAL {}".format(
+                    hex_address(decoded_event.get(u'requestor'))))
+                continue
+
+            withdrawal_request = WithdrawalRequest(
+                wallet=wallet,
+                amount=decoded_event.get(u'amount'),
+                eon_number=eon_number,
+                block=block_number,
+                txid=remove_0x_prefix(log.get('txid')))
+            withdrawal_request.full_clean(exclude=['wallet'])
+            withdrawal_requests.append(withdrawal_request)
+
+        with wallet_locks([withdrawal_request.wallet for withdrawal_request in withdrawal_requests]):
+            WithdrawalRequest.objects.bulk_create(
+                withdrawal_requests, batch_size=500)
+
+        for withdrawal_request in withdrawal_requests:
+            # send withdrawal requested notification to wallet
+            send_notification(
+                stream_prefix="wallet",
+                stream_id="{}/{}".format(withdrawal_request.wallet.token.address,
+                                         withdrawal_request.wallet.address),
+                event_name=REQUESTED_WITHDRAWAL,
+                data=WithdrawalRequestSerializer(
+                    withdrawal_request, read_only=True).data
+            )
+            logger.warning(withdrawal_request)
+
+            if verbose:
+                print(withdrawal_request)
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+from contractor.benchmark import ChainSyncBenchmark
+
+
+class Command(BaseCommand):
+    help = 'Benchmark chain synchronization against a local json-rpc stub serving a synthetic chain. ' \
+           'Runs on a throwaway test database, but resets the sync keys of the configured redis, ' \
+           'so it must not share redis with a running hub'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--blocks', type=int, default=500)
+        parser.add_argument('--recipients', type=int, default=16)
+        parser.add_argument('--deposits-per-block', type=int, default=1)
+        parser.add_argument('--latency', type=float, default=0.0,
+                            help='seconds the stub node waits before answering each request')
+        parser.add_argument('--celery', action='store_true',
+                            help='fetch blocks through eager celery tasks instead of in process')
+
+    def handle(self, *args, **options):
+        database_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            report = ChainSyncBenchmark(
+                block_count=options['blocks'],
+                recipient_count=options['recipients'],
+                deposits_per_block=options['deposits_per_block'],
+                latency=options['latency'],
+                in_process=not options['celery']).run()
+        finally:
+            connection.creation.destroy_test_db(database_name, verbosity=0)
+
+        self.stdout.write('\n'.join('{}: {}'.format(key, value)
+                                    for key, value in report.items()))
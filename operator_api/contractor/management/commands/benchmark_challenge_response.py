@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+from contractor.benchmark import ChallengeResponseBenchmark
+
+
+class Command(BaseCommand):
+    help = 'Benchmark answering simultaneous state update challenges from cached proof bundles, ' \
+           'serially and with the challenge response worker pool'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--challenges', type=int, default=10000)
+        parser.add_argument('--workers', type=int, default=None)
+        parser.add_argument('--latency', type=float, default=0.005,
+                            help='seconds each read of challenge records waits, as a round trip to the node would')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        try:
+            report = ChallengeResponseBenchmark(
+                challenge_count=options['challenges'],
+                workers=options['workers'],
+                latency=options['latency'],
+                seed=options['seed']).run()
+        except ValueError as e:
+            raise CommandError(e)
+
+        self.stdout.write('\n'.join('{}: {}'.format(key, value)
+                                    for key, value in report.items()))
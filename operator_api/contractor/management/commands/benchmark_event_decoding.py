@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand, CommandError
+from contractor.benchmark import EventDecodingBenchmark, synthetic_contract_logs, export_contract_logs, read_logs, write_logs
+from contractor.interfaces import NOCUSTContractInterface
+
+
+class Command(BaseCommand):
+    help = 'Benchmark contract event decoding on synthetic or recorded logs'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--logs', type=int, default=10000,
+                            help='number of synthetic logs')
+        parser.add_argument('--seed', type=int, default=None)
+        parser.add_argument('--rounds', type=int, default=5)
+        parser.add_argument('--replay', type=str, default=None,
+                            help='decode a recorded logs file instead of synthetic logs')
+        parser.add_argument('--export', type=str, default=None,
+                            help='export the contract logs of a block range to a logs file and exit')
+        parser.add_argument('--block-from', type=int, default=None)
+        parser.add_argument('--block-to', type=int, default=None)
+
+    def handle(self, *args, **options):
+        if options['export']:
+            if options['block_from'] is None or options['block_to'] is None:
+                raise CommandError('--block-from and --block-to are required to export logs.')
+            logs = export_contract_logs(
+                NOCUSTContractInterface(), options['block_from'], options['block_to'])
+            write_logs(options['export'], logs)
+            self.stdout.write('Exported {} logs.'.format(len(logs)))
+            return
+
+        if options['replay']:
+            try:
+                logs = read_logs(options['replay'])
+            except (OSError, ValueError) as e:
+                raise CommandError(e)
+        else:
+            logs = synthetic_contract_logs(
+                log_count=options['logs'], seed=options['seed'])
+
+        try:
+            report = EventDecodingBenchmark().run(logs, rounds=options['rounds'])
+        except ValueError as e:
+            raise CommandError(e)
+
+        self.stdout.write('\n'.join('{}: {}'.format(key, value)
+                                    for key, value in report.items()))
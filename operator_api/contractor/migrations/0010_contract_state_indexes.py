@@ -0,0 +1,23 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contractor', '0009_auto_20191010_1303'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='contractstate',
+            index=models.Index(
+                fields=['confirmed', 'block'],
+                name='contractor_state_confirmed'),
+        ),
+        migrations.AddIndex(
+            model_name='contractledgerstate',
+            index=models.Index(
+                fields=['contract_state', 'token'],
+                name='contractor_ledger_state_token'),
+        ),
+    ]
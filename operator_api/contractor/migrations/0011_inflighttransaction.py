@@ -0,0 +1,64 @@
+from django.db import migrations, models
+from django.db.models import Q
+import django.db.models.deletion
+
+
+# Transactions the previous scheduler had not seen mined are still in flight. The previous scheduler never
+# marked an attempt confirmed, so every other transaction was delivered, unless its block was reorganized
+# away: send_queued_transactions reschedules those once it finds their nonce unused on chain.
+# Their queue time is unknown and left out of the delivery metrics.
+def schedule_unconfirmed_transactions(apps, schema_editor):
+    EthereumTransaction = apps.get_model('contractor', 'EthereumTransaction')
+    EthereumTransactionAttempt = apps.get_model(
+        'contractor', 'EthereumTransactionAttempt')
+    InFlightTransaction = apps.get_model('contractor', 'InFlightTransaction')
+
+    seen_mined = EthereumTransactionAttempt.objects\
+        .filter(Q(mined__gt=0) | Q(confirmed=True))\
+        .values('transaction_id')
+    transaction_ids = list(EthereumTransaction.objects
+                           .exclude(id__in=seen_mined)
+                           .values_list('id', flat=True))
+
+    # attempts ordered by gas price, the last one of a transaction is its latest
+    last_attempts = {attempt.transaction_id: attempt for attempt in EthereumTransactionAttempt.objects
+                     .filter(transaction_id__in=transaction_ids)
+                     .order_by('gas_price')}
+
+    InFlightTransaction.objects.bulk_create([
+        InFlightTransaction(
+            transaction_id=transaction_id,
+            queued_block=None,
+            last_attempt=last_attempts.get(transaction_id))
+        for transaction_id in transaction_ids])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contractor', '0010_contract_state_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InFlightTransaction',
+            fields=[
+                ('id', models.AutoField(auto_created=True,
+                                        primary_key=True, serialize=False, verbose_name='ID')),
+                ('queued_block', models.BigIntegerField(blank=True, null=True)),
+                ('queued_at', models.DateTimeField(auto_now_add=True)),
+                ('deadline_block', models.BigIntegerField(blank=True, null=True)),
+                ('mined_block', models.BigIntegerField(blank=True, null=True)),
+                ('last_attempt', models.ForeignKey(blank=True, null=True,
+                                                   on_delete=django.db.models.deletion.PROTECT, related_name='+', to='contractor.EthereumTransactionAttempt')),
+                ('transaction', models.OneToOneField(
+                    on_delete=django.db.models.deletion.PROTECT, related_name='in_flight', to='contractor.EthereumTransaction')),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.RunPython(
+            schedule_unconfirmed_transactions,
+            migrations.RunPython.noop),
+    ]
@@ -0,0 +1,24 @@
+from django.db import migrations
+
+
+# running states are kept in the running state buffer, unconfirmed rows stored before would block the
+# confirmed states of their blocks from being saved, and be returned as the latest state meanwhile
+def delete_running_contract_states(apps, schema_editor):
+    ContractState = apps.get_model('contractor', 'ContractState')
+    ContractLedgerState = apps.get_model('contractor', 'ContractLedgerState')
+
+    ContractLedgerState.objects.filter(contract_state__confirmed=False).delete()
+    ContractState.objects.filter(confirmed=False).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contractor', '0011_inflighttransaction'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            delete_running_contract_states,
+            migrations.RunPython.noop),
+    ]
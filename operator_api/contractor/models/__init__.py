@@ -4,3 +4,4 @@ from .contract_ledger_state import ContractLedgerState
 from .challenge_entry import ChallengeEntry
 from .ethereum_transaction import EthereumTransaction
 from .ethereum_transaction_attempt import EthereumTransactionAttempt
+from .in_flight_transaction import InFlightTransaction
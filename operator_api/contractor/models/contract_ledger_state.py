@@ -29,19 +29,13 @@ class ContractLedgerState(CleanModel, MutexModel):
         decimal_places=0,
         validators=[MinValueValidator(Decimal('0'))])
 
-    def confirm(self, confirmed: 'ContractLedgerState'):
-        if any([self.contract_state.confirmed,
-                self.contract_state.block != confirmed.contract_state.block,
-                self.token_id != confirmed.token_id]):
-            return False
-
-        self.pending_withdrawals = confirmed.pending_withdrawals
-        self.confirmed_withdrawals = confirmed.confirmed_withdrawals
-        self.deposits = confirmed.deposits
-        self.total_balance = confirmed.total_balance
-
-        self.save()
-        return True
+    class Meta:
+        indexes = [
+            # ledger state of a token at a given contract state
+            models.Index(
+                fields=['contract_state', 'token'],
+                name='contractor_ledger_state_token'),
+        ]
 
     def to_dictionary_form(self):
         return {
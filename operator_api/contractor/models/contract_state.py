@@ -1,11 +1,9 @@
 import logging
 
 from django.db import models
-from django.apps import apps
 
 from .contract_ledger_state import ContractLedgerState
 from operator_api.models import CleanModel, MutexModel
-from django.db import transaction, IntegrityError
 
 from celery.utils.log import get_task_logger
 
@@ -30,14 +28,17 @@ class ContractState(CleanModel, MutexModel):
     has_missed_checkpoint_submission = models.BooleanField()
     live_challenge_count = models.BigIntegerField()
 
-    def eon_number_and_sub_block(self):
-        ContractParameters = apps.get_model('contractor', 'ContractParameters')
-        parameters = ContractParameters.objects.first()
-        if not parameters:
-            return 0, 0
+    class Meta:
+        indexes = [
+            # latest confirmed state overall and per eon block range
+            models.Index(
+                fields=['confirmed', 'block'],
+                name='contractor_state_confirmed'),
+        ]
 
-        blocks_passed = self.block - parameters.genesis_block
-        return blocks_passed // parameters.blocks_per_eon + 1, blocks_passed % parameters.blocks_per_eon
+    def eon_number_and_sub_block(self):
+        from contractor.interfaces.eon_clock import EonClock
+        return EonClock.eon_number_and_sub_block(self.block)
 
     def eon_number(self):
         return self.eon_number_and_sub_block()[0]
@@ -45,41 +46,6 @@ class ContractState(CleanModel, MutexModel):
     def sub_block(self):
         return self.eon_number_and_sub_block()[1]
 
-    def confirm(self, confirmed_state: 'ContractState', confirmed_ledger_states: '[ContractLedgerState]'):
-        if self.confirmed or not self.block == confirmed_state.block:
-            return False
-
-        self.basis = confirmed_state.basis
-        self.last_checkpoint_submission_eon = confirmed_state.last_checkpoint_submission_eon
-        self.last_checkpoint = confirmed_state.last_checkpoint
-        self.is_checkpoint_submitted_for_current_eon = confirmed_state.is_checkpoint_submitted_for_current_eon
-        self.has_missed_checkpoint_submission = confirmed_state.has_missed_checkpoint_submission
-        self.live_challenge_count = confirmed_state.live_challenge_count
-
-        with transaction.atomic():
-            if len(confirmed_ledger_states) < self.contractledgerstate_set.count():
-                raise IntegrityError('Ledger State count mismatch {}/{}'.format(len(confirmed_ledger_states),
-                                                                                self.contractledgerstate_set.count()))
-
-            for confirmed_ledger_state in confirmed_ledger_states:
-                try:
-                    ledger_state = self.contractledgerstate_set.get(
-                        token_id=confirmed_ledger_state.token_id)
-                    if not ledger_state.confirm(confirmed_ledger_state):
-                        raise IntegrityError(
-                            'Could not confirm contract ledger state {}'.format(ledger_state.token.address))
-                except ContractLedgerState.DoesNotExist:
-                    confirmed_ledger_state.contract_state = self
-                    confirmed_ledger_state.save()
-                    logger.warning(
-                        'Could not find contract ledger state {} to confirm.'.format(
-                            confirmed_ledger_state.token.address))
-
-            self.confirmed = True
-            self.save()
-
-        return True
-
     def to_dictionary_form(self):
         return {
             'id': self.id,
@@ -0,0 +1,30 @@
+from django.db import models
+from operator_api.models import CleanModel
+
+
+# Scheduling state of a queued transaction, kept only until one of its attempts is confirmed
+# so the scheduler never walks the history of delivered transactions
+class InFlightTransaction(CleanModel):
+    transaction = models.OneToOneField(
+        to='EthereumTransaction',
+        on_delete=models.PROTECT,
+        related_name='in_flight')
+    # unknown for transactions queued before the table existed, which are left out of the delivery metrics
+    queued_block = models.BigIntegerField(
+        blank=True,
+        null=True)
+    queued_at = models.DateTimeField(
+        auto_now_add=True)
+    # last block the transaction is of use in, e.g. the end of a challenge's eon
+    deadline_block = models.BigIntegerField(
+        blank=True,
+        null=True)
+    last_attempt = models.ForeignKey(
+        to='EthereumTransactionAttempt',
+        on_delete=models.PROTECT,
+        related_name='+',
+        blank=True,
+        null=True)
+    mined_block = models.BigIntegerField(
+        blank=True,
+        null=True)
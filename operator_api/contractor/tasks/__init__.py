@@ -5,3 +5,4 @@ from .populate_contract_parameters import populate_contract_parameters
 from .send_queued_transactions import send_queued_transactions
 from .health_checks import check_eth_level
 from .confirm_withdrawals import confirm_withdrawals
+from .prune_contract_states import prune_contract_states
@@ -15,16 +15,12 @@ logger.setLevel(logging.INFO)
     default_retry_delay=20,
     retry_kwargs={'max_retries': 5, 'default_retry_delay': 20})
 def fetch_running_block(self, block_number):
-    if ContractState.objects.filter(block=block_number).exists():
-        logger.error(
-            'Contract state at block {} already exists.'.format(block_number))
-        return None
     logger.info('Fetching running block {}.'.format(block_number))
     contract_state, confirmed_contract_ledger_states = NOCUSTContractInterface().fetch_contract_state_at_block(
         block_number=block_number)
     if contract_state is None:
         raise ValueError('No block returned.')
-    return contract_state.to_dictionary_form(), [s.to_dictionary_form() for s in confirmed_contract_ledger_states]
+    return encode_contract_state(contract_state), [s.to_dictionary_form() for s in confirmed_contract_ledger_states]
 
 
 @operator_celery.task(
@@ -33,23 +29,28 @@ def fetch_running_block(self, block_number):
     max_retries=5,
     default_retry_delay=20,
     retry_kwargs={'max_retries': 5, 'default_retry_delay': 20})
-def fetch_confirmed_block(self, block_number):
+def fetch_confirmed_block(self, block_number, fetch_logs=True):
     contract_interface = NOCUSTContractInterface()
     logger.info('Fetching confirmed block {}.'.format(block_number))
-    block = contract_interface.get_block(block_number)
-    if block is None:
-        raise ValueError('No block returned.')
 
-    logger.info('Retrieving logs for block {}.'.format(block_number))
-    block_logs = [encode_log(log.__dict__)
-                  for log in contract_interface.get_logs(block)]
-    if block_logs is None:
-        raise ValueError('No block logs returned.')
+    # logs are left out when the caller retrieves them for a whole block range at once
+    block_logs = None
+    if fetch_logs:
+        block = contract_interface.get_block(block_number)
+        if block is None:
+            raise ValueError('No block returned.')
+
+        logger.info('Retrieving logs for block {}.'.format(block_number))
+        block_logs = [encode_log(log.__dict__)
+                      for log in contract_interface.get_logs(block)]
 
     confirmed_contract_state, confirmed_contract_ledger_states = contract_interface.fetch_contract_state_at_block(
         block_number=block_number)
 
-    return confirmed_contract_state.to_dictionary_form(), [s.to_dictionary_form() for s in confirmed_contract_ledger_states], block_logs
+    if confirmed_contract_state is None:
+        raise ValueError('No block returned.')
+
+    return encode_contract_state(confirmed_contract_state), [s.to_dictionary_form() for s in confirmed_contract_ledger_states], block_logs
 
 
 def encode_log(log: dict):
@@ -64,3 +65,14 @@ def encode_log(log: dict):
         'logIndex': log.get('logIndex'),
         'removed': log.get('removed')
     }
+
+
+# dictionary form of a fetched contract state, with the hashes of its block, the block's parent
+# and the block's transactions
+def encode_contract_state(contract_state: ContractState):
+    encoded = contract_state.to_dictionary_form()
+    encoded['block_hash'] = contract_state.block_hash
+    encoded['parent_hash'] = contract_state.parent_hash
+    encoded['transaction_hashes'] = getattr(
+        contract_state, 'transaction_hashes', [])
+    return encoded
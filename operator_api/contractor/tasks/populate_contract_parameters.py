@@ -1,7 +1,7 @@
 import logging
 from celery import shared_task
 from celery.utils.log import get_task_logger
-from contractor.interfaces import NOCUSTContractInterface
+from contractor.interfaces import NOCUSTContractInterface, LocalViewInterface
 from contractor.models import ContractParameters, ContractState
 from operator_api.util import ZERO_CHECKSUM
 
@@ -35,6 +35,7 @@ def populate_contract_parameters():
                 is_checkpoint_submitted_for_current_eon=False,
                 has_missed_checkpoint_submission=False,
                 live_challenge_count=0)
+            LocalViewInterface.invalidate()
             logger.info('Contract parameters populated.')
         except ValueError as value_error:
             logger.error(
@@ -0,0 +1,91 @@
+import gzip
+import json
+import logging
+import os
+from celery import shared_task
+from celery.utils.log import get_task_logger
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from contractor.interfaces import LocalViewInterface, EonClock
+from contractor.models import ContractState, ContractLedgerState
+from operator_api.decorators import notification_on_error
+
+logger = get_task_logger(__name__)
+logger.setLevel(logging.INFO)
+
+PRUNED_EON_KEY = 'contract_state_pruned_eon'
+
+
+def archive_path(eon_number):
+    return os.path.join(
+        settings.HUB_CONTRACT_STATE_ARCHIVE_DIR,
+        'contract_states_eon_{}.jsonl.gz'.format(eon_number))
+
+
+# writes the states with their ledger states as gzipped json lines, replacing the file only once complete
+def archive_contract_states(eon_number, contract_states):
+    ledger_states = {}
+    for ledger_state in ContractLedgerState.objects.filter(contract_state__in=contract_states):
+        ledger_states.setdefault(ledger_state.contract_state_id, []).append(
+            ledger_state.to_dictionary_form())
+
+    os.makedirs(settings.HUB_CONTRACT_STATE_ARCHIVE_DIR, exist_ok=True)
+    path = archive_path(eon_number)
+    with gzip.open(path + '.tmp', 'wt') as archive_file:
+        for contract_state in contract_states:
+            archived = contract_state.to_dictionary_form()
+            archived['ledger_states'] = ledger_states.get(contract_state.id, [])
+            archive_file.write(json.dumps(archived) + '\n')
+    os.replace(path + '.tmp', path)
+    return path
+
+
+# Only the last confirmed state of every eon, the genesis state and the states of the latest
+# eons_kept eons are read after synchronization, every other state of an older eon is archived
+# and deleted. Eons are pruned oldest first, at most max_eons per run.
+@shared_task
+@notification_on_error
+def prune_contract_states(max_eons=10):
+    contract_parameters = LocalViewInterface.get_contract_parameters()
+    if not contract_parameters:
+        logger.error('Contract parameters not yet populated.')
+        return 0
+
+    confirmed_eon_number = LocalViewInterface.confirmed().eon_number()
+    prune_until = confirmed_eon_number - contract_parameters.eons_kept
+    prune_from = cache.get(PRUNED_EON_KEY, 0) + 1
+
+    pruned = 0
+    for eon_number in range(prune_from, min(prune_until, prune_from + max_eons)):
+        eon_start, eon_end = EonClock.eon_block_range(eon_number)
+
+        with ContractState.global_lock():
+            boundary = LocalViewInterface.confirmed(eon_number=eon_number)
+            contract_states = ContractState.objects\
+                .filter(
+                    confirmed=True,
+                    block__gte=eon_start,
+                    block__lt=eon_end)\
+                .exclude(block=contract_parameters.genesis_block)
+            if boundary is not None:
+                contract_states = contract_states.exclude(id=boundary.id)
+            contract_states = list(contract_states.order_by('block'))
+
+            if contract_states:
+                path = archive_contract_states(eon_number, contract_states)
+                with transaction.atomic():
+                    ContractLedgerState.objects\
+                        .filter(contract_state__in=contract_states)\
+                        .delete()
+                    ContractState.objects\
+                        .filter(id__in=[s.id for s in contract_states])\
+                        .delete()
+                logger.info('Archived {} contract states of eon {} to {}.'.format(
+                    len(contract_states), eon_number, path))
+                pruned += len(contract_states)
+
+        cache.set(PRUNED_EON_KEY, eon_number, timeout=None)
+
+    return pruned
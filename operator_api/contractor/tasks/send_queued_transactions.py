@@ -1,17 +1,24 @@
 import logging
+from collections import defaultdict
 from operator_api.decorators import notification_on_error
 from celery import shared_task
 from celery.utils.log import get_task_logger
 from django.conf import settings
-from eth_utils import add_0x_prefix, remove_0x_prefix
+from django.utils import timezone
+from eth_utils import remove_0x_prefix
 
-from contractor.interfaces import NOCUSTContractInterface, LocalViewInterface
-from contractor.models import EthereumTransaction, EthereumTransactionAttempt
+from contractor.interfaces import NOCUSTContractInterface, LocalViewInterface, NonceAllocator
+from contractor.models import EthereumTransaction, EthereumTransactionAttempt, InFlightTransaction
 from operator_api.email import send_admin_email
+from operator_api.models.mutex_model import strict_redis_client
 
 logger = get_task_logger(__name__)
 logger.setLevel(logging.INFO)
 
+TRANSACTION_METRICS_KEY = 'ethereum_transaction_metrics'
+TRANSACTION_ATTEMPT_INDEX_KEY = 'ethereum_transaction_attempts'
+RECEIPT_BATCH_SIZE = 500
+
 
 @shared_task
 @notification_on_error
@@ -21,91 +28,322 @@ def send_queued_transactions():
     latest_block = LocalViewInterface.latest_block()
 
     with EthereumTransaction.global_lock(auto_renewal=True):
-        pending_transactions = EthereumTransaction.objects.all().order_by('nonce')
+        remote_nonce = contract_interface.web3.eth.getTransactionCount(
+            settings.HUB_OWNER_ACCOUNT_ADDRESS)
+        # keeps the nonce counter ahead of transactions the owner account sent by other means,
+        # and takes back or fills the nonces of rolled back transactions
+        NonceAllocator().reconcile(remote_nonce)
+        reschedule_unused_nonces(remote_nonce)
+
+        TransactionScheduler(contract_interface).run(latest_block)
+
+
+# transactions whose nonce the chain has not used yet are still in flight, even when they were taken for
+# delivered, e.g. those migrated from before the in flight table that had been seen mined in a block
+# reorganized away. their queue time is unknown, so they are left out of the delivery metrics
+def reschedule_unused_nonces(remote_nonce):
+    transactions = EthereumTransaction.objects.filter(
+        from_address=remove_0x_prefix(settings.HUB_OWNER_ACCOUNT_ADDRESS),
+        nonce__gte=remote_nonce,
+        in_flight__isnull=True)
+    transaction_ids = list(transactions.values_list('id', flat=True))
+    if not transaction_ids:
+        return
+
+    logger.warning('Rescheduling transactions {} with unused nonces.'.format(transaction_ids))
+    # attempts ordered by gas price, the last one of a transaction is its latest
+    last_attempts = {attempt.transaction_id: attempt for attempt in EthereumTransactionAttempt.objects
+                     .filter(transaction_id__in=transaction_ids)
+                     .order_by('gas_price')}
+    InFlightTransaction.objects.bulk_create([
+        InFlightTransaction(
+            transaction_id=transaction_id,
+            queued_block=None,
+            last_attempt=last_attempts.get(transaction_id))
+        for transaction_id in transaction_ids])
+
+
+# elapsed fraction of the blocks between queueing a transaction and its deadline
+def urgency(in_flight: InFlightTransaction, latest_block):
+    if in_flight.deadline_block is None:
+        return 0.0
+    window = max(1, in_flight.deadline_block - in_flight.queued_block)
+    return min(1.0, max(0.0, (latest_block - in_flight.queued_block) / window))
+
+
+def gas_escalation(urgency):
+    return settings.HUB_TX_GAS_ESCALATION + \
+        (settings.HUB_TX_GAS_ESCALATION_MAX - settings.HUB_TX_GAS_ESCALATION) * \
+        urgency ** settings.HUB_TX_GAS_ESCALATION_EXPONENT
+
+
+def resend_interval(urgency):
+    return max(1, int(round(settings.HUB_TX_RESEND_BLOCKS * (1 - urgency))))
+
+
+# receipts are only polled for transactions the receipt watcher may have missed, before an attempt is
+# replaced and when a mined transaction was not confirmed well after its confirmation depth
+def needs_receipts(in_flight: InFlightTransaction, latest_block):
+    if in_flight.mined_block is not None:
+        return latest_block - in_flight.mined_block > 2 * settings.HUB_LQD_CONTRACT_CONFIRMATIONS
+    last_attempt = in_flight.last_attempt
+    return last_attempt is not None and \
+        latest_block - last_attempt.block >= resend_interval(urgency(in_flight, latest_block))
+
+
+# Delivers the transactions in flight, oldest nonce first. Unmined attempts are replaced at a gas
+# price that escalates faster and more often the closer the transaction is to its deadline. Mined
+# attempts are found by the receipt watcher in the blocks the synchronizer fetches.
+class TransactionScheduler(object):
+    def __init__(self, contract_interface=None):
+        self.contract_interface = contract_interface or NOCUSTContractInterface()
+
+    def gas_price_cap(self):
+        return self.contract_interface.web3.toWei(settings.HUB_TX_MAX_GAS_PRICE_GWEI, 'gwei')
+
+    def initial_gas_price(self, urgency):
+        initial_gas_price = self.contract_interface.web3.toWei(
+            settings.HUB_TX_INITIAL_GAS_PRICE_GWEI, 'gwei')
+        return min(self.gas_price_cap(), int(initial_gas_price * gas_escalation(urgency) / settings.HUB_TX_GAS_ESCALATION))
+
+    def receipts(self, transaction_hashes):
+        receipts = {}
+        for i in range(0, len(transaction_hashes), RECEIPT_BATCH_SIZE):
+            chunk = transaction_hashes[i:i + RECEIPT_BATCH_SIZE]
+            receipts.update(zip(chunk, self.contract_interface.get_transaction_receipts(chunk)))
+        return receipts
+
+    def run(self, latest_block):
+        in_flight_transactions = list(InFlightTransaction.objects
+                                      .select_related('transaction', 'last_attempt')
+                                      .order_by('transaction__nonce'))
+
+        attempts = defaultdict(list)
+        for attempt in EthereumTransactionAttempt.objects.filter(transaction__in_flight__isnull=False):
+            attempts[attempt.transaction_id].append(attempt)
+        ReceiptWatcher().index(
+            [attempt for transaction_attempts in attempts.values() for attempt in transaction_attempts])
+
+        receipts = self.receipts([attempt.hash
+                                  for in_flight in in_flight_transactions if needs_receipts(in_flight, latest_block)
+                                  for attempt in attempts[in_flight.transaction_id]])
+
+        for in_flight in in_flight_transactions:
+            self.schedule(
+                in_flight, attempts[in_flight.transaction_id], receipts, latest_block)
+
+    def schedule(self, in_flight: InFlightTransaction, attempts, receipts, latest_block):
+        transaction = in_flight.transaction
+
+        if any(attempt.hash in receipts for attempt in attempts):
+            if any(isinstance(receipts.get(attempt.hash), Exception) for attempt in attempts):
+                logger.warning('Could not poll receipts of {}.'.format(transaction.tag))
+                return
+
+            # any attempt may be mined, they all share the transaction's nonce
+            mined_attempt = next(
+                (attempt for attempt in attempts if receipts.get(attempt.hash) is not None), None)
+            if mined_attempt is not None:
+                mined_block = receipts.get(mined_attempt.hash).get('blockNumber')
+                logger.warning('Transaction {} mined at {} was missed by the receipt watcher.'.format(
+                    transaction.tag, mined_block))
+                if latest_block - mined_block >= settings.HUB_LQD_CONTRACT_CONFIRMATIONS:
+                    confirm_delivery(in_flight, [mined_attempt.hash], mined_block)
+                else:
+                    mark_mined([in_flight.transaction_id], [mined_attempt.hash], mined_block)
+                return
+
+            if in_flight.mined_block is not None:
+                unmark_mined([in_flight.transaction_id])
+                in_flight.mined_block = None
+
+        # mined transactions are confirmed by the receipt watcher
+        if in_flight.mined_block is not None:
+            return
+
+        transaction_urgency = urgency(in_flight, latest_block)
+        last_attempt = in_flight.last_attempt
+
+        if last_attempt is None:
+            self.send(
+                in_flight,
+                self.initial_gas_price(transaction_urgency),
+                latest_block,
+                error_subject='INITIAL TRANSACTION ATTEMPT ERROR')
+            return
 
-        for transaction in pending_transactions:
-            if transaction.ethereumtransactionattempt_set.filter(confirmed=True).exists():
-                continue
+        if latest_block - last_attempt.block < resend_interval(transaction_urgency):
+            return
 
-            if transaction.ethereumtransactionattempt_set.exists():
-                last_attempt = transaction.ethereumtransactionattempt_set.order_by(
-                    'gas_price').last()
+        new_gas_price = min(
+            self.gas_price_cap(),
+            int(int(last_attempt.gas_price) * gas_escalation(transaction_urgency)))
+        if new_gas_price <= int(last_attempt.gas_price):
+            logger.warning('Transaction {} stuck at the gas price cap.'.format(
+                transaction.tag))
+            return
+
+        if in_flight.deadline_block is not None and latest_block > in_flight.deadline_block:
+            send_admin_email(
+                subject='Transaction Deadline Missed',
+                content='{}: deadline {}, block {}'.format(transaction.tag, in_flight.deadline_block, latest_block))
+
+        if self.send(in_flight, new_gas_price, latest_block, error_subject='TRANSACTION RE-ATTEMPT ERROR'):
+            send_admin_email(
+                subject='Transaction Reattempt',
+                content='{}: {}'.format(transaction.tag, new_gas_price))
+
+    def send(self, in_flight: InFlightTransaction, gas_price, latest_block, error_subject):
+        transaction = in_flight.transaction
+        signed_tx = self.contract_interface.sign_for_delivery_as_owner(
+            transaction, gas_price)
+        try:
+            logger.info('Publishing Signed TX: {}'.format(transaction))
+            hash = self.contract_interface.send_raw_transaction(
+                signed_tx.rawTransaction)
+        except ValueError as e:
+            send_admin_email(
+                subject=error_subject,
+                content='{}: {}'.format(transaction.tag, e))
+            return None
+
+        in_flight.last_attempt = EthereumTransactionAttempt.objects.create(
+            transaction=transaction,
+            block=latest_block,
+            gas_price=gas_price,
+            signed_attempt=signed_tx.rawTransaction.hex(),
+            hash=remove_0x_prefix(hash.hex()),
+            mined=None,
+            confirmed=False)
+        in_flight.save()
+        ReceiptWatcher().index_attempt(in_flight.last_attempt)
+        return in_flight.last_attempt
+
+
+# Finds the attempts of the transactions in flight among the transactions of each block the synchronizer
+# commits, through an index from attempt hash to transaction. Attempts seen in running blocks are marked
+# mined, attempts seen in confirmed blocks confirm their transactions, so no receipts are polled per attempt.
+class ReceiptWatcher(object):
+    def __init__(self, redis_client=None):
+        self.redis = redis_client or strict_redis_client
+
+    # replaces the index with the attempts of the transactions in flight
+    def index(self, attempts):
+        pipeline = self.redis.pipeline()
+        pipeline.delete(TRANSACTION_ATTEMPT_INDEX_KEY)
+        if attempts:
+            pipeline.hset(TRANSACTION_ATTEMPT_INDEX_KEY, mapping={
+                attempt.hash.lower(): attempt.transaction_id for attempt in attempts})
+        pipeline.execute()
+
+    def index_attempt(self, attempt: EthereumTransactionAttempt):
+        self.redis.hset(TRANSACTION_ATTEMPT_INDEX_KEY,
+                        attempt.hash.lower(), attempt.transaction_id)
+
+    # attempt hashes of the block in the index, with the transactions they belong to
+    def match(self, transaction_hashes):
+        attempt_hashes = [remove_0x_prefix(transaction_hash).lower()
+                          for transaction_hash in transaction_hashes]
+        if not attempt_hashes:
+            return {}
+        transaction_ids = self.redis.hmget(
+            TRANSACTION_ATTEMPT_INDEX_KEY, attempt_hashes)
+        return {attempt_hash: int(transaction_id)
+                for attempt_hash, transaction_id in zip(attempt_hashes, transaction_ids) if transaction_id is not None}
+
+    def observe(self, block_number, transaction_hashes, confirmed):
+        matches = self.match(transaction_hashes)
+        transaction_ids = set(matches.values())
+
+        # transactions marked mined in a running block that did not make it into the confirmed chain
+        unmined = InFlightTransaction.objects\
+            .filter(mined_block__lte=block_number)\
+            .exclude(transaction_id__in=transaction_ids) if confirmed else InFlightTransaction.objects.none()
+
+        if not matches and not unmined.exists():
+            return
+
+        with EthereumTransaction.global_lock(auto_renewal=True):
+            unmined_transaction_ids = list(
+                unmined.values_list('transaction_id', flat=True))
+            if unmined_transaction_ids:
+                unmark_mined(unmined_transaction_ids)
+
+            if not matches:
+                return
+
+            if confirmed:
+                for in_flight in InFlightTransaction.objects.select_related('transaction').filter(transaction_id__in=transaction_ids):
+                    confirm_delivery(in_flight, list(matches.keys()), block_number)
             else:
-                initial_gas_price = contract_interface.web3.toWei(
-                    '100', 'gwei')
-                signed_tx = contract_interface.sign_for_delivery_as_owner(
-                    transaction, initial_gas_price)
-                try:
-                    logger.info('Publishing Signed TX: {}'.format(transaction))
-                    hash = contract_interface.send_raw_transaction(
-                        signed_tx.rawTransaction)
-                except ValueError as e:
-                    send_admin_email(
-                        subject='INITIAL TRANSACTION ATTEMPT ERROR',
-                        content='{}: {}'.format(transaction.tag, e))
-                    continue
-                last_attempt = EthereumTransactionAttempt.objects.create(
-                    transaction=transaction,
-                    block=latest_block,
-                    gas_price=initial_gas_price,
-                    signed_attempt=signed_tx.rawTransaction.hex(),
-                    hash=remove_0x_prefix(hash.hex()),
-                    mined=False,
-                    confirmed=False)
-
-            if transaction.ethereumtransactionattempt_set.filter(mined=True).exists():
-                try:
-                    mined_transaction = transaction.ethereumtransactionattempt_set.get(
-                        mined=True)
-                except EthereumTransactionAttempt.DoesNotExist:
-                    logger.error('Mined Transaction Attempt Inconsistency')
-                    continue
-
-                receipt = contract_interface.get_transaction_receipt_hex(
-                    add_0x_prefix(mined_transaction.hash))
-
-                if receipt is not None:
-                    if receipt.get('blockNumber') - latest_block > settings.HUB_LQD_CONTRACT_CONFIRMATIONS:
-                        logger.info('Transaction confirmed! {}'.format(
-                            last_attempt.hash))
-                        mined_transaction.confirmed = True
-                        mined_transaction.save()
-                    continue
-
-                logger.warning(
-                    'Transaction UNMINED: {}'.format(last_attempt.hash))
-                mined_transaction.mined = False
-                mined_transaction.save()
-
-            receipt = contract_interface.get_transaction_receipt_hex(
-                add_0x_prefix(last_attempt.hash))
-            if receipt is not None:
-                last_attempt.mined = True
-                last_attempt.save()
-                continue
-
-            if latest_block - last_attempt.block > 10:
-                new_gas_price = 2 * int(last_attempt.gas_price)
-                signed_tx = contract_interface.sign_for_delivery_as_owner(
-                    transaction, new_gas_price)
-                try:
-                    hash = contract_interface.send_raw_transaction(
-                        signed_tx.rawTransaction)
-                except ValueError as e:
-                    send_admin_email(
-                        subject='TRANSACTION RE-ATTEMPT ERROR',
-                        content='{}: {}'.format(transaction.tag, e))
-                    continue
-
-                EthereumTransactionAttempt.objects.create(
-                    transaction=transaction,
-                    block=latest_block,
-                    gas_price=new_gas_price,
-                    signed_attempt=signed_tx.rawTransaction.hex(),
-                    hash=remove_0x_prefix(hash.hex()),
-                    mined=False,
-                    confirmed=False)
-
-                send_admin_email(
-                    subject='Transaction Reattempt',
-                    content='{}: {}'.format(transaction.tag, new_gas_price))
+                mark_mined(transaction_ids, list(matches.keys()), block_number)
+
+
+def mark_mined(transaction_ids, attempt_hashes, mined_block):
+    EthereumTransactionAttempt.objects\
+        .filter(hash__in=attempt_hashes)\
+        .update(mined=mined_block)
+    InFlightTransaction.objects\
+        .filter(transaction_id__in=transaction_ids)\
+        .update(mined_block=mined_block)
+
+
+def unmark_mined(transaction_ids):
+    logger.warning('Transactions UNMINED: {}'.format(transaction_ids))
+    EthereumTransactionAttempt.objects\
+        .filter(transaction_id__in=transaction_ids, mined__isnull=False)\
+        .update(mined=None)
+    InFlightTransaction.objects\
+        .filter(transaction_id__in=transaction_ids)\
+        .update(mined_block=None)
+
+
+def confirm_delivery(in_flight: InFlightTransaction, attempt_hashes, mined_block):
+    logger.info('Transaction confirmed! {}'.format(in_flight.transaction.tag))
+    confirmed_attempts = EthereumTransactionAttempt.objects\
+        .filter(transaction_id=in_flight.transaction_id, hash__in=attempt_hashes)
+    confirmed_attempts.update(mined=mined_block, confirmed=True)
+
+    strict_redis_client.hdel(TRANSACTION_ATTEMPT_INDEX_KEY, *[attempt_hash.lower() for attempt_hash in EthereumTransactionAttempt.objects
+                                                              .filter(transaction_id=in_flight.transaction_id)
+                                                              .values_list('hash', flat=True)])
+    record_delivery(in_flight, mined_block)
+    in_flight.delete()
+
+
+def record_delivery(in_flight: InFlightTransaction, mined_block):
+    if in_flight.queued_block is None:
+        return
+
+    pipeline = strict_redis_client.pipeline()
+    pipeline.hincrby(TRANSACTION_METRICS_KEY, 'confirmed', 1)
+    pipeline.hincrby(TRANSACTION_METRICS_KEY, 'blocks_to_mine',
+                     max(0, mined_block - in_flight.queued_block))
+    pipeline.hincrbyfloat(TRANSACTION_METRICS_KEY, 'seconds_to_confirm',
+                          (timezone.now() - in_flight.queued_at).total_seconds())
+    if in_flight.deadline_block is not None and mined_block > in_flight.deadline_block:
+        pipeline.hincrby(TRANSACTION_METRICS_KEY, 'missed_deadlines', 1)
+    pipeline.execute()
+
+
+# queue depth from the in flight table, delivery times averaged over every confirmed transaction
+def transaction_queue_metrics(latest_block=None):
+    if latest_block is None:
+        latest_block = LocalViewInterface.latest_block()
+
+    in_flight = InFlightTransaction.objects.all()
+    delivered = {key.decode(): float(value)
+                 for key, value in strict_redis_client.hgetall(TRANSACTION_METRICS_KEY).items()}
+    confirmed = int(delivered.get('confirmed', 0))
+
+    return {
+        'queue_depth': in_flight.count(),
+        'unsent': in_flight.filter(last_attempt__isnull=True).count(),
+        'mined': in_flight.filter(mined_block__isnull=False).count(),
+        'with_deadline': in_flight.filter(deadline_block__isnull=False).count(),
+        'overdue': in_flight.filter(deadline_block__lt=latest_block).count(),
+        'confirmed': confirmed,
+        'missed_deadlines': int(delivered.get('missed_deadlines', 0)),
+        'mean_blocks_to_mine': delivered.get('blocks_to_mine', 0) / confirmed if confirmed else None,
+        'mean_seconds_to_confirm': delivered.get('seconds_to_confirm', 0) / confirmed if confirmed else None,
+    }
@@ -2,21 +2,31 @@ from operator_api.decorators import notification_on_error
 import logging
 import traceback
 import sys
+import time
+from collections import defaultdict, deque
+from itertools import groupby
+from concurrent import futures
 from celery import shared_task, exceptions
 from django.conf import settings
 from celery.utils.log import get_task_logger
+from django.core.cache import cache
 from django.db import transaction
 
-from contractor.interfaces import NOCUSTContractInterface, LocalViewInterface
+from contractor.interfaces import NOCUSTContractInterface, LocalViewInterface, RunningStateBuffer
+from contractor.interfaces.json_rpc_batch import AsyncJSONRPCTransport
 from contractor.decoders import NOCUSTContractEventDecoder
 from contractor.interpreters import event_interpreter_map
 from contractor.models import ContractState, ContractLedgerState
-from contractor.tasks.fetch_blocks import fetch_running_block, fetch_confirmed_block
+from contractor.tasks.fetch_blocks import fetch_running_block, fetch_confirmed_block, encode_log, encode_contract_state
+from contractor.tasks.send_queued_transactions import ReceiptWatcher
 from operator_api.email import send_admin_email
+from operator_api.util import Singleton
 
 logger = get_task_logger(__name__)
 logger.setLevel(logging.INFO)
 
+CONTRACT_LOG_CHECKPOINT_KEY = 'contract_log_checkpoint'
+
 
 def fully_synchronize_contract_state(verbose=False):
     while synchronize_contract_state(verbose) > 0:
@@ -40,10 +50,168 @@ def synchronize_contract_state(verbose=False):
         logger.info('Decoder acquired')
         contract_interface.get_blocks_per_eon()
 
-        return concurrently_retrieve_state(contract_interface, contract_event_decoder, verbose)
+        block_fetcher = None
+        if settings.HUB_SYNC_FETCH_IN_PROCESS and AsyncJSONRPCTransport.is_available():
+            block_fetcher = AsyncBlockFetcher()
+
+        return concurrently_retrieve_state(contract_interface, contract_event_decoder, verbose, block_fetcher)
+
+
+# encoded contract logs of the confirmed blocks [from_block, to_block], grouped by block number
+# the last block of each range is kept as a checkpoint which the following range has to extend
+def fetch_confirmed_logs(contract_interface, from_block, to_block):
+    first_block = contract_interface.get_block(from_block)
+    last_block = first_block if to_block == from_block else contract_interface.get_block(
+        to_block)
+    if first_block is None or last_block is None:
+        raise ValueError('No block returned.')
+
+    checkpoint = cache.get(CONTRACT_LOG_CHECKPOINT_KEY)
+    if checkpoint is not None and checkpoint[0] == from_block - 1 and checkpoint[1] != first_block.get(u'parentHash').hex():
+        logger.error('Block {} does not extend log checkpoint {}.'.format(
+            from_block, checkpoint))
+        send_admin_email(
+            subject='Chain Sync Reorganization {}'.format(from_block),
+            content='Block {} does not extend log checkpoint {}.'.format(from_block, checkpoint))
+        raise Exception()
+
+    logs_by_block = defaultdict(list)
+    for log in contract_interface.get_contract_logs(from_block, to_block):
+        block_number = log.get(u'blockNumber')
+        if log.get(u'removed') \
+                or block_number == from_block and log.get(u'blockHash') != first_block.get(u'hash') \
+                or block_number == to_block and log.get(u'blockHash') != last_block.get(u'hash'):
+            logger.error('Log of a non canonical block {}.'.format(log))
+            raise ValueError('Logs changed while being retrieved.')
+        logs_by_block[block_number].append(encode_log(log.__dict__))
+
+    cache.set(CONTRACT_LOG_CHECKPOINT_KEY,
+              (to_block, last_block.get(u'hash').hex()), timeout=None)
+    return logs_by_block
+
+
+# dispatches block fetches to the blockchain workers through celery
+class CeleryBlockFetcher(object):
+    def dispatch(self, block_number, confirmed):
+        if confirmed:
+            return fetch_confirmed_block.delay(block_number=block_number, fetch_logs=False)
+        return fetch_running_block.delay(block_number=block_number)
+
+    def is_ready(self, fetch):
+        return fetch.ready()
+
+    def result(self, fetch):
+        return fetch.get(
+            timeout=settings.HUB_BLOCK_FETCH_TIMEOUT,
+            disable_sync_subtasks=False)
+
+    def cancel(self, fetch):
+        try:
+            fetch.forget()
+        except NotImplementedError as e:
+            logger.error('Could not forget task results.')
+            logger.error(e)
+
+
+# fetches block snapshots from this process, posting the json-rpc batch of each block through a pooled
+# async client instead of a celery round trip, blocks that fail are fetched again through celery
+class AsyncBlockFetcher(object, metaclass=Singleton):
+    def __init__(self):
+        self.transport = AsyncJSONRPCTransport(
+            connections=settings.HUB_SYNC_MAX_LOOKAHEAD)
+        self.contract_interface = NOCUSTContractInterface(
+            rpc_transport=self.transport)
+        self.fallback = CeleryBlockFetcher()
+
+    class Fetch(object):
+        def __init__(self, block_number, confirmed, batch, tokens, future):
+            self.block_number = block_number
+            self.confirmed = confirmed
+            self.batch = batch
+            self.tokens = tokens
+            self.future = future
+
+    def dispatch(self, block_number, confirmed):
+        batch, tokens = self.contract_interface.contract_state_batch(
+            block_number)
+        return AsyncBlockFetcher.Fetch(
+            block_number, confirmed, batch, tokens, self.transport.submit(batch.requests))
+
+    def is_ready(self, fetch):
+        return fetch.future.done()
+
+    def result(self, fetch):
+        try:
+            responses = fetch.future.result(
+                timeout=settings.HUB_BLOCK_FETCH_TIMEOUT)
+        except futures.TimeoutError:
+            raise exceptions.TimeoutError(
+                'Fetching block {} timed out.'.format(fetch.block_number))
+        except Exception as e:
+            logger.warning('Could not fetch block {} in process: {}'.format(
+                fetch.block_number, e))
+            return self.fallback_result(fetch)
+
+        snapshot = self.contract_interface.contract_state_from_results(
+            fetch.block_number, fetch.tokens, fetch.batch.results(responses))
+        if snapshot is None:
+            logger.warning('No state returned for block {} in process.'.format(
+                fetch.block_number))
+            return self.fallback_result(fetch)
+
+        contract_state, contract_ledger_states = snapshot
+        result = (encode_contract_state(contract_state),
+                  [s.to_dictionary_form() for s in contract_ledger_states])
+        if fetch.confirmed:
+            return result + (None,)
+        return result
+
+    def fallback_result(self, fetch):
+        return self.fallback.result(
+            self.fallback.dispatch(fetch.block_number, fetch.confirmed))
+
+    def cancel(self, fetch):
+        fetch.future.cancel()
+
+
+# number of block fetches kept in flight, grown by one whenever a commit had to wait for its fetch
+# and halved when a fetch times out, so a slow node or busy workers are not flooded with requests
+class SyncWindow(object):
+    lookahead = settings.HUB_SYNC_MIN_LOOKAHEAD
+
+    @staticmethod
+    def grow():
+        SyncWindow.lookahead = min(
+            SyncWindow.lookahead + 1, settings.HUB_SYNC_MAX_LOOKAHEAD)
+
+    @staticmethod
+    def shrink():
+        SyncWindow.lookahead = max(
+            SyncWindow.lookahead // 2, settings.HUB_SYNC_MIN_LOOKAHEAD)
+
 
+CHAIN_SYNC_METRICS_KEY = 'chain_sync_metrics'
 
-def concurrently_retrieve_state(contract_interface, contract_event_decoder, verbose):
+
+def chain_sync_metrics():
+    return cache.get(CHAIN_SYNC_METRICS_KEY)
+
+
+def record_chain_sync_metrics(blocks_committed, elapsed, blocks_behind):
+    metrics = {
+        'blocks_committed': blocks_committed,
+        'seconds': elapsed,
+        'blocks_per_second': blocks_committed / elapsed if elapsed else 0,
+        'blocks_behind': blocks_behind,
+        'lookahead': SyncWindow.lookahead,
+    }
+    logger.info('Committed {} blocks in {:.2f}s ({:.2f} blocks/s), {} behind, lookahead {}.'.format(
+        blocks_committed, elapsed, metrics.get('blocks_per_second'), blocks_behind, SyncWindow.lookahead))
+    cache.set(CHAIN_SYNC_METRICS_KEY, metrics, timeout=None)
+    return metrics
+
+
+def concurrently_retrieve_state(contract_interface, contract_event_decoder, verbose, block_fetcher=None):
     logger.info('Retrieve blocks.')
     latest_chain_block = contract_interface.current_block() - 1
     if not settings.DEBUG:
@@ -65,115 +233,162 @@ def concurrently_retrieve_state(contract_interface, contract_event_decoder, verb
         logger.info('No new blocks to confirm.')
 
     update_from = min(running_from, confirm_from)
-    update_until = min(update_from + 11, running_until + 1)
+    update_until = min(update_from + settings.HUB_MAX_BLOCKS_PER_SYNC,
+                       running_until + 1)
     skipped = running_until + 1 - update_until
 
-    contract_state_tasks = []
-    contract_state_tasks_block_numbers = []
+    # logs of the confirmed blocks in this window are retrieved at once instead of per block
+    confirmed_logs = {}
+    logs_until = min(confirm_until, update_until - 1)
+    if confirm_from <= logs_until:
+        logger.info('Retrieving logs [{},{}]'.format(confirm_from, logs_until))
+        confirmed_logs = fetch_confirmed_logs(
+            contract_interface, confirm_from, logs_until)
+
+    if block_fetcher is None:
+        block_fetcher = CeleryBlockFetcher()
 
-    logger.info('Fetching [{},{})'.format(update_from, update_until))
-    for block_number in range(update_from, update_until):
-        if confirm_from <= block_number and block_number <= confirm_until:
-            contract_state_tasks.append(
-                fetch_confirmed_block.delay(block_number=block_number))
-            contract_state_tasks_block_numbers.append(block_number)
-        elif running_from <= block_number and block_number <= running_until:
-            contract_state_tasks.append(
-                fetch_running_block.delay(block_number=block_number))
-            contract_state_tasks_block_numbers.append(block_number)
+    # fetches are dispatched ahead of the block being committed, and committed strictly in order
+    in_flight = deque()
+    next_block_number = update_from
+    blocks_committed = 0
+    started = time.monotonic()
 
-    for task_index, contract_state_task in enumerate(contract_state_tasks):
-        block_number = contract_state_tasks_block_numbers[task_index]
+    logger.info('Fetching [{},{}) with lookahead {}'.format(
+        update_from, update_until, SyncWindow.lookahead))
+    while in_flight or next_block_number < update_until:
+        while next_block_number < update_until and len(in_flight) < SyncWindow.lookahead:
+            block_number = next_block_number
+            next_block_number += 1
+            if confirm_from <= block_number and block_number <= confirm_until:
+                in_flight.append((block_number, block_fetcher.dispatch(
+                    block_number, confirmed=True)))
+            elif running_from <= block_number and block_number <= running_until:
+                in_flight.append((block_number, block_fetcher.dispatch(
+                    block_number, confirmed=False)))
+
+        if not in_flight:
+            break
+
+        block_number, fetch = in_flight.popleft()
+        fetch_was_ready = block_fetcher.is_ready(fetch)
 
         try:
-            task_result = contract_state_task.get(
-                timeout=settings.HUB_BLOCK_FETCH_TIMEOUT,
-                disable_sync_subtasks=False)
+            task_result = block_fetcher.result(fetch)
         except exceptions.TimeoutError:
             logger.error('Timed-out fetching block {}'.format(block_number))
-            for cleanup_index, task_to_clean_up in enumerate(contract_state_tasks):
-                if cleanup_index >= task_index:
-                    try:
-                        task_to_clean_up.forget()
-                    except NotImplementedError as e:
-                        logger.error('Could not forget task results.')
-                        logger.error(e)
+            block_fetcher.cancel(fetch)
+            for _, fetch_to_clean_up in in_flight:
+                block_fetcher.cancel(fetch_to_clean_up)
+            SyncWindow.shrink()
             break
 
-        if confirm_from <= block_number and block_number <= confirm_until:
-            confirmed_contract_state_dictionary, confirmed_contract_ledger_state_dictionaries, block_logs = task_result
-
-            confirmed_contract_state = ContractState.from_dictionary_form(
-                confirmed_contract_state_dictionary)
-            confirmed_ledger_states = [ContractLedgerState.from_dictionary_form(ledger_state, confirmed_contract_state) for ledger_state in
-                                       confirmed_contract_ledger_state_dictionaries]
-            with transaction.atomic():
-                if running_from <= block_number and block_number <= running_until:
-                    confirmed_contract_state.save()
-                    for ledger_state in confirmed_ledger_states:
-                        ledger_state.contract_state = confirmed_contract_state
-                        ledger_state.save()
-
-                logger.info('Decoding logs for block {}.'.format(
-                    confirmed_contract_state.block))
-                decoded_logs = contract_event_decoder.decode_many(block_logs)
-                eon_number = confirmed_contract_state.eon_number()
-                logger.info("Processing decoded logs in block %d eon %s: %d logs" % (
-                    confirmed_contract_state.block, eon_number, len(decoded_logs)))
-                for log in decoded_logs:
-
-                    if log.get(u'name') in event_interpreter_map:
-                        interpreter = event_interpreter_map.get(
-                            log.get(u'name'))
-                        interpreter.interpret(
-                            decoded_event=log.get('data'),
-                            txid=log.get('txid'),
-                            block_number=confirmed_contract_state.block,
-                            eon_number=eon_number,
-                            verbose=verbose) if interpreter else None
-                    else:
+        # the committer waited on the network, so more fetches can be kept in flight
+        if not fetch_was_ready:
+            SyncWindow.grow()
+
+        commit_block(
+            block_number,
+            task_result,
+            confirmed_logs,
+            contract_event_decoder,
+            running_from,
+            running_until,
+            confirm_from,
+            confirm_until,
+            verbose)
+        blocks_committed += 1
+
+    record_chain_sync_metrics(
+        blocks_committed,
+        time.monotonic() - started,
+        running_until - (update_from + blocks_committed - 1))
+    return skipped
+
+
+def commit_block(block_number, task_result, confirmed_logs, contract_event_decoder, running_from, running_until, confirm_from, confirm_until, verbose):
+    if confirm_from <= block_number and block_number <= confirm_until:
+        confirmed_contract_state_dictionary, confirmed_contract_ledger_state_dictionaries, _ = task_result
+        block_logs = confirmed_logs.get(block_number, [])
+        transaction_hashes = confirmed_contract_state_dictionary.pop(
+            'transaction_hashes', [])
+
+        confirmed_contract_state = ContractState.from_dictionary_form(
+            confirmed_contract_state_dictionary)
+        confirmed_contract_state.confirmed = True
+        confirmed_ledger_states = [ContractLedgerState.from_dictionary_form(ledger_state, confirmed_contract_state) for ledger_state in
+                                   confirmed_contract_ledger_state_dictionaries]
+
+        running_state_buffer = RunningStateBuffer()
+        try:
+            running_state_buffer.check_confirmed(confirmed_contract_state_dictionary)
+        except ValueError as e:
+            logger.error(e)
+            send_admin_email(
+                subject='Chain Sync Reorganization {}'.format(block_number),
+                content='{}'.format(e))
+            raise Exception()
+
+        with transaction.atomic():
+            # only confirmed states are stored, running states are kept in the running state buffer.
+            # the block leaves the buffer and becomes the confirmed head only once its state is stored,
+            # so a failed block is checked against its parent and interpreted again when it is retried
+            transaction.on_commit(
+                lambda: running_state_buffer.confirm(confirmed_contract_state_dictionary))
+            confirmed_contract_state.save()
+            for ledger_state in confirmed_ledger_states:
+                ledger_state.contract_state = confirmed_contract_state
+                ledger_state.save()
+
+            logger.info('Decoding logs for block {}.'.format(
+                confirmed_contract_state.block))
+            decoded_logs = contract_event_decoder.decode_many(block_logs)
+            eon_number = confirmed_contract_state.eon_number()
+            logger.info("Processing decoded logs in block %d eon %s: %d logs" % (
+                confirmed_contract_state.block, eon_number, len(decoded_logs)))
+            # consecutive logs of the same event are interpreted together, keeping the order of the block
+            for name, logs in groupby(decoded_logs, key=lambda log: log.get(u'name')):
+                logs = list(logs)
+                if name in event_interpreter_map:
+                    interpreter = event_interpreter_map.get(name)
+                    interpreter.interpret_many(
+                        decoded_logs=logs,
+                        block_number=confirmed_contract_state.block,
+                        eon_number=eon_number,
+                        verbose=verbose) if interpreter else None
+                else:
+                    for log in logs:
                         logger.error('UNKNOWN EVENT LOG {} '.format(log))
                         send_admin_email(
                             subject='Chain Sync Error: Unknown Log',
                             content='{}'.format(log))
 
-                running_contract_state = LocalViewInterface.running(
-                    block_number=confirmed_contract_state.block)
+            logger.info('Block {} confirmed.'.format(
+                confirmed_contract_state.block))
+            LocalViewInterface.invalidate()
 
-                if running_contract_state.confirm(confirmed_contract_state, confirmed_ledger_states):
-                    logger.info('Block {} confirmed.'.format(
-                        confirmed_contract_state.block))
-                else:
-                    logger.error('Block {} failed to confirm.'.format(
-                        confirmed_contract_state.block))
-                    send_admin_email(
-                        subject='Chain Sync Confirmation Failure {}'.format(
-                            confirmed_contract_state.block),
-                        content='{}'.format(confirmed_contract_state))
-                    raise Exception()
-        elif running_from <= block_number and block_number <= running_until:
-            logger.info('Process running block {}'.format(block_number))
-            confirmed_contract_state_dictionary, confirmed_contract_ledger_state_dictionaries = task_result
-
-            contract_state = ContractState.from_dictionary_form(
-                confirmed_contract_state_dictionary)
-            contract_state.save()
-            ledger_states = [ContractLedgerState.from_dictionary_form(ledger_state, contract_state) for ledger_state in
-                             confirmed_contract_ledger_state_dictionaries]
-            for ledger_state in ledger_states:
-                ledger_state.save()
-            logger.info('Running block {} stored.'.format(
-                contract_state.block))
-        else:
-            logger.info('Running from {} to {}.'.format(
-                running_from, running_until))
-            logger.info('Confirm from {} to {}.'.format(
-                confirm_from, confirm_until))
-            logger.info('Update from {} to {}.'.format(
-                update_from, update_until))
-            logger.error('Unexpected block number {}'.format(block_number))
-            send_admin_email(
-                subject='Chain Sync Unexpected Block {}'.format(block_number),
-                content='Out of order processing.')
-            raise Exception()
-    return skipped
+        ReceiptWatcher().observe(
+            block_number, transaction_hashes, confirmed=True)
+    elif running_from <= block_number and block_number <= running_until:
+        logger.info('Process running block {}'.format(block_number))
+        running_contract_state_dictionary, running_contract_ledger_state_dictionaries = task_result
+        transaction_hashes = running_contract_state_dictionary.pop(
+            'transaction_hashes', [])
+
+        if not RunningStateBuffer().push(running_contract_state_dictionary, running_contract_ledger_state_dictionaries):
+            logger.warning('Running chain reorganized at block {}.'.format(
+                block_number))
+        LocalViewInterface.invalidate()
+        ReceiptWatcher().observe(
+            block_number, transaction_hashes, confirmed=False)
+        logger.info('Running block {} stored.'.format(block_number))
+    else:
+        logger.info('Running from {} to {}.'.format(
+            running_from, running_until))
+        logger.info('Confirm from {} to {}.'.format(
+            confirm_from, confirm_until))
+        logger.error('Unexpected block number {}'.format(block_number))
+        send_admin_email(
+            subject='Chain Sync Unexpected Block {}'.format(block_number),
+            content='Out of order processing.')
+        raise Exception()
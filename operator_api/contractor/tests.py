@@ -1,12 +1,34 @@
+import gzip
+import json
+import pickle
 import random
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 
 from django.conf import settings
-from eth_utils import remove_0x_prefix
-
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase
+from eth_abi import encode_abi
+from eth_utils import remove_0x_prefix, decode_hex, encode_hex, keccak
+from hexbytes import HexBytes
+from web3 import Web3
+
+from contractor.benchmark import synthetic_contract_logs, reference_decode, SyntheticChain, JSONRPCStubServer, ChainSyncBenchmark, ChallengeResponseBenchmark
+from contractor.decoders import NOCUSTContractEventDecoder
+from contractor.interpreters import DepositInterpreter, WithdrawalRequestInterpreter
+from contractor.interfaces import LocalViewInterface, NOCUSTContractInterface, RunningStateBuffer, EonClock, NonceAllocator
+from contractor.interfaces.json_rpc_batch import FakeJSONRPCTransport, HTTPJSONRPCTransport, JSONRPCBatch, JSONRPCError
+from contractor.interfaces.nocust_contract_interface import contract_state_variables_types, contract_ledger_state_variables_types, challenge_record_types
+from contractor.models import ContractParameters, ContractState, ContractLedgerState, EthereumTransaction, InFlightTransaction
 from contractor.rpctestcase import RPCTestCase
 from contractor.tasks import respond_to_challenges, slash_bad_withdrawals, confirm_withdrawals
-from contractor.tasks.send_queued_transactions import send_queued_transactions
+from contractor.tasks.send_queued_transactions import send_queued_transactions, TransactionScheduler, TRANSACTION_METRICS_KEY, \
+    TRANSACTION_ATTEMPT_INDEX_KEY, ReceiptWatcher, transaction_queue_metrics, urgency, gas_escalation, resend_interval, confirm_delivery, \
+    reschedule_unused_nonces
+from contractor.tasks.prune_contract_states import prune_contract_states, archive_path
 from operator_api import crypto, merkle_tree, testrpc_accounts
+from operator_api.models import MockModel
+from operator_api.models.mutex_model import strict_redis_client
 from operator_api.merkle_tree import calculate_merkle_proof
 from operator_api.simulation.deposit import create_random_deposits, make_deposit
 from operator_api.simulation.withdrawal import place_parallel_withdrawals
@@ -16,9 +38,10 @@ from operator_api.simulation.registration import register_testrpc_accounts
 from operator_api.simulation.tokens import deploy_new_test_token, distribute_token_balance_to_addresses
 from operator_api.simulation.swap import send_swap, freeze_last_swap, finalize_last_swap, cancel_last_swap, init_swap_challenge, freeze_swap, cancel_swap, finalize_swap
 from operator_api.tx_merkle_tree import TransactionMerkleTree
-from operator_api.util import cyan, long_string_to_list, csf_to_list
+from operator_api.util import cyan, long_string_to_list, csf_to_list, ZERO_CHECKSUM
+from ledger.challenge_proofs import ChallengeProofBundle
 from ledger.context.wallet_transfer import WalletTransferContext
-from ledger.models import Wallet, TokenCommitment, Token, RootCommitment, TokenPair, WithdrawalRequest, Withdrawal, Transfer
+from ledger.models import Wallet, TokenCommitment, ExclusiveBalanceAllotment, Token, RootCommitment, TokenPair, WithdrawalRequest, Withdrawal, Transfer, Deposit, BlacklistEntry
 from ledger.tests import simulate_eon_with_random_transfers
 from ledger.token_registration import register_token
 from swapper.tasks.cancel_finalize_swaps import cancel_finalize_swaps_for_eon
@@ -1897,3 +1920,694 @@ class ContractorTests(RPCTestCase):
             test_case=self,
             eon_number=5)
         commit_eon(test_case=self, eon_number=6)
+
+
+class ContractStateBatchTests(TestCase):
+    def setUp(self):
+        self.cached_contract_parameters = LocalViewInterface.contract_parameters
+        LocalViewInterface.contract_parameters = ContractParameters(
+            genesis_block=10,
+            blocks_per_eon=20,
+            eons_kept=3,
+            challenge_cost=0)
+        self.tokens = [
+            Token.objects.create(
+                address="9561C133DD8580860B6b7E504bC5Aa500f0f06a7",
+                name='Ethereum',
+                short_name='ETH',
+                trail=0,
+                block=1),
+            Token.objects.create(
+                address="5b1869D9A4C187F2EAa108f3062412ecf0526b24",
+                name='Liquidity',
+                short_name='LQD',
+                trail=1,
+                block=1),
+            Token.objects.create(
+                address="CfEB869F69431e42cdB54A4F4f105C19C080A601",
+                name='Late',
+                short_name='LTE',
+                trail=2,
+                block=100),
+        ]
+
+    def tearDown(self):
+        LocalViewInterface.contract_parameters = self.cached_contract_parameters
+
+    def eth_call(self, params):
+        call, block_identifier = params
+        self.assertEqual(block_identifier, hex(51))
+        data = decode_hex(call.get('data'))
+        contract = NOCUSTContractInterface().contract
+        if encode_hex(data[:4]) == contract.encodeABI(fn_name='getServerContractStateVariables'):
+            return encode_hex(encode_abi(contract_state_variables_types, [b'\x01' * 32, 2, b'\x02' * 32, True, False, 0]))
+        eon_number, token_address = contract.decode_function_input(encode_hex(data))[1].values()
+        self.assertEqual(eon_number, 3)
+        trail = [t.address.lower() for t in self.tokens].index(remove_0x_prefix(token_address).lower())
+        return encode_hex(encode_abi(contract_ledger_state_variables_types, [trail, 0, 10 * trail, 9 * trail]))
+
+    def block_header(self, params):
+        self.assertEqual(params, [hex(51), False])
+        return {'number': hex(51), 'hash': '0x' + '51' * 32, 'parentHash': '0x' + '50' * 32}
+
+    def test_fetch_contract_state_in_one_batch(self):
+        transport = FakeJSONRPCTransport({'eth_call': self.eth_call, 'eth_getBlockByNumber': self.block_header})
+        contract_state, ledger_states = NOCUSTContractInterface(rpc_transport=transport)\
+            .fetch_contract_state_at_block(block_number=51)
+
+        ledger_states = sorted(ledger_states, key=lambda s: s.token.trail)
+        self.assertEqual(transport.round_trips, 1)
+        self.assertEqual(transport.requests, 4)
+        self.assertEqual(contract_state.block, 51)
+        self.assertEqual(contract_state.block_hash, '0x' + '51' * 32)
+        self.assertEqual(contract_state.parent_hash, '0x' + '50' * 32)
+        self.assertEqual(contract_state.last_checkpoint_submission_eon, 2)
+        self.assertTrue(contract_state.is_checkpoint_submitted_for_current_eon)
+        self.assertEqual([s.token for s in ledger_states], self.tokens[:2])
+        self.assertEqual([s.deposits for s in ledger_states], [0, 10])
+        self.assertEqual([s.total_balance for s in ledger_states], [0, 9])
+
+    def test_failed_ledger_call_is_zeroed(self):
+        def eth_call(params):
+            if len(decode_hex(params[0].get('data'))) > 4:
+                raise ValueError('execution reverted')
+            return self.eth_call(params)
+
+        contract_state, ledger_states = NOCUSTContractInterface(rpc_transport=FakeJSONRPCTransport({'eth_call': eth_call}))\
+            .fetch_contract_state_at_block(block_number=51)
+
+        self.assertIsNotNone(contract_state)
+        self.assertEqual(len(ledger_states), 2)
+        self.assertEqual([s.total_balance for s in ledger_states], [0, 0])
+
+    def test_batches_share_the_transport_of_the_interface(self):
+        contract_interface = NOCUSTContractInterface()
+        self.assertIsInstance(contract_interface.rpc_transport, HTTPJSONRPCTransport)
+        self.assertIs(contract_interface.contract_state_batch(block_number=51)[0].transport,
+                      contract_interface.rpc_transport)
+
+    def test_refused_batch_fails_every_request(self):
+        transport = FakeJSONRPCTransport({'eth_call': self.eth_call}, max_batch_size=1)
+        batch = JSONRPCBatch(transport=transport)
+        batch.add('eth_call', [])
+        batch.add('eth_blockNumber', [])
+
+        results = batch.execute()
+        self.assertEqual(len(results), 2)
+        for result in results:
+            self.assertIsInstance(result, JSONRPCError)
+            self.assertEqual(result.args[0].get('message'), 'Batch too large')
+
+    def test_batch_posted_by_the_caller(self):
+        transport = FakeJSONRPCTransport({'eth_call': self.eth_call})
+        contract_interface = NOCUSTContractInterface(rpc_transport=transport)
+        batch, tokens = contract_interface.contract_state_batch(block_number=51)
+
+        self.assertEqual(transport.round_trips, 0)
+        self.assertEqual(sorted(tokens, key=lambda t: t.trail), self.tokens[:2])
+        contract_state, ledger_states = contract_interface.contract_state_from_results(
+            51, tokens, batch.results(reversed(transport(batch.requests))))
+
+        ledger_states = sorted(ledger_states, key=lambda s: s.token.trail)
+        self.assertEqual(contract_state.last_checkpoint_submission_eon, 2)
+        self.assertEqual([s.deposits for s in ledger_states], [0, 10])
+
+
+    def test_challenge_records_in_one_batch(self):
+        def eth_call(params):
+            contract = NOCUSTContractInterface().contract
+            token_address, sender, recipient = contract.decode_function_input(params[0].get('data'))[1].values()
+            if recipient == sender:
+                raise ValueError('execution reverted')
+            return encode_hex(encode_abi(challenge_record_types, [1, 5, 2, 0, 0, 0, 0, int(recipient[-2:], 16), 0]))
+
+        transport = FakeJSONRPCTransport({'eth_call': eth_call})
+        keys = [(self.tokens[0].address, '0x' + '{:02x}'.format(i) * 20, '0x' + '11' * 20) for i in [0x11, 2, 3]]
+        records = NOCUSTContractInterface(rpc_transport=transport).get_challenge_records(keys)
+
+        self.assertEqual(transport.round_trips, 1)
+        self.assertEqual([r.deliveredTxNonce for r in records[1:]], [2, 3])
+        self.assertEqual(records[1].challengeStage, 1)
+        self.assertIsInstance(records[0], JSONRPCError)
+
+class EventDecoderTests(TestCase):
+    def test_compiled_decoding_matches_reference(self):
+        decoder = NOCUSTContractEventDecoder()
+        logs = synthetic_contract_logs(log_count=60, seed=7)
+        logs.append(dict(logs[0], topics=['0x' + '00' * 32]))
+
+        decoded = decoder.decode_many(logs)
+
+        self.assertEqual(len(decoded), 60)
+        self.assertEqual(decoded, [reference_decode(decoder.events, log) for log in logs[:60]])
+        self.assertEqual({d.get('name') for d in decoded},
+                         {event.get('name') for event in decoder.events.values()})
+        self.assertIsNone(decoder.decode(logs[-1]))
+
+
+class LocalViewCacheTests(TransactionTestCase):
+    def setUp(self):
+        self.cached_contract_parameters = LocalViewInterface.contract_parameters
+        LocalViewInterface.contract_parameters = ContractParameters.objects.create(
+            genesis_block=10,
+            blocks_per_eon=20,
+            eons_kept=3,
+            challenge_cost=0)
+        LocalViewInterface.invalidate()
+
+    def tearDown(self):
+        LocalViewInterface.contract_parameters = self.cached_contract_parameters
+        LocalViewInterface.invalidate()
+
+    def save_contract_state(self, block, confirmed):
+        ContractState.objects.create(
+            block=block,
+            confirmed=confirmed,
+            basis=ZERO_CHECKSUM,
+            last_checkpoint_submission_eon=0,
+            last_checkpoint=ZERO_CHECKSUM,
+            is_checkpoint_submitted_for_current_eon=False,
+            has_missed_checkpoint_submission=False,
+            live_challenge_count=0)
+
+    def test_views_are_cached_until_invalidated(self):
+        self.save_contract_state(10, True)
+        self.save_contract_state(31, False)
+        LocalViewInterface.invalidate()
+
+        self.assertEqual(LocalViewInterface.latest().block, 31)
+        self.assertEqual(LocalViewInterface.confirmed().block, 10)
+        self.assertIsNone(LocalViewInterface.confirmed(eon_number=2))
+
+        self.save_contract_state(32, True)
+        with self.assertNumQueries(0):
+            self.assertEqual(LocalViewInterface.latest().block, 31)
+            self.assertIsNone(LocalViewInterface.confirmed(eon_number=2))
+
+        LocalViewInterface.invalidate()
+        self.assertEqual(LocalViewInterface.latest().block, 32)
+        self.assertEqual(LocalViewInterface.confirmed().block, 32)
+        self.assertEqual(LocalViewInterface.confirmed(eon_number=2).block, 32)
+
+
+class ContractStatePruningTests(TransactionTestCase):
+    def setUp(self):
+        self.cached_contract_parameters = LocalViewInterface.contract_parameters
+        LocalViewInterface.contract_parameters = ContractParameters.objects.create(
+            genesis_block=10,
+            blocks_per_eon=20,
+            eons_kept=1,
+            challenge_cost=0)
+        LocalViewInterface.invalidate()
+        self.archive_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        LocalViewInterface.contract_parameters = self.cached_contract_parameters
+        LocalViewInterface.invalidate()
+        self.archive_dir.cleanup()
+
+    def test_old_eons_are_archived_except_boundaries(self):
+        token = Token.objects.create(
+            address="9561C133DD8580860B6b7E504bC5Aa500f0f06a7",
+            name='Ethereum',
+            short_name='ETH',
+            trail=0,
+            block=1)
+        for block in [10, 15, 20, 29, 30, 35, 50]:
+            contract_state = ContractState.objects.create(
+                block=block,
+                confirmed=True,
+                basis=ZERO_CHECKSUM,
+                last_checkpoint_submission_eon=0,
+                last_checkpoint=ZERO_CHECKSUM,
+                is_checkpoint_submitted_for_current_eon=False,
+                has_missed_checkpoint_submission=False,
+                live_challenge_count=0)
+            ContractLedgerState.objects.create(
+                contract_state=contract_state,
+                token=token,
+                pending_withdrawals=0,
+                confirmed_withdrawals=0,
+                deposits=block,
+                total_balance=block)
+        LocalViewInterface.invalidate()
+
+        with self.settings(HUB_CONTRACT_STATE_ARCHIVE_DIR=self.archive_dir.name):
+            self.assertEqual(prune_contract_states(), 2)
+            self.assertEqual(prune_contract_states(), 0)
+
+            with gzip.open(archive_path(1), 'rt') as archive_file:
+                archived = [json.loads(line) for line in archive_file]
+
+        self.assertEqual(list(ContractState.objects.order_by('block').values_list('block', flat=True)),
+                         [10, 29, 30, 35, 50])
+        self.assertEqual(ContractLedgerState.objects.count(), 5)
+        self.assertEqual([state.get('block') for state in archived], [15, 20])
+        self.assertEqual([state.get('ledger_states')[0].get('deposits') for state in archived], [15, 20])
+
+
+class RunningStateBufferTests(TestCase):
+    def setUp(self):
+        self.buffer = RunningStateBuffer(size=4)
+        self.buffer.redis.delete('running_states', 'running_state_blocks', 'confirmed_state_head')
+
+    def tearDown(self):
+        self.buffer.redis.delete('running_states', 'running_state_blocks', 'confirmed_state_head')
+
+    @staticmethod
+    def state(block, fork=''):
+        return {
+            'block': block,
+            'confirmed': False,
+            'basis': ZERO_CHECKSUM,
+            'last_checkpoint_submission_eon': 0,
+            'last_checkpoint': ZERO_CHECKSUM,
+            'is_checkpoint_submitted_for_current_eon': False,
+            'has_missed_checkpoint_submission': False,
+            'live_challenge_count': block,
+            'block_hash': '{}{}'.format(fork, block),
+            'parent_hash': '{}{}'.format(fork, block - 1),
+        }
+
+    def test_running_chain(self):
+        for block in range(1, 8):
+            self.assertTrue(self.buffer.push(self.state(block), []))
+
+        self.assertEqual(self.buffer.running().block, 7)
+        self.assertEqual(self.buffer.running(5).live_challenge_count, 5)
+        self.assertIsNone(self.buffer.running(3))
+
+        self.buffer.confirm(self.state(4))
+        self.assertIsNone(self.buffer.running(4))
+        self.assertEqual(self.buffer.running(5).block, 5)
+
+    def test_reorganization_drops_the_stale_fork(self):
+        for block in range(1, 6):
+            self.buffer.push(self.state(block), [])
+
+        self.assertFalse(self.buffer.push(self.state(4, fork='b'), []))
+        self.assertEqual(self.buffer.running().block, 4)
+        self.assertEqual(self.buffer.hashes_at(4), ['b4'])
+        # older blocks of the abandoned fork are dropped as well
+        self.assertEqual(self.buffer.hashes_at('-inf', 3), [])
+        self.assertTrue(self.buffer.push(self.state(5, fork='b'), []))
+        self.assertEqual(self.buffer.hashes_at(5), ['b5'])
+
+    def test_confirmed_blocks_must_extend_each_other(self):
+        self.buffer.confirm(self.state(1))
+        self.buffer.confirm(self.state(2))
+        with self.assertRaises(ValueError):
+            self.buffer.check_confirmed(self.state(3, fork='b'))
+        self.buffer.check_confirmed(self.state(3))
+
+
+class ChainSyncBenchmarkTests(TransactionTestCase):
+    def test_stub_serves_synthetic_chain(self):
+        chain = SyntheticChain(block_count=10, recipients=['0x' + '11' * 20], deposits_per_block=2)
+        transport = FakeJSONRPCTransport(chain.handlers())
+        with JSONRPCStubServer(transport) as server, self.settings(HUB_ETHEREUM_NODE_URL=server.url):
+            contract_interface = NOCUSTContractInterface()
+            self.assertEqual(contract_interface.current_block(), 11)
+            self.assertEqual(contract_interface.get_blocks_per_eon(), 180)
+            self.assertEqual(contract_interface.get_block(5).get('parentHash'),
+                             contract_interface.get_block(4).get('hash'))
+            self.assertEqual(len(contract_interface.get_contract_logs(1, 11)), 20)
+
+    def test_sync_synthetic_chain(self):
+        report = ChainSyncBenchmark(block_count=30, in_process=False).run()
+
+        self.assertEqual(report.get('blocks'), 30 if not settings.DEBUG else 29)
+        self.assertGreater(report.get('confirmed_blocks'), 0)
+        self.assertEqual(report.get('deposits'), report.get('confirmed_blocks'))
+
+
+class BatchedInterpretationTests(TestCase):
+    def setUp(self):
+        self.token = Token.objects.create(
+            address="9561C133DD8580860B6b7E504bC5Aa500f0f06a7",
+            name='Ethereum',
+            short_name='ETH',
+            trail=0,
+            block=1)
+        self.wallets = [
+            Wallet.objects.create(
+                address='{:040x}'.format(index + 1).upper(),
+                token=self.token,
+                registration_eon_number=0)
+            for index in range(3)]
+
+    def log(self, wallet_address, amount, index, account_field):
+        return {
+            'name': None,
+            'txid': '0x{:064x}'.format(index),
+            'data': {
+                'token': '0x' + '00' * 12 + self.token.address.lower(),
+                account_field: '0x' + '00' * 12 + wallet_address.lower(),
+                'amount': amount,
+            },
+        }
+
+    def test_deposits_of_a_block_are_inserted_together(self):
+        logs = [self.log(wallet.address, 10 * (index + 1), index, 'recipient')
+                for index, wallet in enumerate(self.wallets + self.wallets[:1])]
+        logs.append(self.log('ff' * 20, 5, 9, 'recipient'))
+
+        DepositInterpreter().interpret_many(logs, block_number=20, eon_number=2)
+
+        deposits = Deposit.objects.order_by('txid')
+        self.assertEqual([deposit.wallet for deposit in deposits], self.wallets + self.wallets[:1])
+        self.assertEqual([int(deposit.amount) for deposit in deposits], [10, 20, 30, 40])
+        self.assertTrue(all(deposit.block == 20 and deposit.eon_number == 2 for deposit in deposits))
+        self.assertTrue(BlacklistEntry.objects.filter(address__iexact='ff' * 20).exists())
+
+    def test_withdrawal_requests_of_a_block_are_inserted_together(self):
+        logs = [self.log(wallet.address, 7, index, 'requestor')
+                for index, wallet in enumerate(self.wallets)]
+
+        WithdrawalRequestInterpreter().interpret_many(logs, block_number=20, eon_number=2)
+
+        self.assertEqual(
+            set(WithdrawalRequest.objects.values_list('wallet', flat=True)),
+            {wallet.id for wallet in self.wallets})
+
+
+class EonClockTests(TestCase):
+    def setUp(self):
+        self.cached_contract_parameters = LocalViewInterface.contract_parameters
+        LocalViewInterface.contract_parameters = ContractParameters(
+            genesis_block=10,
+            blocks_per_eon=20,
+            eons_kept=3,
+            challenge_cost=0)
+
+    def tearDown(self):
+        LocalViewInterface.contract_parameters = self.cached_contract_parameters
+
+    def test_block_arithmetic_does_not_query(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(EonClock.eon_number_and_sub_block(10), (1, 0))
+            self.assertEqual(EonClock.eon_number_and_sub_block(49), (2, 19))
+            self.assertEqual(EonClock.eon_number(50), 3)
+            self.assertEqual(EonClock.sub_block(51), 1)
+            self.assertEqual(EonClock.eon_block_range(2), (30, 50))
+            self.assertEqual(ContractState(block=75).eon_number_and_sub_block(), (4, 5))
+
+
+class ChallengeResponseTests(TestCase):
+    def test_bundle_decodes_allotment(self):
+        token = Token(id=1, address='9561C133DD8580860B6b7E504bC5Aa500f0f06a7')
+        wallet = Wallet(id=7, address='11' * 20, token=token)
+        allotment = ExclusiveBalanceAllotment(
+            wallet=wallet,
+            eon_number=3,
+            left=10,
+            right=25,
+            merkle_proof_hashes='ab' * 32 + 'cd' * 32,
+            merkle_proof_values='5,9',
+            merkle_proof_trail=1)
+        token_commitment = TokenCommitment(
+            token=token,
+            membership_hashes='ef' * 32)
+
+        bundle = pickle.loads(pickle.dumps(
+            ChallengeProofBundle(allotment, token_commitment)))
+
+        self.assertEqual(bundle.wallet_id, 7)
+        self.assertEqual(bundle.amount, 15)
+        self.assertEqual(bundle.allotment_chain, [b'\xab' * 32, b'\xcd' * 32])
+        self.assertEqual(bundle.membership_chain, [b'\xef' * 32])
+        self.assertEqual(bundle.values, [5, 9])
+        self.assertEqual(bundle.l_r, [10, 25])
+        self.assertEqual(bundle.tx_set_root, b'\0' * 32)
+        self.assertEqual(bundle.deltas, [0, 0])
+        self.assertEqual(bundle.v, [0, 0])
+        self.assertEqual(bundle.transfers_eon_number, 2)
+
+    def test_pool_answers_all_challenges(self):
+        report = ChallengeResponseBenchmark(challenge_count=64, workers=4, latency=0.001).run()
+
+        self.assertEqual(report.get('challenges'), 64)
+        self.assertGreater(report.get('pool_challenges_per_second'), 0)
+
+
+class TransactionSchedulerTests(TestCase):
+    class StubInterface(object):
+        web3 = Web3
+
+        def __init__(self):
+            self.receipts = {}
+
+        def get_transaction_receipts(self, transaction_hashes):
+            return [self.receipts.get(transaction_hash) for transaction_hash in transaction_hashes]
+
+        def sign_for_delivery_as_owner(self, transaction, gas_price):
+            return MockModel(rawTransaction=HexBytes(keccak(text='{} {}'.format(transaction.nonce, gas_price))))
+
+        def send_raw_transaction(self, raw_transaction):
+            return HexBytes(keccak(raw_transaction))
+
+    def setUp(self):
+        strict_redis_client.delete(
+            TRANSACTION_METRICS_KEY, TRANSACTION_ATTEMPT_INDEX_KEY)
+        self.transaction = EthereumTransaction.objects.create(
+            chain_id=1,
+            from_address='11' * 20,
+            to_address='22' * 20,
+            gas=21000,
+            data='00',
+            value=0,
+            nonce=0,
+            tag='checkpoint')
+        InFlightTransaction.objects.create(
+            transaction=self.transaction,
+            queued_block=100,
+            deadline_block=120)
+
+    def attempts(self):
+        return list(self.transaction.ethereumtransactionattempt_set.order_by('gas_price'))
+
+    def test_urgency_curve(self):
+        in_flight = InFlightTransaction(queued_block=100, deadline_block=120)
+        self.assertEqual(urgency(in_flight, 100), 0)
+        self.assertEqual(urgency(in_flight, 110), 0.5)
+        self.assertEqual(urgency(in_flight, 130), 1)
+        self.assertEqual(urgency(InFlightTransaction(queued_block=100), 1000), 0)
+
+        with self.settings(HUB_TX_GAS_ESCALATION=2.0, HUB_TX_GAS_ESCALATION_MAX=4.0, HUB_TX_GAS_ESCALATION_EXPONENT=2.0,
+                           HUB_TX_RESEND_BLOCKS=10):
+            self.assertEqual(gas_escalation(0), 2.0)
+            self.assertEqual(gas_escalation(0.5), 2.5)
+            self.assertEqual(gas_escalation(1), 4.0)
+            self.assertEqual(resend_interval(0), 10)
+            self.assertEqual(resend_interval(1), 1)
+
+    def test_escalates_and_confirms(self):
+        contract_interface = TransactionSchedulerTests.StubInterface()
+        scheduler = TransactionScheduler(contract_interface)
+
+        with self.settings(HUB_TX_INITIAL_GAS_PRICE_GWEI=100, HUB_TX_GAS_ESCALATION=2.0, HUB_TX_GAS_ESCALATION_MAX=4.0,
+                           HUB_TX_GAS_ESCALATION_EXPONENT=2.0, HUB_TX_RESEND_BLOCKS=10, HUB_LQD_CONTRACT_CONFIRMATIONS=3):
+            scheduler.run(100)
+            self.assertEqual([int(a.gas_price) for a in self.attempts()], [Web3.toWei(100, 'gwei')])
+
+            # half way to the deadline attempts are replaced every 5 blocks at 2.5 times the gas price
+            scheduler.run(104)
+            self.assertEqual(len(self.attempts()), 1)
+            scheduler.run(110)
+            self.assertEqual([int(a.gas_price) for a in self.attempts()],
+                             [Web3.toWei(100, 'gwei'), Web3.toWei(250, 'gwei')])
+
+            # the first attempt may still be the one mined, the watcher finds it in the synchronized blocks
+            first_attempt = self.attempts()[0]
+            watcher = ReceiptWatcher()
+            watcher.observe(111, ['0x' + '00' * 32, '0x' + first_attempt.hash], confirmed=False)
+            self.assertEqual(InFlightTransaction.objects.get().mined_block, 111)
+            scheduler.run(114)
+            self.assertEqual(len(self.attempts()), 2)
+
+            watcher.observe(111, ['0x' + first_attempt.hash], confirmed=True)
+            self.assertFalse(InFlightTransaction.objects.exists())
+            self.assertTrue(self.attempts()[0].confirmed)
+            self.assertFalse(strict_redis_client.exists(TRANSACTION_ATTEMPT_INDEX_KEY))
+
+            metrics = transaction_queue_metrics(114)
+            self.assertEqual(metrics.get('queue_depth'), 0)
+            self.assertEqual(metrics.get('confirmed'), 1)
+            self.assertEqual(metrics.get('mean_blocks_to_mine'), 11)
+
+    def test_unused_nonces_rescheduled(self):
+        delivered = EthereumTransaction.objects.create(
+            chain_id=1,
+            from_address=remove_0x_prefix(settings.HUB_OWNER_ACCOUNT_ADDRESS),
+            to_address='22' * 20,
+            gas=21000,
+            data='00',
+            value=0,
+            nonce=5,
+            tag='checkpoint')
+
+        reschedule_unused_nonces(6)
+        self.assertFalse(InFlightTransaction.objects.filter(transaction=delivered).exists())
+
+        # the block it was mined in was reorganized away
+        reschedule_unused_nonces(5)
+        self.assertIsNone(InFlightTransaction.objects.get(transaction=delivered).queued_block)
+
+    def test_migrated_transactions_left_out_of_metrics(self):
+        in_flight = InFlightTransaction.objects.get()
+        in_flight.queued_block = None
+        in_flight.save()
+
+        confirm_delivery(in_flight, [], 110)
+        self.assertFalse(InFlightTransaction.objects.exists())
+        self.assertEqual(transaction_queue_metrics(110).get('confirmed'), 0)
+
+    def test_receipts_polled_only_before_replacement(self):
+        contract_interface = TransactionSchedulerTests.StubInterface()
+        polled = []
+        get_transaction_receipts = contract_interface.get_transaction_receipts
+        contract_interface.get_transaction_receipts = lambda hashes: polled.append(
+            hashes) or get_transaction_receipts(hashes)
+        scheduler = TransactionScheduler(contract_interface)
+
+        with self.settings(HUB_TX_RESEND_BLOCKS=10, HUB_LQD_CONTRACT_CONFIRMATIONS=3):
+            scheduler.run(100)
+            scheduler.run(101)
+            scheduler.run(102)
+            self.assertEqual(polled, [])
+
+            # an attempt mined while the watcher was not indexing it is found before it is replaced
+            attempt = self.attempts()[0]
+            contract_interface.receipts[attempt.hash] = {'blockNumber': 102}
+            scheduler.run(110)
+            self.assertEqual(len(polled), 1)
+            self.assertEqual(len(self.attempts()), 1)
+            self.assertFalse(InFlightTransaction.objects.exists())
+            self.assertTrue(self.attempts()[0].confirmed)
+
+    def test_running_block_reorganized_away(self):
+        scheduler = TransactionScheduler(TransactionSchedulerTests.StubInterface())
+
+        with self.settings(HUB_LQD_CONTRACT_CONFIRMATIONS=3):
+            scheduler.run(100)
+            attempt = self.attempts()[0]
+            watcher = ReceiptWatcher()
+            watcher.observe(101, [attempt.hash], confirmed=False)
+            self.assertEqual(InFlightTransaction.objects.get().mined_block, 101)
+
+            # the confirmed block at that height does not include the attempt
+            watcher.observe(101, [], confirmed=True)
+            self.assertIsNone(InFlightTransaction.objects.get().mined_block)
+            self.assertIsNone(self.attempts()[0].mined)
+
+
+class NonceAllocatorTests(TestCase):
+    def setUp(self):
+        self.allocator = NonceAllocator(address='0x' + 'ab' * 20)
+        strict_redis_client.delete(self.allocator.key)
+
+    def tearDown(self):
+        strict_redis_client.delete(self.allocator.key)
+
+    def test_allocates_from_the_remote_nonce_once(self):
+        remote_calls = []
+
+        def remote_nonce():
+            remote_calls.append(1)
+            return 5
+
+        self.assertEqual(self.allocator.allocate(remote_nonce), 5)
+        self.assertEqual(self.allocator.allocate(remote_nonce), 6)
+        self.assertEqual(len(remote_calls), 1)
+        self.assertEqual(self.allocator.peek(), 7)
+
+    def test_raise_to_floor_only_raises(self):
+        self.allocator.allocate(lambda: 5)
+        self.assertEqual(self.allocator.raise_to_floor(3), 6)
+        self.assertEqual(self.allocator.raise_to_floor(10), 10)
+        self.assertEqual(self.allocator.allocate(lambda: 0), 10)
+
+        EthereumTransaction.objects.create(
+            chain_id=1,
+            from_address='ab' * 20,
+            to_address='22' * 20,
+            gas=21000,
+            data='00',
+            value=0,
+            nonce=20,
+            tag='slash')
+        self.assertEqual(self.allocator.raise_to_floor(0), 21)
+
+    def test_concurrent_allocations_are_unique(self):
+        self.allocator.reconcile(0)
+
+        def allocate(_):
+            try:
+                with transaction.atomic():
+                    return NonceAllocator(address='0x' + 'ab' * 20).allocate(lambda: 0)
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            nonces = list(executor.map(allocate, range(400)))
+        self.assertEqual(sorted(nonces), list(range(400)))
+
+
+class NonceRollbackTests(TransactionTestCase):
+    def setUp(self):
+        self.cached_contract_parameters = LocalViewInterface.contract_parameters
+        LocalViewInterface.contract_parameters = ContractParameters.objects.create(
+            genesis_block=10,
+            blocks_per_eon=20,
+            eons_kept=3,
+            challenge_cost=0)
+        LocalViewInterface.invalidate()
+
+        self.allocator = NonceAllocator()
+        strict_redis_client.delete(self.allocator.key)
+        self.allocator.reconcile(0)
+
+        self.contract_interface = NOCUSTContractInterface()
+        self.contract_interface._chain_id = 1
+
+    def tearDown(self):
+        strict_redis_client.delete(self.allocator.key)
+        LocalViewInterface.contract_parameters = self.cached_contract_parameters
+        LocalViewInterface.invalidate()
+
+    def queue(self, tag):
+        contract_transaction = MockModel(buildTransaction=lambda options: dict(
+            options, to='0x' + '22' * 20, data='0x00', value=0))
+        return self.contract_interface.queue_transaction_by_owner(contract_transaction, tag).nonce
+
+    def queue_rolled_back(self, tag):
+        with self.assertRaises(RuntimeError):
+            with transaction.atomic():
+                self.queue(tag)
+                raise RuntimeError()
+
+    def test_rolled_back_nonce_is_reused(self):
+        self.assertEqual(self.queue('first'), 0)
+        self.queue_rolled_back('rolled_back')
+
+        self.assertEqual(self.allocator.reconcile(0), 1)
+        self.assertEqual(self.queue('next'), 1)
+        self.assertEqual(
+            list(EthereumTransaction.objects.order_by('nonce').values_list('nonce', 'tag')),
+            [(0, 'first'), (1, 'next')])
+
+    def test_rolled_back_nonce_before_stored_ones_is_filled(self):
+        self.assertEqual(self.queue('first'), 0)
+        self.queue_rolled_back('rolled_back')
+        self.assertEqual(self.queue('after'), 2)
+
+        self.assertEqual(self.allocator.reconcile(0), 3)
+        self.assertEqual(self.queue('next'), 3)
+        self.assertEqual(
+            list(EthereumTransaction.objects.order_by('nonce').values_list('nonce', 'tag')),
+            [(0, 'first'), (1, 'nonce_gap_1'), (2, 'after'), (3, 'next')])
+
+        gap = EthereumTransaction.objects.get(nonce=1)
+        self.assertEqual(gap.to_address, gap.from_address)
+        self.assertEqual(gap.value, 0)
+        self.assertTrue(InFlightTransaction.objects.filter(transaction=gap).exists())
@@ -0,0 +1,105 @@
+import time
+from uuid import uuid4
+from django.conf import settings
+from django.db.models import Q
+from ledger.models import Transfer, Wallet, WithdrawalRequest
+from operator_api.models.mutex_model import strict_redis_client
+from swapper.models import SwapCursor
+
+ACCOUNTING_HEARTBEAT_KEY = 'accounting_heartbeat'
+
+# deletes the guard only if it still belongs to the heartbeat finishing
+RELEASE_HEARTBEAT_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+# One accounting heartbeat runs at a time. A heartbeat takes the guard before dispatching its stages
+# and the task finishing its chord gives it back, beats arriving in between are skipped. The guard
+# expires on its own should the chord never finish.
+def begin_heartbeat(redis_client=None):
+    redis_client = redis_client or strict_redis_client
+    token = '{}:{}'.format(uuid4().hex, time.time())
+    if not redis_client.set(ACCOUNTING_HEARTBEAT_KEY, token, nx=True, ex=settings.HUB_ACCOUNTING_HEARTBEAT_TIMEOUT):
+        return None
+    return token
+
+
+# returns the seconds the heartbeat ran for, or None if its guard was lost to the timeout
+def end_heartbeat(token, redis_client=None):
+    redis_client = redis_client or strict_redis_client
+    release = redis_client.register_script(RELEASE_HEARTBEAT_SCRIPT)
+    if not release(keys=[ACCOUNTING_HEARTBEAT_KEY], args=[token]):
+        return None
+    return time.time() - float(token.split(':')[1])
+
+
+def token_pair(token_id, other_token_id):
+    return tuple(sorted([token_id, other_token_id]))
+
+
+def distinct_pairs(queryset):
+    return {token_pair(*pair) for pair in queryset
+            .values_list('wallet__token_id', 'recipient__token_id')
+            .distinct()}
+
+
+# Cheap probes of the pending work of each accounting stage, one grouped query per stage returning the
+# tokens or token pairs it has something to do for. They read the same rows the API writes to queue
+# work for the stages, so the heartbeat only dispatches the partitions with something to process.
+def pending_accounting_work(eon_number):
+    work = {
+        'process_admissions': set(Wallet.objects
+                                  .filter(registration_operator_authorization__isnull=True)
+                                  .values_list('token_id', flat=True)
+                                  .distinct()),
+        'slash_bad_withdrawals': set(WithdrawalRequest.objects
+                                     .filter(slashed=False, eon_number__gte=eon_number - 1)
+                                     .values_list('wallet__token_id', flat=True)
+                                     .distinct()),
+        'process_passive_transfers': set(Transfer.objects
+                                         .filter(processed=False, swap=False, passive=True)
+                                         .values_list('wallet__token_id', flat=True)
+                                         .distinct()),
+    }
+
+    open_swaps = Transfer.objects.filter(
+        swap=True,
+        processed=False,
+        complete=False,
+        voided=False,
+        cancelled=False,
+        eon_number=eon_number)
+
+    work['confirm_swaps'] = distinct_pairs(open_swaps.filter(
+        sender_active_state__isnull=False,
+        recipient_active_state__isnull=False,
+        sender_active_state__operator_signature__isnull=True,
+        recipient_active_state__operator_signature__isnull=True))
+
+    work['cancel_finalize_swaps'] = distinct_pairs(Transfer.objects.filter(
+        Q(complete=True, recipient_finalization_active_state__isnull=False) |
+        Q(complete=False,
+          cancelled=True,
+          sender_cancellation_active_state__isnull=False,
+          recipient_cancellation_active_state__isnull=False),
+        swap=True,
+        processed=False,
+        voided=False))
+
+    # signed swaps are matched once their pair's cursor is behind them,
+    # swaps countersigned by this heartbeat are matched right after
+    work['process_swaps'] = set(work['confirm_swaps'])
+    signed_swaps = open_swaps.filter(
+        sender_active_state__operator_signature__isnull=False,
+        recipient_active_state__operator_signature__isnull=False)
+    for left_token_id, right_token_id in distinct_pairs(signed_swaps) - work['process_swaps']:
+        cursor = SwapCursor.objects.filter(left_token_id=left_token_id, right_token_id=right_token_id).first() \
+            or SwapCursor(left_token_id=left_token_id, right_token_id=right_token_id)
+        if cursor.unmatched_swaps(eon_number).exists():
+            work['process_swaps'].add((left_token_id, right_token_id))
+
+    return work
@@ -1,10 +1,15 @@
 import logging
+from itertools import combinations
 
-from celery import shared_task
+from celery import shared_task, chain, chord, group
 from celery.utils.log import get_task_logger
 
 from admission.tasks import process_admissions
+from contractor.interfaces import LocalViewInterface
 from contractor.tasks import synchronize_contract_state, slash_bad_withdrawals, confirm_withdrawals, respond_to_challenges, send_queued_transactions
+from heartbeat.scheduler import begin_heartbeat, end_heartbeat, pending_accounting_work, token_pair
+from ledger.accounting_partitions import record_heartbeat, record_stage_idle
+from ledger.models import Token
 from ledger.tasks import create_checkpoint
 from swapper.tasks.cancel_finalize_swaps import cancel_finalize_swaps
 from swapper.tasks.confirm_swaps import confirm_swaps
@@ -30,23 +35,75 @@ def heartbeat_verifier():
     send_queued_transactions()
 
 
+# stages run per token, in order
+TOKEN_STAGES = [
+    # wallet admissions
+    ('process_admissions', process_admissions),
+    # withdrawal slashing
+    ('slash_bad_withdrawals', slash_bad_withdrawals),
+    # processing transfers
+    # depends on admission
+    ('process_passive_transfers', process_passive_transfers),
+]
+
+# stages run per token pair, in order
+PAIR_STAGES = [
+    ('confirm_swaps', confirm_swaps),
+    ('cancel_finalize_swaps', cancel_finalize_swaps),
+    ('process_swaps', process_swaps),
+]
+
+
 # heartbeat for account management
+# stages are dispatched per token and per token pair to the accounting workers,
+# they run concurrently unless they touch the ledger partition of the same token.
+# only the stages a probe finds pending work for are dispatched, and a beat
+# arriving while the stages of the previous one are still running is skipped
 @shared_task
 def heartbeat_accounting():
-    # wallet admissions
-    process_admissions()
+    if not LocalViewInterface.get_contract_parameters():
+        logger.error('Contract parameters not yet populated.')
+        return
 
-    # withdrawal slashing
-    slash_bad_withdrawals()
+    token = begin_heartbeat()
+    if token is None:
+        logger.info('Previous accounting heartbeat still running.')
+        record_heartbeat(overlapping=True)
+        return
 
-    # processing transfers
-    # depends on admission
-    process_passive_transfers()
-    confirm_swaps()
-    cancel_finalize_swaps()
-    process_swaps()
+    try:
+        token_ids = list(Token.objects.order_by('id').values_list('id', flat=True))
+        pairs = [token_pair(*pair) for pair in combinations(token_ids, 2)]
+        work = pending_accounting_work(LocalViewInterface.latest().eon_number())
+
+        for stage, _ in TOKEN_STAGES:
+            record_stage_idle(stage, len(set(token_ids) - work[stage]))
+        for stage, _ in PAIR_STAGES:
+            record_stage_idle(stage, len(set(pairs) - work[stage]))
 
-    # checkpoint creation
-    # depends on admission, withdrawal slashing & transfer processing
-    create_checkpoint()
+        token_stages = [chain(*[task.si(token_id) for stage, task in TOKEN_STAGES if token_id in work[stage]])
+                        for token_id in token_ids]
+        swap_stages = [chain(*[task.si(list(pair)) for stage, task in PAIR_STAGES if pair in work[stage]])
+                       for pair in pairs]
+        busy_stages = [stages for stages in token_stages + swap_stages if stages.tasks]
 
+        # checkpoint creation
+        # depends on admission, withdrawal slashing & transfer processing
+        finish = chain(create_checkpoint.si(), finish_heartbeat_accounting.si(token))
+        if busy_stages:
+            chord(group(busy_stages))(finish)
+        else:
+            finish.delay()
+    except Exception:
+        # the next beat does not wait for the timeout of a heartbeat that dispatched nothing
+        end_heartbeat(token)
+        raise
+
+
+@shared_task
+def finish_heartbeat_accounting(token):
+    elapsed = end_heartbeat(token)
+    if elapsed is None:
+        logger.warning('Accounting heartbeat outlived its timeout.')
+        return
+    record_heartbeat(elapsed=elapsed)
@@ -0,0 +1,45 @@
+from django.test import TestCase
+from heartbeat.scheduler import ACCOUNTING_HEARTBEAT_KEY, begin_heartbeat, end_heartbeat, pending_accounting_work
+from ledger.models import Token, Wallet
+from operator_api.models.mutex_model import strict_redis_client
+
+
+class AccountingHeartbeatTests(TestCase):
+    def setUp(self):
+        strict_redis_client.delete(ACCOUNTING_HEARTBEAT_KEY)
+
+    def tearDown(self):
+        strict_redis_client.delete(ACCOUNTING_HEARTBEAT_KEY)
+
+    def test_overlapping_heartbeat_skipped(self):
+        token = begin_heartbeat()
+        self.assertIsNotNone(token)
+        self.assertIsNone(begin_heartbeat())
+
+        self.assertGreaterEqual(end_heartbeat(token), 0)
+        # a heartbeat outliving its timeout does not release the guard of the next one
+        next_token = begin_heartbeat()
+        self.assertIsNone(end_heartbeat(token))
+        self.assertIsNone(begin_heartbeat())
+        self.assertIsNotNone(end_heartbeat(next_token))
+
+    def test_probes_find_pending_admissions(self):
+        token = Token.objects.create(
+            address='{:040x}'.format(2 ** 40),
+            trail=2 ** 20,
+            name='Probe',
+            short_name='PRB',
+            block=0)
+
+        work = pending_accounting_work(eon_number=1)
+        self.assertNotIn(token.id, work['process_admissions'])
+        self.assertNotIn(token.id, work['process_passive_transfers'])
+
+        Wallet.objects.create(
+            address='{:040x}'.format(2 ** 41),
+            token=token,
+            registration_eon_number=1)
+
+        work = pending_accounting_work(eon_number=1)
+        self.assertIn(token.id, work['process_admissions'])
+        self.assertNotIn(token.id, work['process_passive_transfers'])
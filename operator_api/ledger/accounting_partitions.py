@@ -0,0 +1,183 @@
+import logging
+import time
+from contextlib import contextmanager
+from itertools import combinations
+from celery.utils.log import get_task_logger
+from django.conf import settings
+from ledger.models import RootCommitment, Token
+from operator_api.models.locks import MultiKeyLock
+from operator_api.models.mutex_model import strict_redis_client
+
+logger = get_task_logger(__name__)
+logger.setLevel(logging.INFO)
+
+# stages moving balances, transfers, swaps and withdrawal slashing
+BALANCES = 'balances'
+# wallet admission only assigns trails to new wallets of a token, so it runs beside the balance stages
+ADMISSIONS = 'admissions'
+
+
+# The stages of the accounting heartbeat are partitioned by token. A stage takes the partitions of all
+# the tokens it touches at once, so the transfers of one token and the swaps of a pair of two others are
+# processed concurrently, while stages of the same token stay serialized: their transactions hold wallet
+# balances until they commit. Stages also take the read side of the checkpoint lock of the operator eon
+# and of the eon before it, so a checkpoint is only created once the stages in progress are done.
+def partition_lock(partition, tokens):
+    return MultiKeyLock(
+        strict_redis_client,
+        ['accounting/{}/token_{}'.format(partition, token.id) for token in tokens],
+        auto_renewal=True,
+        expiry_seconds=10)
+
+
+# yields False without waiting if another worker is processing the partition, it is processed again on
+# the next heartbeat
+@contextmanager
+def ledger_partition(partition, tokens, eon_number):
+    lock = partition_lock(partition, tokens)
+    if not lock.acquire(blocking=False):
+        logger.info('Partition {} of tokens {} is busy.'.format(
+            partition, [token.id for token in tokens]))
+        yield False
+        return
+
+    try:
+        with RootCommitment.read_write_lock(suffix=eon_number - 1), RootCommitment.read_write_lock(suffix=eon_number):
+            yield True
+    finally:
+        lock.release()
+
+
+# the token of a partitioned stage, or every token in trail order for a stage of the whole ledger
+def partition_tokens(token_id=None):
+    if token_id is not None:
+        return list(Token.objects.filter(id=token_id))
+    return list(Token.objects.order_by('trail'))
+
+
+# token pairs of the swap stages, the pair of token_ids or every pair for a stage of the whole ledger
+def partition_pairs(token_ids=None):
+    tokens = Token.objects.order_by('id')
+    if token_ids is not None:
+        tokens = tokens.filter(id__in=token_ids)
+    return [list(pair) for pair in combinations(tokens, 2)]
+
+
+ACCOUNTING_STAGE_BUDGETS_KEY = 'accounting_stage_budgets'
+ACCOUNTING_STAGE_METRICS_KEY = 'accounting_stage_metrics'
+
+# stages of the accounting heartbeat, named after their tasks
+ACCOUNTING_STAGES = [
+    'process_admissions',
+    'slash_bad_withdrawals',
+    'process_passive_transfers',
+    'confirm_swaps',
+    'cancel_finalize_swaps',
+    'process_swaps',
+]
+
+
+# Bounds the time one run of a stage spends on a partition. A run is allowed the budget of the stage plus
+# the time earlier runs of the partition left unused, up to a cap, and pays back the time it overran by.
+# Stages check the budget before every item and leave the items past it to the next heartbeat, the first
+# item of a run is always processed so a partition in debt still makes progress.
+class StageBudget(object):
+    def __init__(self, stage, tokens, redis_client=None, budget_seconds=None, max_budget_seconds=None):
+        self.stage = stage
+        self.redis = redis_client or strict_redis_client
+        self.field = '{}/{}'.format(stage, '_'.join(str(token.id) for token in tokens))
+        self.budget_seconds = settings.HUB_ACCOUNTING_STAGE_BUDGET_SECONDS \
+            if budget_seconds is None else budget_seconds
+        self.max_budget_seconds = settings.HUB_ACCOUNTING_STAGE_MAX_BUDGET_SECONDS \
+            if max_budget_seconds is None else max_budget_seconds
+        self.allowance = None
+        self.started = None
+        self.checks = 0
+        self.was_exhausted = False
+
+    def __enter__(self):
+        carried = float(self.redis.hget(ACCOUNTING_STAGE_BUDGETS_KEY, self.field) or 0)
+        self.allowance = max(
+            0, min(carried + self.budget_seconds, self.max_budget_seconds))
+        self.started = time.perf_counter()
+        self.checks = 0
+        self.was_exhausted = False
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        elapsed = self.elapsed()
+        # debt is bounded by one budget, so a slow item is paid back by the next run
+        carried = max(-self.budget_seconds, self.allowance - elapsed)
+        self.redis.hset(ACCOUNTING_STAGE_BUDGETS_KEY, self.field, carried)
+        record_stage_run(self.stage, elapsed, self.was_exhausted, redis_client=self.redis)
+        return False
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def exhausted(self):
+        self.checks += 1
+        if self.checks > 1 and self.elapsed() >= self.allowance:
+            if not self.was_exhausted:
+                logger.info('Stage {} out of budget after {:.3f}s.'.format(
+                    self.field, self.elapsed()))
+            self.was_exhausted = True
+        return self.was_exhausted
+
+
+def record_stage_run(stage, elapsed, exhausted, redis_client=None):
+    redis_client = redis_client or strict_redis_client
+    pipeline = redis_client.pipeline()
+    pipeline.hincrby(ACCOUNTING_STAGE_METRICS_KEY, '{}_runs'.format(stage), 1)
+    pipeline.hincrbyfloat(ACCOUNTING_STAGE_METRICS_KEY, '{}_seconds'.format(stage), elapsed)
+    pipeline.hset(ACCOUNTING_STAGE_METRICS_KEY, '{}_last_seconds'.format(stage), elapsed)
+    if exhausted:
+        pipeline.hincrby(ACCOUNTING_STAGE_METRICS_KEY, '{}_exhausted'.format(stage), 1)
+    pipeline.execute()
+
+
+# partitions of a stage the heartbeat did not dispatch because they had no pending work
+def record_stage_idle(stage, partitions, redis_client=None):
+    redis_client = redis_client or strict_redis_client
+    if partitions:
+        redis_client.hincrby(ACCOUNTING_STAGE_METRICS_KEY, '{}_idle'.format(stage), partitions)
+
+
+def record_heartbeat(elapsed=None, overlapping=False, redis_client=None):
+    redis_client = redis_client or strict_redis_client
+    pipeline = redis_client.pipeline()
+    if overlapping:
+        pipeline.hincrby(ACCOUNTING_STAGE_METRICS_KEY, 'overlapping_heartbeats', 1)
+    else:
+        pipeline.hincrby(ACCOUNTING_STAGE_METRICS_KEY, 'heartbeats', 1)
+        pipeline.hincrbyfloat(ACCOUNTING_STAGE_METRICS_KEY, 'heartbeat_seconds', elapsed)
+        pipeline.hset(ACCOUNTING_STAGE_METRICS_KEY, 'heartbeat_last_seconds', elapsed)
+    pipeline.execute()
+
+
+# run counts and latencies of the accounting stages, averaged over every run since the metrics were reset
+def accounting_stage_metrics(redis_client=None):
+    redis_client = redis_client or strict_redis_client
+    recorded = {key.decode(): float(value)
+                for key, value in redis_client.hgetall(ACCOUNTING_STAGE_METRICS_KEY).items()}
+
+    def mean(total, count):
+        return recorded.get(total, 0) / recorded[count] if recorded.get(count) else None
+
+    stages = {}
+    for stage in ACCOUNTING_STAGES:
+        stages[stage] = {
+            'runs': int(recorded.get('{}_runs'.format(stage), 0)),
+            'idle': int(recorded.get('{}_idle'.format(stage), 0)),
+            'exhausted': int(recorded.get('{}_exhausted'.format(stage), 0)),
+            'mean_seconds': mean('{}_seconds'.format(stage), '{}_runs'.format(stage)),
+            'last_seconds': recorded.get('{}_last_seconds'.format(stage)),
+        }
+
+    return {
+        'heartbeats': int(recorded.get('heartbeats', 0)),
+        'overlapping_heartbeats': int(recorded.get('overlapping_heartbeats', 0)),
+        'mean_heartbeat_seconds': mean('heartbeat_seconds', 'heartbeats'),
+        'last_heartbeat_seconds': recorded.get('heartbeat_last_seconds'),
+        'stages': stages,
+    }
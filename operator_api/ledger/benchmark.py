@@ -0,0 +1,106 @@
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from uuid import uuid4
+import redis
+from operator_api.models.locks import ReadWriteLock, MultiLockReadWriteLock
+from operator_api.models.mutex_model import strict_redis_client
+
+
+# redis client counting the commands it sends, each one a round trip to the server
+class CountingRedis(redis.StrictRedis):
+    def __init__(self, *args, **kwargs):
+        super(CountingRedis, self).__init__(*args, **kwargs)
+        self.commands = 0
+        self.counter_lock = threading.Lock()
+
+    def execute_command(self, *args, **options):
+        with self.counter_lock:
+            self.commands += 1
+        return super(CountingRedis, self).execute_command(*args, **options)
+
+
+# Threads take a read write lock the way transfer confirmations and checkpoint creation take the
+# lock of an eon, mostly reading with occasional writes, and hold it for a fixed time.
+class ReadWriteLockBenchmark(object):
+    implementations = {
+        'lua': ReadWriteLock,
+        'multi_lock': MultiLockReadWriteLock,
+    }
+
+    def __init__(self, threads=16, operations=200, write_ratio=0.05, hold_seconds=0.001, seed=0):
+        self.threads = threads
+        self.operations = operations
+        self.write_ratio = write_ratio
+        self.hold_seconds = hold_seconds
+        self.seed = seed
+
+    def contend(self, lock_class):
+        redis_client = CountingRedis(
+            connection_pool=strict_redis_client.connection_pool)
+        name = 'benchmark-{}'.format(uuid4().hex)
+        generator = random.Random(self.seed)
+        roles = [[generator.random() < self.write_ratio for _ in range(self.operations)]
+                 for _ in range(self.threads)]
+
+        state_lock = threading.Lock()
+        state = {'readers': 0, 'writers': 0, 'violations': 0}
+        waits = []
+
+        def enter(is_write):
+            with state_lock:
+                if state['writers'] or (is_write and state['readers']):
+                    state['violations'] += 1
+                state['writers' if is_write else 'readers'] += 1
+
+        def leave(is_write):
+            with state_lock:
+                state['writers' if is_write else 'readers'] -= 1
+
+        def work(thread_roles):
+            thread_waits = []
+            for is_write in thread_roles:
+                lock = lock_class(redis_client, name,
+                                  auto_renewal=False, is_write=is_write)
+                started = time.perf_counter()
+                lock.lock()
+                thread_waits.append(time.perf_counter() - started)
+                enter(is_write)
+                time.sleep(self.hold_seconds)
+                leave(is_write)
+                lock.release()
+            return thread_waits
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.threads) as executor:
+            for thread_waits in executor.map(work, roles):
+                waits += thread_waits
+        elapsed = time.perf_counter() - started
+
+        keys = strict_redis_client.keys('*{}*'.format(name))
+        if keys:
+            strict_redis_client.delete(*keys)
+
+        waits.sort()
+        acquisitions = len(waits)
+        return {
+            'seconds': elapsed,
+            'acquisitions_per_second': acquisitions / elapsed if elapsed else 0,
+            'mean_wait_ms': 1000 * sum(waits) / acquisitions if acquisitions else 0,
+            'p99_wait_ms': 1000 * waits[int(0.99 * (acquisitions - 1))] if acquisitions else 0,
+            'round_trips_per_acquire_release': redis_client.commands / acquisitions if acquisitions else 0,
+            'exclusion_violations': state['violations'],
+        }
+
+    def run(self):
+        report = {
+            'threads': self.threads,
+            'operations_per_thread': self.operations,
+            'write_ratio': self.write_ratio,
+            'hold_seconds': self.hold_seconds,
+        }
+        for implementation, lock_class in self.implementations.items():
+            for key, value in self.contend(lock_class).items():
+                report['{}_{}'.format(implementation, key)] = value
+        return report
@@ -0,0 +1,154 @@
+import logging
+from celery.utils.log import get_task_logger
+from django.core.cache import cache
+from operator_api import crypto
+from operator_api.merkle_tree import calculate_merkle_proof
+from operator_api.tx_merkle_tree import TransactionMerkleTree
+from operator_api.util import long_string_to_list, csf_to_list
+from ledger.context.wallet_transfer import WalletTransferContext
+from ledger.models import ExclusiveBalanceAllotment, TokenCommitment
+
+logger = get_task_logger(__name__)
+logger.setLevel(logging.INFO)
+
+# bundles are only a shortcut, challenges fall back to building them from the database once they expire
+CHALLENGE_PROOF_BUNDLE_TIMEOUT = 7 * 24 * 60 * 60
+
+
+def challenge_proof_bundle_key(wallet_id, eon_number):
+    return 'challenge_proof_bundle_{}_{}'.format(wallet_id, eon_number)
+
+
+# membership proofs of the appended transfers of a wallet in an eon, as tx nonce -> (tx trail, tx chain)
+def transfer_membership_proofs(wallet, eon_number, last_transfer_is_finalized=False, starting_balance=None):
+    wallet_transfer_context = WalletTransferContext(
+        wallet=wallet, transfer=None)
+
+    transfers_list_nonce_index_map = {}
+    transfers_list = wallet_transfer_context.authorized_transfers_list_shorthand(
+        only_appended=True,
+        force_append=False,
+        eon_number=eon_number,
+        last_transfer_is_finalized=last_transfer_is_finalized,
+        index_map=transfers_list_nonce_index_map,
+        starting_balance=starting_balance)
+    if not transfers_list:
+        return {}
+
+    transfer_tree = TransactionMerkleTree(transfers_list)
+    proofs = {}
+    for nonce, transfer_index in transfers_list_nonce_index_map.items():
+        transfer_node = transfer_tree.merkle_tree_leaf_map.get(transfer_index)
+        proofs[nonce] = (transfer_index, [crypto.zfill(node.get('hash')) for node in calculate_merkle_proof(
+            transfer_index, transfer_node)])
+    return proofs
+
+
+# Everything the operator submits to answer a challenge against the exclusive balance allotment
+# of a wallet in a checkpoint, decoded once when the checkpoint is created instead of while the
+# challenge deadline runs. Passive values and transfer proofs refer to the eon before the
+# checkpoint and are computed on demand for any other eon.
+class ChallengeProofBundle(object):
+    def __init__(self, allotment: ExclusiveBalanceAllotment, token_commitment: TokenCommitment):
+        self.wallet_id = allotment.wallet_id
+        self.eon_number = allotment.eon_number
+        self.amount = int(allotment.amount())
+
+        self.allotment_chain = [crypto.zfill(crypto.decode_hex(checksum)) for checksum in
+                                long_string_to_list(allotment.merkle_proof_hashes, 64)]
+        self.membership_chain = [crypto.zfill(crypto.decode_hex(checksum)) for checksum in
+                                 long_string_to_list(token_commitment.membership_hashes, 64)]
+        self.values = csf_to_list(allotment.merkle_proof_values, int)
+        self.l_r = [int(allotment.left), int(allotment.right)]
+        self.tx_set_root = crypto.decode_hex(allotment.transaction_set_root())
+        self.deltas = [d for d in allotment.deltas()]
+
+        v_0, r_0, s_0 = allotment.wallet_v_r_s()
+        v_1, r_1, s_1 = allotment.operator_v_r_s()
+        self.v = [v_0, v_1]
+        self.r = [crypto.uint256(r_0), crypto.uint256(r_1)]
+        self.s = [crypto.uint256(s_0), crypto.uint256(s_1)]
+
+        self.transfers_eon_number = self.eon_number - 1
+        self.passive_values = None
+        self.transfer_proofs = None
+
+    # precomputes the eon dependent proofs, transfer proofs only exist for wallets with an active state
+    def complete(self, wallet, has_active_state):
+        self.passive_values = WalletTransferContext(wallet=wallet, transfer=None).get_passive_values(
+            eon_number=self.transfers_eon_number)
+        self.transfer_proofs = transfer_membership_proofs(
+            wallet, self.transfers_eon_number) if has_active_state else {}
+        return self
+
+    def get_passive_values(self, wallet, eon_number):
+        if eon_number == self.transfers_eon_number and self.passive_values is not None:
+            return self.passive_values
+        return WalletTransferContext(wallet=wallet, transfer=None).get_passive_values(eon_number=eon_number)
+
+    # (tx trail, tx chain) of a delivered transfer, or None if it is not part of the transfer set
+    def transfer_proof(self, wallet, eon_number, nonce):
+        if eon_number == self.transfers_eon_number and self.transfer_proofs is not None:
+            proofs = self.transfer_proofs
+        else:
+            proofs = transfer_membership_proofs(wallet, eon_number)
+        return proofs.get(int(nonce))
+
+    @staticmethod
+    def for_wallet(wallet, eon_number):
+        key = challenge_proof_bundle_key(wallet.id, eon_number)
+        bundle = cache.get(key)
+        if bundle is not None:
+            return bundle
+
+        # raises DoesNotExist if the wallet has no allotment in this checkpoint
+        allotment = ExclusiveBalanceAllotment.objects\
+            .select_related('active_state__wallet_signature', 'active_state__operator_signature')\
+            .get(wallet=wallet, eon_number=eon_number)
+        token_commitment = TokenCommitment.objects.get(
+            token=wallet.token,
+            root_commitment__eon_number=eon_number)
+
+        bundle = ChallengeProofBundle(allotment, token_commitment)
+        cache.set(key, bundle, timeout=CHALLENGE_PROOF_BUNDLE_TIMEOUT)
+        return bundle
+
+
+# builds and caches the bundles of every allotment of a checkpoint
+def precompute_challenge_proof_bundles(eon_number, chunk_size=500):
+    token_commitments = {
+        token_commitment.token_id: token_commitment
+        for token_commitment in TokenCommitment.objects.filter(root_commitment__eon_number=eon_number)
+    }
+
+    allotments = ExclusiveBalanceAllotment.objects\
+        .filter(eon_number=eon_number)\
+        .select_related(
+            'wallet__token',
+            'active_state__wallet_signature',
+            'active_state__operator_signature')\
+        .order_by('id')
+
+    bundles = {}
+    precomputed = 0
+    for allotment in allotments.iterator():
+        token_commitment = token_commitments.get(allotment.wallet.token_id)
+        if token_commitment is None:
+            logger.error('Missing token commitment of {} at eon {}.'.format(
+                allotment.wallet.token.address, eon_number))
+            continue
+
+        bundle = ChallengeProofBundle(allotment, token_commitment).complete(
+            wallet=allotment.wallet,
+            has_active_state=allotment.active_state_id is not None)
+        bundles[challenge_proof_bundle_key(allotment.wallet_id, eon_number)] = bundle
+
+        if len(bundles) >= chunk_size:
+            cache.set_many(bundles, timeout=CHALLENGE_PROOF_BUNDLE_TIMEOUT)
+            precomputed += len(bundles)
+            bundles = {}
+
+    if bundles:
+        cache.set_many(bundles, timeout=CHALLENGE_PROOF_BUNDLE_TIMEOUT)
+        precomputed += len(bundles)
+    return precomputed
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from ledger.benchmark import ReadWriteLockBenchmark
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the lua scripted read write lock against the previous implementation over three redis locks, ' \
+           'under contention from concurrent readers and writers'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=16)
+        parser.add_argument('--operations', type=int, default=200,
+                            help='lock acquisitions per thread')
+        parser.add_argument('--write-ratio', type=float, default=0.05)
+        parser.add_argument('--hold', type=float, default=0.001,
+                            help='seconds each acquisition holds the lock')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        report = ReadWriteLockBenchmark(
+            threads=options['threads'],
+            operations=options['operations'],
+            write_ratio=options['write_ratio'],
+            hold_seconds=options['hold'],
+            seed=options['seed']).run()
+
+        self.stdout.write('\n'.join('{}: {}'.format(key, value)
+                                    for key, value in report.items()))
@@ -0,0 +1,23 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ledger', '0070_swap_sell_flag'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='transfer',
+            index=models.Index(
+                condition=models.Q(
+                    cancelled=False,
+                    complete=False,
+                    processed=False,
+                    swap=True,
+                    voided=False),
+                fields=['eon_number', 'time', 'id'],
+                name='ledger_transfer_open_swaps'),
+        ),
+    ]
@@ -172,6 +172,18 @@ class Transfer(Transaction):
             ('eon_number', 'recipient', 'nonce'),
             ('eon_number', 'wallet', 'nonce'),
             ('eon_number', 'tx_id'))
+        indexes = [
+            # open swaps, scanned by the matcher in (time, id) order
+            models.Index(
+                fields=['eon_number', 'time', 'id'],
+                name='ledger_transfer_open_swaps',
+                condition=models.Q(
+                    swap=True,
+                    processed=False,
+                    complete=False,
+                    voided=False,
+                    cancelled=False)),
+        ]
 
     def checksum(self, wallet_transfer_context, is_last_transfer=False, starting_balance=None, assume_active_state_exists=False):
         if not self.is_swap():
@@ -338,8 +350,8 @@ class Transfer(Transaction):
             self.recipient_fulfillment_active_state.operator_signature = self.recipient_fulfillment_active_state.sign_active_state(
                 address, private_key)
             self.recipient_fulfillment_active_state.operator_signature.save()
-            self.recipient_fulfillment_active_state.save()
-            self.save()
+            self.recipient_fulfillment_active_state.save(
+                update_fields=['operator_signature'])
 
     def sign_swap_finalization(self, address, private_key):
         if self.is_swap() \
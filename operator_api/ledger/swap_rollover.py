@@ -0,0 +1,171 @@
+import logging
+from collections import defaultdict
+from celery.utils.log import get_task_logger
+import redis_lock
+from django.core.cache import cache
+from django.db.models import Sum
+from ledger.models import Transfer, Matching
+from operator_api.models.mutex_model import strict_redis_client
+
+logger = get_task_logger(__name__)
+logger.setLevel(logging.INFO)
+
+SWAP_ROLLOVER_EON_KEY = 'swap_rollover_eon'
+# carried totals are only a shortcut, swaps fall back to querying their matchings once they expire
+CARRIED_SWAP_TIMEOUT = 7 * 24 * 60 * 60
+
+
+def carried_swap_key(eon_number, tx_id):
+    return 'carried_swap_{}_{}'.format(eon_number, tx_id)
+
+
+# matched out/in totals of many orders at once, as Transfer.matched_amounts does for one
+def matched_amounts_by_tx_id(tx_ids, eon_number=None):
+    matchings = Matching.objects.all()
+    if eon_number is not None:
+        matchings = matchings.filter(eon_number=eon_number)
+
+    totals = defaultdict(lambda: (0, 0))
+
+    as_left = matchings\
+        .filter(left_order_tx_id__in=tx_ids)\
+        .order_by()\
+        .values('left_order_tx_id')\
+        .annotate(
+            out_sum=Sum('left_deducted_right_granted_amount'),
+            in_sum=Sum('right_deducted_left_granted_amount'))
+    for row in as_left:
+        matched_out, matched_in = totals[row['left_order_tx_id']]
+        totals[row['left_order_tx_id']] = (
+            matched_out + row['out_sum'], matched_in + row['in_sum'])
+
+    as_right = matchings\
+        .filter(right_order_tx_id__in=tx_ids)\
+        .order_by()\
+        .values('right_order_tx_id')\
+        .annotate(
+            out_sum=Sum('right_deducted_left_granted_amount'),
+            in_sum=Sum('left_deducted_right_granted_amount'))
+    for row in as_right:
+        matched_out, matched_in = totals[row['right_order_tx_id']]
+        totals[row['right_order_tx_id']] = (
+            matched_out + row['out_sum'], matched_in + row['in_sum'])
+
+    return totals
+
+
+# Carries multi eon swaps over the boundary into eon_number using set based queries
+# instead of retiring and inspecting every swap on its own
+class SwapRollover(object):
+    def __init__(self, eon_number):
+        self.eon_number = eon_number
+        self.last_eon_number = eon_number - 1
+        self.multi_eon_tx_ids = set()
+        self.matched_amounts_all_eons = {}
+        self.matched_amounts_last_eon = {}
+
+    # same effect as Transfer.retire_swap on every open swap signed by the operator in the last eon
+    def retire_swaps(self):
+        open_swaps = Transfer.objects\
+            .filter(
+                swap=True,
+                processed=False,
+                appended=True,
+                eon_number=self.last_eon_number,
+                sender_active_state__operator_signature__isnull=False,
+                recipient_active_state__operator_signature__isnull=False)\
+            .select_for_update()
+        retired = list(open_swaps.values_list('id', 'tx_id', 'complete'))
+        if not retired:
+            return 0
+
+        Transfer.objects\
+            .filter(id__in=[swap_id for swap_id, _, _ in retired])\
+            .update(processed=True, cancelled=False, voided=False)
+
+        completed_tx_ids = [tx_id for _, tx_id, complete in retired if complete]
+        if completed_tx_ids:
+            Transfer.objects\
+                .filter(
+                    tx_id__in=completed_tx_ids,
+                    eon_number__gt=self.last_eon_number,
+                    swap=True,
+                    voided=False)\
+                .update(processed=True, appended=False, voided=True)
+
+        logger.info('Retired {} swaps of eon {}'.format(
+            len(retired), self.last_eon_number))
+        return len(retired)
+
+    # swaps of the last eon that were carried over from the eon before it, with their matched totals
+    def load(self):
+        previous_eon_tx_ids = Transfer.objects\
+            .filter(swap=True, eon_number=self.last_eon_number - 1)\
+            .values('tx_id')
+        self.multi_eon_tx_ids = set(Transfer.objects
+                                    .filter(
+                                        swap=True,
+                                        cancelled=False,
+                                        eon_number=self.last_eon_number,
+                                        tx_id__in=previous_eon_tx_ids)
+                                    .values_list('tx_id', flat=True))
+
+        self.matched_amounts_all_eons = matched_amounts_by_tx_id(
+            self.multi_eon_tx_ids)
+        self.matched_amounts_last_eon = matched_amounts_by_tx_id(
+            self.multi_eon_tx_ids, eon_number=self.last_eon_number)
+        return self
+
+    def is_multi_eon_swap(self, transfer: Transfer):
+        if transfer.eon_number != self.last_eon_number:
+            return Transfer.objects.filter(eon_number=transfer.eon_number-1, tx_id=transfer.tx_id).exists()
+        return transfer.tx_id in self.multi_eon_tx_ids
+
+    def matched_amounts(self, transfer: Transfer, all_eons=False):
+        if transfer.eon_number != self.last_eon_number or transfer.tx_id not in self.multi_eon_tx_ids:
+            return transfer.matched_amounts(all_eons=all_eons)
+        if all_eons:
+            return self.matched_amounts_all_eons[transfer.tx_id]
+        return self.matched_amounts_last_eon[transfer.tx_id]
+
+    # stores the matched totals of the swaps carried into eon_number before any of them is confirmed
+    # no matching can happen on them until then, so the totals hold until the operator signs them
+    def carry_over(self):
+        last_eon_tx_ids = Transfer.objects\
+            .filter(swap=True, eon_number=self.last_eon_number)\
+            .values('tx_id')
+        carried_tx_ids = list(Transfer.objects
+                              .filter(
+                                  swap=True,
+                                  processed=False,
+                                  voided=False,
+                                  eon_number=self.eon_number,
+                                  tx_id__in=last_eon_tx_ids)
+                              .values_list('tx_id', flat=True))
+
+        totals = matched_amounts_by_tx_id(carried_tx_ids)
+        cache.set_many({
+            carried_swap_key(self.eon_number, tx_id): totals[tx_id] for tx_id in carried_tx_ids
+        }, timeout=CARRIED_SWAP_TIMEOUT)
+        cache.set(SWAP_ROLLOVER_EON_KEY, self.eon_number, timeout=None)
+
+        logger.info('Carried {} swaps into eon {}'.format(
+            len(carried_tx_ids), self.eon_number))
+
+    @staticmethod
+    def carry_over_into(eon_number):
+        if cache.get(SWAP_ROLLOVER_EON_KEY) == eon_number:
+            return
+        # swap stages of different token pairs run concurrently, the first one carries every pair over
+        with redis_lock.Lock(redis_client=strict_redis_client, name='{}__locked'.format(SWAP_ROLLOVER_EON_KEY),
+                             expire=10, auto_renewal=True, strict=True):
+            if cache.get(SWAP_ROLLOVER_EON_KEY) == eon_number:
+                return
+            SwapRollover(eon_number).carry_over()
+
+    # matched totals of a multi eon swap stored by carry_over, or None if it is not a carried swap
+    @staticmethod
+    def carried_matched_amounts(swap: Transfer):
+        if swap.appended:
+            return None
+        return cache.get(carried_swap_key(swap.eon_number, swap.tx_id))
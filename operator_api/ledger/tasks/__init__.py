@@ -3,3 +3,4 @@ from .register_owner_account import register_owner_account
 from .register_eth_token import register_eth_token
 from .register_sla_token import register_sla_token
 from .whitelist_default_token_pairs import whitelist_default_token_pairs
+from .precompute_challenge_proofs import precompute_challenge_proofs
@@ -15,7 +15,9 @@ from operator_api.passive_delivery_merkle_tree import PassiveDeliveryMerkleTree
 from operator_api.util import ZERO_CHECKSUM
 from operator_api.models import BulkCreateManager
 from ledger.context.wallet_transfer import WalletTransferContext
-from ledger.models import ExclusiveBalanceAllotment, TokenCommitment, Wallet, Transfer, WithdrawalRequest, RootCommitment, Token
+from ledger.models import ExclusiveBalanceAllotment, TokenCommitment, Wallet, WithdrawalRequest, RootCommitment, Token
+from ledger.swap_rollover import SwapRollover
+from ledger.tasks.precompute_challenge_proofs import precompute_challenge_proofs
 from operator_api.celery import operator_celery
 from operator_api.decorators import notification_on_error
 
@@ -42,6 +44,7 @@ def create_checkpoint():
     if latest_sub_block < blocks_for_creation:
         return
 
+    # serializes checkpoint creation, the accounting stages are held off by the write side of the checkpoint lock
     with RootCommitment.global_lock():
         new_checkpoint = create_checkpoint_for_eon(latest_eon_number, latest.block)
         if new_checkpoint:
@@ -88,8 +91,13 @@ def create_checkpoint_for_eon(eon_number, latest_block_number):
 
     # commitment write read lock makes sure transaction confirmation will not mutate ledger while checkpoint is being created
     with transaction.atomic(), RootCommitment.read_write_lock(suffix=eon_number-1, is_write=True, auto_renewal=True):
+        # retire the open swaps of the last eon and load the multi eon ones in bulk
+        swap_rollover = SwapRollover(eon_number)
+        swap_rollover.retire_swaps()
+        swap_rollover.load()
+
         # TODO parallelism
-        token_commitments = [create_token_commitment_for_eon(token, eon_number) for token in
+        token_commitments = [create_token_commitment_for_eon(token, eon_number, swap_rollover) for token in
                              Token.objects.all().order_by('trail')]
 
         root_commitment = create_root_commitment_for_eon(
@@ -97,6 +105,10 @@ def create_checkpoint_for_eon(eon_number, latest_block_number):
 
         NOCUSTContractInterface().queue_submit_checkpoint(root_commitment)
 
+        # challenge answers are assembled from bundles prepared once the checkpoint is stored
+        transaction.on_commit(
+            lambda: precompute_challenge_proofs.delay(eon_number))
+
     return True
 
 
@@ -128,11 +140,14 @@ def create_root_commitment_for_eon(token_commitments: [TokenCommitment], eon_num
     return root_commitment
 
 
-def create_token_commitment_for_eon(token: Token, eon_number):
+def create_token_commitment_for_eon(token: Token, eon_number, swap_rollover: SwapRollover = None):
     logger.info('Creating Token Commitment for {} at {}'.format(
         token.address, eon_number))
     last_eon_number = eon_number - 1
 
+    if swap_rollover is None:
+        swap_rollover = SwapRollover(eon_number).load()
+
     with transaction.atomic():
         wallets = Wallet.objects\
             .filter(
@@ -231,11 +246,11 @@ def create_token_commitment_for_eon(token: Token, eon_number):
                 # starting balance included in every tx checksum should be set to the cached starting balance
                 # this way checkpoint state will match signed active state
                 if last_transfer.is_swap() and not last_transfer.cancelled:
-                    if Transfer.objects.filter(eon_number=last_transfer.eon_number-1, tx_id=last_transfer.tx_id).exists():
-                        matched_out, matched_in = last_transfer.matched_amounts(
-                            all_eons=True)
-                        current_matched_out, current_matched_in = last_transfer.matched_amounts(
-                            all_eons=False)
+                    if swap_rollover.is_multi_eon_swap(last_transfer):
+                        matched_out, matched_in = swap_rollover.matched_amounts(
+                            last_transfer, all_eons=True)
+                        current_matched_out, current_matched_in = swap_rollover.matched_amounts(
+                            last_transfer, all_eons=False)
                         if last_transfer_is_outgoing:
                             sender_starting_balance = last_transfer.sender_starting_balance
 
@@ -0,0 +1,17 @@
+import logging
+from celery import shared_task
+from celery.utils.log import get_task_logger
+from ledger.challenge_proofs import precompute_challenge_proof_bundles
+from operator_api.decorators import notification_on_error
+
+logger = get_task_logger(__name__)
+logger.setLevel(logging.INFO)
+
+
+@shared_task
+@notification_on_error
+def precompute_challenge_proofs(eon_number):
+    precomputed = precompute_challenge_proof_bundles(eon_number)
+    logger.info('Precomputed {} challenge proof bundles for eon {}.'.format(
+        precomputed, eon_number))
+    return precomputed
@@ -1,5 +1,8 @@
 import random
+import time
+from uuid import uuid4
 
+from django.test import TestCase
 from eth_utils import remove_0x_prefix
 
 from contractor.rpctestcase import RPCTestCase
@@ -11,12 +14,15 @@ from operator_api.simulation.epoch import commit_eon
 from operator_api.simulation.registration import register_testrpc_accounts
 from operator_api.simulation.swap import send_swap, finalize_last_swap, cancel_last_swap, freeze_last_swap
 from operator_api.simulation.tokens import deploy_new_test_token, distribute_token_balance_to_addresses
+from ledger.accounting_partitions import ADMISSIONS, BALANCES, ledger_partition, StageBudget, \
+    ACCOUNTING_STAGE_BUDGETS_KEY, ACCOUNTING_STAGE_METRICS_KEY
 from ledger.context.wallet_transfer import WalletTransferContext
-from ledger.models import Token, Transfer, Wallet, TokenPair
+from ledger.models import Token, Transfer, Wallet, TokenPair, RootCommitment
 from ledger.token_registration import register_token
 from swapper.tasks.cancel_finalize_swaps import cancel_finalize_swaps_for_eon
 from swapper.tasks.confirm_swaps import confirm_swaps_for_eon
 from swapper.tasks.process_swaps import process_swaps_for_eon
+from operator_api.models.mutex_model import strict_redis_client
 
 
 class LedgerTests(RPCTestCase):
@@ -229,3 +235,81 @@ class LedgerTests(RPCTestCase):
         commit_eon(
             test_case=self,
             eon_number=2)
+
+
+class AccountingPartitionTests(TestCase):
+    def setUp(self):
+        # far beyond the ids and eons of a running hub
+        self.tokens = [Token(id=2 ** 40 + i) for i in range(3)]
+        self.eon_number = 2 ** 40
+
+    def tearDown(self):
+        for eon_number in [self.eon_number - 1, self.eon_number]:
+            keys = strict_redis_client.keys('*eon_{}_*'.format(eon_number))
+            if keys:
+                strict_redis_client.delete(*keys)
+
+    def test_overlapping_partitions_exclude(self):
+        with ledger_partition(BALANCES, [self.tokens[0]], self.eon_number) as acquired:
+            self.assertTrue(acquired)
+            with ledger_partition(BALANCES, self.tokens[:2], self.eon_number) as acquired:
+                self.assertFalse(acquired)
+            with ledger_partition(BALANCES, self.tokens[1:], self.eon_number) as acquired:
+                self.assertTrue(acquired)
+            with ledger_partition(ADMISSIONS, [self.tokens[0]], self.eon_number) as acquired:
+                self.assertTrue(acquired)
+
+        with ledger_partition(BALANCES, self.tokens[:2], self.eon_number) as acquired:
+            self.assertTrue(acquired)
+
+    def test_checkpoint_waits_for_stages(self):
+        checkpoint_lock = RootCommitment.read_write_lock(
+            suffix=self.eon_number - 1, is_write=True, auto_renewal=False)
+        with ledger_partition(BALANCES, [self.tokens[0]], self.eon_number):
+            self.assertIsNone(checkpoint_lock.acquire(blocking=False))
+        self.assertIsNotNone(checkpoint_lock.acquire(blocking=False))
+        checkpoint_lock.release()
+
+
+class StageBudgetTests(TestCase):
+    def setUp(self):
+        self.stage = 'stage_{}'.format(uuid4().hex)
+        self.tokens = [Token(id=2 ** 40)]
+
+    def tearDown(self):
+        strict_redis_client.hdel(
+            ACCOUNTING_STAGE_BUDGETS_KEY, '{}/{}'.format(self.stage, self.tokens[0].id))
+        for field in ['runs', 'seconds', 'last_seconds', 'exhausted']:
+            strict_redis_client.hdel(
+                ACCOUNTING_STAGE_METRICS_KEY, '{}_{}'.format(self.stage, field))
+
+    def budget(self):
+        return StageBudget(self.stage, self.tokens, budget_seconds=0.1, max_budget_seconds=0.25)
+
+    def test_unused_time_carries_over_up_to_cap(self):
+        with self.budget() as budget:
+            self.assertAlmostEqual(budget.allowance, 0.1)
+        with self.budget() as budget:
+            self.assertAlmostEqual(budget.allowance, 0.2, places=2)
+        with self.budget() as budget:
+            self.assertAlmostEqual(budget.allowance, 0.25)
+
+    def test_overrun_is_paid_back(self):
+        with self.budget() as budget:
+            self.assertFalse(budget.exhausted())
+            time.sleep(0.3)
+            self.assertTrue(budget.exhausted())
+
+        # the debt is bounded by one budget
+        with self.budget() as budget:
+            self.assertEqual(budget.allowance, 0)
+            # the first item of a run is always processed
+            self.assertFalse(budget.exhausted())
+            self.assertTrue(budget.exhausted())
+
+        with self.budget() as budget:
+            self.assertAlmostEqual(budget.allowance, 0.1, places=2)
+
+        metrics = strict_redis_client.hgetall(ACCOUNTING_STAGE_METRICS_KEY)
+        self.assertEqual(int(metrics['{}_runs'.format(self.stage).encode()]), 3)
+        self.assertEqual(int(metrics['{}_exhausted'.format(self.stage).encode()]), 2)
@@ -19,7 +19,9 @@ else:
 operator_celery.conf.beat_schedule = {
     'heartbeat_accounting': {
         'task': 'heartbeat.tasks.heartbeat_accounting',
-        'schedule': 1.0
+        'schedule': 1.0,
+        # beats left on the queue behind a busy worker are dropped instead of piling up
+        'options': {'expires': 1.0}
     },
     'heartbeat_verifier': {
         'task': 'heartbeat.tasks.heartbeat_verifier',
@@ -29,6 +31,10 @@ operator_celery.conf.beat_schedule = {
         'task': 'contractor.tasks.health_checks.check_eth_level',
         'schedule': 3600.0  # 1 hour
     },
+    'prune_contract_states': {
+        'task': 'contractor.tasks.prune_contract_states.prune_contract_states',
+        'schedule': 3600.0  # 1 hour
+    },
     'update_tos': {
         'task': 'tos.tasks.update_tos',
         'schedule': 3600.0*24  # 1 day
@@ -54,6 +60,35 @@ operator_celery.conf.task_routes = {
     'heartbeat.tasks.heartbeat_accounting': {
         'queue': 'accounting'
     },
+    'heartbeat.tasks.finish_heartbeat_accounting': {
+        'queue': 'accounting'
+    },
+    # stages of the accounting heartbeat
+    'admission.tasks.process_admissions': {
+        'queue': 'accounting'
+    },
+    'contractor.tasks.slash_bad_withdrawals.slash_bad_withdrawals': {
+        'queue': 'accounting'
+    },
+    'transactor.tasks.process_passive_transfers.process_passive_transfers': {
+        'queue': 'accounting'
+    },
+    'swapper.tasks.confirm_swaps.confirm_swaps': {
+        'queue': 'accounting'
+    },
+    'swapper.tasks.cancel_finalize_swaps.cancel_finalize_swaps': {
+        'queue': 'accounting'
+    },
+    'swapper.tasks.process_swaps.process_swaps': {
+        'queue': 'accounting'
+    },
+    'ledger.tasks.create_checkpoint.create_checkpoint': {
+        'queue': 'accounting'
+    },
+    # kept off the verifier worker, which would hold off chain sync while building the bundles
+    'ledger.tasks.precompute_challenge_proofs.precompute_challenge_proofs': {
+        'queue': 'accounting'
+    },
 }
 
 # wrap register_token tasks
@@ -1,6 +1,6 @@
 from .clean_model import CleanModel
 from .mutex_model import MutexModel
-from .bulk_manager import BulkCreateManager
+from .bulk_manager import BulkCreateManager, BulkUpdateManager
 from .mock_model import MockModel
 from .errors import (
     ErrorCode,
@@ -1,12 +1,284 @@
-from django.conf import settings
-from django.db import models
-import redis
+import logging
+import threading
+import time
+from uuid import uuid4
+from celery.utils.log import get_task_logger
 import redis_lock
 
+logger = get_task_logger(__name__)
+logger.setLevel(logging.INFO)
 
+# milliseconds since the epoch by the redis server clock, so leases do not depend on the clocks of the hosts
+# KEYS: readers, writer, write pending, fence
+LOCK_SCRIPT_PRELUDE = """
+redis.replicate_commands()
+local time = redis.call('TIME')
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+local ttl = tonumber(ARGV[2])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now)
+"""
+
+# readers are refused while a writer holds the lock or waits for it
+ACQUIRE_READ_SCRIPT = LOCK_SCRIPT_PRELUDE + """
+if redis.call('EXISTS', KEYS[2]) == 1 or redis.call('EXISTS', KEYS[3]) == 1 then
+    return 0
+end
+redis.call('ZADD', KEYS[1], now + ttl, ARGV[1])
+if redis.call('PTTL', KEYS[1]) < ttl then
+    redis.call('PEXPIRE', KEYS[1], ttl)
+end
+return redis.call('INCR', KEYS[4])
+"""
+
+# a writer that finds the lock taken marks itself pending, the first pending writer goes next
+ACQUIRE_WRITE_SCRIPT = LOCK_SCRIPT_PRELUDE + """
+local pending = redis.call('GET', KEYS[3])
+if pending and pending ~= ARGV[1] then
+    return 0
+end
+if redis.call('EXISTS', KEYS[2]) == 1 or redis.call('ZCARD', KEYS[1]) > 0 then
+    redis.call('SET', KEYS[3], ARGV[1], 'PX', ttl)
+    return 0
+end
+redis.call('SET', KEYS[2], ARGV[1], 'PX', ttl)
+redis.call('DEL', KEYS[3])
+return redis.call('INCR', KEYS[4])
+"""
+
+RELEASE_READ_SCRIPT = """
+return redis.call('ZREM', KEYS[1], ARGV[1])
+"""
+
+RELEASE_WRITE_SCRIPT = """
+if redis.call('GET', KEYS[2]) == ARGV[1] then
+    return redis.call('DEL', KEYS[2])
+end
+return 0
+"""
+
+RENEW_READ_SCRIPT = LOCK_SCRIPT_PRELUDE + """
+if not redis.call('ZSCORE', KEYS[1], ARGV[1]) then
+    return 0
+end
+redis.call('ZADD', KEYS[1], now + ttl, ARGV[1])
+if redis.call('PTTL', KEYS[1]) < ttl then
+    redis.call('PEXPIRE', KEYS[1], ttl)
+end
+return 1
+"""
+
+RENEW_WRITE_SCRIPT = """
+if redis.call('GET', KEYS[2]) == ARGV[1] then
+    return redis.call('PEXPIRE', KEYS[2], ARGV[2])
+end
+return 0
+"""
+
+# polling intervals of a blocked acquire, in seconds
+LOCK_RETRY_DELAY = 0.001
+LOCK_MAX_RETRY_DELAY = 0.05
+
+
+# Parallel read, single write lock, write biased. Acquiring and releasing are single lua scripts, so
+# each takes one round trip. Readers hold leases in a sorted set scored by their expiry and writers a
+# key that expires, so a crashed holder blocks the lock for one expiry at most. Every acquisition
+# returns a fencing token from a counter that only increases.
+class ReadWriteLock(object):
+    def __init__(self, redis_client, name, auto_renewal=True, expiry_seconds=10, is_write=False):
+        self.auto_renewal = auto_renewal
+        self.expiry_seconds = expiry_seconds
+        self.is_write = is_write
+        self.redis_client = redis_client
+        self.id = uuid4().hex
+        self.token = None
+        self.keys = ['{0}/{1}_{2}'.format(self.__class__.__name__, name, suffix)
+                     for suffix in ['readers', 'writer', 'write_pending', 'fence']]
+        self.acquire_script = redis_client.register_script(
+            ACQUIRE_WRITE_SCRIPT if is_write else ACQUIRE_READ_SCRIPT)
+        self.release_script = redis_client.register_script(
+            RELEASE_WRITE_SCRIPT if is_write else RELEASE_READ_SCRIPT)
+        self.renew_script = redis_client.register_script(
+            RENEW_WRITE_SCRIPT if is_write else RENEW_READ_SCRIPT)
+        self.renewal_stop = None
+
+    def expiry_milliseconds(self):
+        return int(self.expiry_seconds * 1000)
+
+    # returns the fencing token, or None if the lock was not acquired without blocking
+    def acquire(self, blocking=True):
+        delay = LOCK_RETRY_DELAY
+        while True:
+            token = self.acquire_script(
+                keys=self.keys, args=[self.id, self.expiry_milliseconds()])
+            if token:
+                break
+            if not blocking:
+                return None
+            time.sleep(delay)
+            delay = min(2 * delay, LOCK_MAX_RETRY_DELAY)
+
+        self.token = int(token)
+        if self.auto_renewal:
+            self.start_renewal()
+        return self.token
+
+    def lock(self):
+        return self.acquire(blocking=True)
+
+    def renew(self):
+        return bool(self.renew_script(keys=self.keys, args=[self.id, self.expiry_milliseconds()]))
+
+    def start_renewal(self):
+        self.renewal_stop = threading.Event()
+
+        def renew_until_released(stop):
+            while not stop.wait(self.expiry_seconds * 2 / 3):
+                if not self.renew():
+                    logger.error('Lock {} expired before renewal.'.format(self.keys[1]))
+                    return
+
+        threading.Thread(target=renew_until_released,
+                         args=(self.renewal_stop,), daemon=True).start()
+
+    def release(self):
+        if self.renewal_stop is not None:
+            self.renewal_stop.set()
+            self.renewal_stop = None
+        if not self.release_script(keys=self.keys, args=[self.id]):
+            logger.warning('Lock {} expired before release, token {}.'.format(
+                self.keys[1], self.token))
+
+    # syntactic sugar
+    # implementing python pattern, to use this lock inside a "with" context statement
+    def __enter__(self):
+        return self.lock()
+
+    def __exit__(self, type, value, traceback):
+        self.release()
+
+
+# takes every key or none, returns 0 or the 1-based index of a key held by someone else
+# KEYS: lock keys, ARGV: id, expiry in milliseconds
+ACQUIRE_MANY_SCRIPT = """
+for index, key in ipairs(KEYS) do
+    if redis.call('EXISTS', key) == 1 then
+        return index
+    end
+end
+for _, key in ipairs(KEYS) do
+    redis.call('SET', key, ARGV[1], 'PX', ARGV[2])
+end
+return 0
+"""
+
+# releases the keys still held and signals their waiters, as redis_lock does for a single key
+# KEYS: lock keys followed by their signal keys, ARGV: id, signal expiry in milliseconds
+RELEASE_MANY_SCRIPT = """
+local count = #KEYS / 2
+local released = 0
+for index = 1, count do
+    if redis.call('GET', KEYS[index]) == ARGV[1] then
+        redis.call('DEL', KEYS[count + index])
+        redis.call('LPUSH', KEYS[count + index], 1)
+        redis.call('PEXPIRE', KEYS[count + index], ARGV[2])
+        redis.call('DEL', KEYS[index])
+        released = released + 1
+    end
+end
+return released
+"""
+
+RENEW_MANY_SCRIPT = """
+local renewed = 0
+for _, key in ipairs(KEYS) do
+    if redis.call('GET', key) == ARGV[1] then
+        redis.call('PEXPIRE', key, ARGV[2])
+        renewed = renewed + 1
+    end
+end
+return renewed
+"""
+
+SIGNAL_EXPIRY_MILLISECONDS = 1000
+
+
+# Holds the locks of several objects at once. The keys are those redis_lock uses for a single name,
+# so the objects stay mutually exclusive with their own lock(), but all are taken in one script or
+# none is, and a single thread renews them together. A blocked acquire waits on the release signal
+# of the key it found held.
+class MultiKeyLock(object):
+    def __init__(self, redis_client, names, auto_renewal=False, expiry_seconds=5):
+        self.redis_client = redis_client
+        self.names = sorted(set(names))
+        self.keys = ['lock:{}'.format(name) for name in self.names]
+        self.signals = ['lock-signal:{}'.format(name) for name in self.names]
+        self.auto_renewal = auto_renewal
+        self.expiry_seconds = expiry_seconds
+        self.id = uuid4().hex
+        self.acquire_script = redis_client.register_script(ACQUIRE_MANY_SCRIPT)
+        self.release_script = redis_client.register_script(RELEASE_MANY_SCRIPT)
+        self.renew_script = redis_client.register_script(RENEW_MANY_SCRIPT)
+        self.renewal_stop = None
+
+    def expiry_milliseconds(self):
+        return int(self.expiry_seconds * 1000)
+
+    def acquire(self, blocking=True):
+        if not self.keys:
+            return True
+        while True:
+            held = self.acquire_script(
+                keys=self.keys, args=[self.id, self.expiry_milliseconds()])
+            if not held:
+                break
+            if not blocking:
+                return False
+            self.redis_client.blpop(
+                self.signals[held - 1], max(1, int(self.expiry_seconds)))
+
+        if self.auto_renewal:
+            self.start_renewal()
+        return True
+
+    def renew(self):
+        return self.renew_script(keys=self.keys, args=[self.id, self.expiry_milliseconds()]) == len(self.keys)
+
+    def start_renewal(self):
+        self.renewal_stop = threading.Event()
+
+        def renew_until_released(stop):
+            while not stop.wait(self.expiry_seconds * 2 / 3):
+                if not self.renew():
+                    logger.error('Locks {} expired before renewal.'.format(self.names))
+                    return
+
+        threading.Thread(target=renew_until_released,
+                         args=(self.renewal_stop,), daemon=True).start()
+
+    def release(self):
+        if self.renewal_stop is not None:
+            self.renewal_stop.set()
+            self.renewal_stop = None
+        if not self.keys:
+            return
+        released = self.release_script(
+            keys=self.keys + self.signals, args=[self.id, SIGNAL_EXPIRY_MILLISECONDS])
+        if released != len(self.keys):
+            logger.warning('Locks {} expired before release.'.format(self.names))
+
+    def __enter__(self):
+        self.acquire(blocking=True)
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.release()
+
+
+# previous implementation over three redis locks and a read counter, 6+ round trips per read acquire,
+# kept as the baseline of the lock contention benchmark
 # parallel read, single write lock
 # write biased
-class ReadWriteLock():
+class MultiLockReadWriteLock():
     @classmethod
     def get_locks(cls, redis_client, name, auto_renewal, expiry_seconds):
         # confirmation lock guarantee consistency when writing
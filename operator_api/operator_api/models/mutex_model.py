@@ -2,7 +2,7 @@ from django.conf import settings
 from django.db import models
 import redis
 import redis_lock
-from .locks import ReadWriteLock
+from .locks import ReadWriteLock, MultiKeyLock
 
 
 strict_redis_client = redis.StrictRedis(
@@ -15,15 +15,27 @@ class MutexModel(models.Model):
     class Meta:
         abstract = True,
 
+    def lock_name(self):
+        return '{0}__locked:{1}'.format(self.__class__.__name__, self.id)
+
     def lock(self, acquirer_id=None, auto_renewal=False, expiry_seconds=5):
         return redis_lock.Lock(
             redis_client=strict_redis_client,
-            name='{0}__locked:{1}'.format(self.__class__.__name__, self.id),
+            name=self.lock_name(),
             expire=expiry_seconds,
             id=acquirer_id,
             auto_renewal=auto_renewal,
             strict=True)
 
+    # locks of several objects, possibly of different models, taken atomically in a single round trip
+    @staticmethod
+    def lock_many(*objects, auto_renewal=False, expiry_seconds=5):
+        return MultiKeyLock(
+            strict_redis_client,
+            [obj.lock_name() for obj in objects],
+            auto_renewal=auto_renewal,
+            expiry_seconds=expiry_seconds)
+
     @classmethod
     def global_lock(cls, acquirer_id=None, auto_renewal=True, expiry_seconds=10):
         return redis_lock.Lock(
@@ -248,7 +248,70 @@ HUB_ETHEREUM_NODE_URL = os.environ.get(
     'HUB_ETHEREUM_NODE_URL', 'http://localhost:8545')
 HUB_ETHEREUM_NETWORK_IS_POA = os.environ.get(
     'HUB_ETHEREUM_NETWORK_IS_POA', '').lower() == 'true'
-# TODO HUB_MAX_BLOCKS_PER_SYNC = os.environ.get('HUB_MAX_BLOCKS_PER_SYNC', 50)
+# blocks committed by one synchronization run, and bounds of the number of block fetches kept in flight
+HUB_MAX_BLOCKS_PER_SYNC = int(os.environ.get(
+    'HUB_MAX_BLOCKS_PER_SYNC',
+    50))
+HUB_SYNC_MIN_LOOKAHEAD = int(os.environ.get(
+    'HUB_SYNC_MIN_LOOKAHEAD',
+    11))
+HUB_SYNC_MAX_LOOKAHEAD = int(os.environ.get(
+    'HUB_SYNC_MAX_LOOKAHEAD',
+    32))
+# unconfirmed blocks kept in the running state buffer
+HUB_RUNNING_STATE_BUFFER_SIZE = int(os.environ.get(
+    'HUB_RUNNING_STATE_BUFFER_SIZE',
+    256))
+# fetch block snapshots from the synchronizing process itself instead of through the blockchain workers
+HUB_SYNC_FETCH_IN_PROCESS = os.environ.get(
+    'HUB_SYNC_FETCH_IN_PROCESS', 'true').lower() == 'true'
+# pruned contract states are archived here as gzipped json lines, one file per eon
+HUB_CONTRACT_STATE_ARCHIVE_DIR = os.environ.get(
+    'HUB_CONTRACT_STATE_ARCHIVE_DIR',
+    os.path.join(BASE_DIR, 'archive'))
+# upper bound of the block ranges requested through eth_getLogs
+HUB_MAX_LOG_RANGE = int(os.environ.get(
+    'HUB_MAX_LOG_RANGE',
+    1000))
+
+# threads answering open challenges concurrently
+HUB_CHALLENGE_RESPONSE_WORKERS = int(os.environ.get(
+    'HUB_CHALLENGE_RESPONSE_WORKERS',
+    8))
+# gas price of the first attempt to deliver a queued transaction
+HUB_TX_INITIAL_GAS_PRICE_GWEI = int(os.environ.get(
+    'HUB_TX_INITIAL_GAS_PRICE_GWEI',
+    100))
+HUB_TX_MAX_GAS_PRICE_GWEI = int(os.environ.get(
+    'HUB_TX_MAX_GAS_PRICE_GWEI',
+    5000))
+# blocks an unmined attempt waits before it is replaced, shrinking towards one block near the deadline
+HUB_TX_RESEND_BLOCKS = int(os.environ.get(
+    'HUB_TX_RESEND_BLOCKS',
+    10))
+# gas price multiplier of a replacement attempt, rising from the base to the max multiplier
+# as urgency ** exponent, urgency being the elapsed fraction of the time until the deadline
+HUB_TX_GAS_ESCALATION = float(os.environ.get(
+    'HUB_TX_GAS_ESCALATION',
+    2.0))
+HUB_TX_GAS_ESCALATION_MAX = float(os.environ.get(
+    'HUB_TX_GAS_ESCALATION_MAX',
+    4.0))
+HUB_TX_GAS_ESCALATION_EXPONENT = float(os.environ.get(
+    'HUB_TX_GAS_ESCALATION_EXPONENT',
+    2.0))
+
+# seconds one run of an accounting stage spends on a partition, and the most it can save up from shorter runs
+HUB_ACCOUNTING_STAGE_BUDGET_SECONDS = float(os.environ.get(
+    'HUB_ACCOUNTING_STAGE_BUDGET_SECONDS',
+    0.5))
+HUB_ACCOUNTING_STAGE_MAX_BUDGET_SECONDS = float(os.environ.get(
+    'HUB_ACCOUNTING_STAGE_MAX_BUDGET_SECONDS',
+    2.0))
+# seconds after which an accounting heartbeat that never finished stops holding off the next ones
+HUB_ACCOUNTING_HEARTBEAT_TIMEOUT = int(os.environ.get(
+    'HUB_ACCOUNTING_HEARTBEAT_TIMEOUT',
+    60))
 
 HUB_TRANSFER_TIMEOUT_SECONDS = os.environ.get(
     'HUB_TRANSFER_TIMEOUT_SECONDS', 60)
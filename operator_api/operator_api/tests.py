@@ -1,5 +1,11 @@
+import threading
+import time
+from uuid import uuid4
+import redis_lock
 from django.test import TestCase
 from operator_api import crypto
+from operator_api.models.locks import ReadWriteLock, MultiKeyLock
+from operator_api.models.mutex_model import strict_redis_client
 from operator_api.tx_merkle_tree import TransactionMerkleTree
 from operator_api.tx_optimized_merkle_tree import OptimizedTransactionMerkleTree
 
@@ -230,3 +236,90 @@ class OperatorTests(TestCase):
         merkle_hash_cache, merkle_height_cache = optimized_tree.merkle_cache_stacks()
 
         self.assertEqual(root_hash, reference_tree.root_hash())
+
+
+class ReadWriteLockTests(TestCase):
+    def setUp(self):
+        self.name = 'test-{}'.format(uuid4().hex)
+
+    def tearDown(self):
+        keys = strict_redis_client.keys('*{}*'.format(self.name))
+        if keys:
+            strict_redis_client.delete(*keys)
+
+    def read_lock(self, **kwargs):
+        return ReadWriteLock(strict_redis_client, self.name, auto_renewal=False, **kwargs)
+
+    def write_lock(self, **kwargs):
+        return ReadWriteLock(strict_redis_client, self.name, auto_renewal=False, is_write=True, **kwargs)
+
+    def test_readers_share_writers_exclude(self):
+        first_reader, second_reader, writer = self.read_lock(), self.read_lock(), self.write_lock()
+        first_token = first_reader.acquire(blocking=False)
+        second_token = second_reader.acquire(blocking=False)
+        self.assertIsNotNone(first_token)
+        self.assertGreater(second_token, first_token)
+        self.assertIsNone(writer.acquire(blocking=False))
+
+        first_reader.release()
+        second_reader.release()
+        writer_token = writer.acquire(blocking=False)
+        self.assertGreater(writer_token, second_token)
+        self.assertIsNone(self.read_lock().acquire(blocking=False))
+        self.assertIsNone(self.write_lock().acquire(blocking=False))
+
+        writer.release()
+        self.assertIsNotNone(self.read_lock().acquire(blocking=False))
+
+    def test_waiting_writer_goes_before_new_readers(self):
+        reader, writer = self.read_lock(), self.write_lock()
+        reader.acquire(blocking=False)
+        self.assertIsNone(writer.acquire(blocking=False))
+
+        # the writer is pending, so readers and other writers wait behind it
+        self.assertIsNone(self.read_lock().acquire(blocking=False))
+        self.assertIsNone(self.write_lock().acquire(blocking=False))
+
+        reader.release()
+        self.assertIsNotNone(writer.acquire(blocking=False))
+
+    def test_expired_reader_does_not_block_writer(self):
+        self.read_lock(expiry_seconds=0.05).acquire(blocking=False)
+        writer = self.write_lock()
+        self.assertIsNone(writer.acquire(blocking=False))
+        self.assertIsNotNone(writer.acquire(blocking=True))
+
+
+class MultiKeyLockTests(TestCase):
+    def setUp(self):
+        self.names = ['test-{}'.format(uuid4().hex) for _ in range(3)]
+
+    def tearDown(self):
+        strict_redis_client.delete(*['lock:{}'.format(name) for name in self.names])
+
+    def single_lock(self, name):
+        return redis_lock.Lock(redis_client=strict_redis_client, name=name, expire=5, strict=True)
+
+    def test_all_or_nothing(self):
+        held = self.single_lock(self.names[2])
+        held.acquire()
+
+        multi_lock = MultiKeyLock(strict_redis_client, self.names)
+        self.assertFalse(multi_lock.acquire(blocking=False))
+        self.assertFalse(strict_redis_client.exists('lock:{}'.format(self.names[0])))
+
+        held.release()
+        self.assertTrue(multi_lock.acquire(blocking=False))
+        self.assertFalse(self.single_lock(self.names[0]).acquire(blocking=False))
+
+        multi_lock.release()
+        self.assertTrue(self.single_lock(self.names[0]).acquire(blocking=False))
+
+    def test_blocked_acquire_wakes_on_release(self):
+        held = self.single_lock(self.names[1])
+        held.acquire()
+        threading.Timer(0.1, held.release).start()
+
+        started = time.monotonic()
+        with MultiKeyLock(strict_redis_client, self.names, expiry_seconds=5):
+            self.assertLess(time.monotonic() - started, 1)
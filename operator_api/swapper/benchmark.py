@@ -0,0 +1,398 @@
+import json
+import random
+import time
+import uuid
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from sortedcontainers import SortedKeyList
+from operator_api import crypto
+from operator_api.crypto import sign_message, encode_signature
+from operator_api.util import ZERO_CHECKSUM
+from ledger.models import Token, Wallet, Transfer, Matching, ActiveState, Signature, MinimumAvailableBalanceMarker
+from swapper.matcher import match_limit_to_limit, price_sorting_key, MatchingBatch
+
+
+# Stream events are plain dictionaries so that they can be stored as json lines
+#   order:  {'type': 'order', 'id', 'eon_number', 'account', 'token', 'token_swapped',
+#            'amount', 'amount_swapped', 'sell_order', 'eon_count'}
+#   cancel: {'type': 'cancel', 'id', 'eon_number'}
+# Events must be ordered by time, eon numbers are only required to be non-decreasing.
+
+
+def synthetic_order_stream(order_count, seed=None, eon_count=1, tokens=('ETH', 'LQD'), account_count=8,
+                           cancellation_ratio=0.05, multi_eon_ratio=0.1, spread=0.02):
+    generator = random.Random(seed)
+    orders_per_eon = max(1, order_count // eon_count)
+    base_unit = 10 ** 16
+    mid_price = 1.0
+    open_orders = []
+    events = []
+
+    for index in range(order_count):
+        eon_number = 1 + min(index // orders_per_eon, eon_count - 1)
+
+        if open_orders and generator.random() < cancellation_ratio:
+            events.append({
+                'type': 'cancel',
+                'id': open_orders.pop(generator.randrange(len(open_orders))),
+                'eon_number': eon_number})
+
+        # random walk of the mid price, orders are spread around it
+        mid_price *= 1 + generator.uniform(-spread, spread) / 10
+        token, token_swapped = generator.sample(tokens, 2)
+        price = mid_price * (1 + generator.uniform(-spread, spread))
+        if token != tokens[0]:
+            price = 1 / price
+
+        amount = generator.randint(1, 100) * base_unit
+        amount_swapped = max(1, int(amount * price))
+        order_id = str(index)
+        events.append({
+            'type': 'order',
+            'id': order_id,
+            'eon_number': eon_number,
+            'account': generator.randrange(account_count),
+            'token': token,
+            'token_swapped': token_swapped,
+            'amount': amount,
+            'amount_swapped': amount_swapped,
+            'sell_order': generator.random() < 0.5,
+            'eon_count': generator.randint(2, 4) if generator.random() < multi_eon_ratio else 1})
+        open_orders.append(order_id)
+
+    return events
+
+
+# Export recorded swaps from the Transfer/Matching tables in stream form
+# Returns the recorded matching count alongside the events for comparison with a replay
+def export_swap_history(eon_from=None, eon_to=None):
+    swaps = Transfer.objects\
+        .filter(swap=True)\
+        .select_related('wallet__token', 'recipient__token', 'sender_cancellation_active_state')\
+        .order_by('tx_id', 'eon_number')
+    matchings = Matching.objects.all()
+    if eon_from is not None:
+        swaps = swaps.filter(eon_number__gte=eon_from)
+        matchings = matchings.filter(eon_number__gte=eon_from)
+    if eon_to is not None:
+        swaps = swaps.filter(eon_number__lte=eon_to)
+        matchings = matchings.filter(eon_number__lte=eon_to)
+
+    accounts = {}
+    timed_events = []
+    order_event = None
+
+    for swap in swaps:
+        # only the first eon of a multi eon swap is an order, the rest are carried forward
+        if order_event is not None and order_event['id'] == str(swap.tx_id):
+            order_event['eon_count'] += 1
+            continue
+
+        account = accounts.setdefault(swap.wallet.address, len(accounts))
+        order_id = str(swap.tx_id)
+        order_event = {
+            'type': 'order',
+            'id': order_id,
+            'eon_number': swap.eon_number,
+            'account': account,
+            'token': swap.wallet.token.short_name or swap.wallet.token.address,
+            'token_swapped': swap.recipient.token.short_name or swap.recipient.token.address,
+            'amount': int(swap.amount),
+            'amount_swapped': int(swap.amount_swapped),
+            'sell_order': swap.sell_order,
+            'eon_count': 1}
+        timed_events.append((swap.time, order_event))
+
+        if swap.cancelled and swap.sender_cancellation_active_state is not None:
+            timed_events.append((swap.sender_cancellation_active_state.time, {
+                'type': 'cancel',
+                'id': order_id,
+                'eon_number': swap.sender_cancellation_active_state.eon_number}))
+
+    timed_events.sort(key=lambda timed_event: timed_event[0])
+
+    # eon numbers must not decrease along the stream
+    events, eon_number = [], None
+    for _, event in timed_events:
+        eon_number = max(eon_number or event['eon_number'], event['eon_number'])
+        event['eon_number'] = eon_number
+        events.append(event)
+
+    return events, matchings.count()
+
+
+def write_stream(path, events, recorded_matches=None):
+    with open(path, 'w') as stream_file:
+        stream_file.write(json.dumps(
+            {'type': 'header', 'recorded_matches': recorded_matches}) + '\n')
+        for event in events:
+            stream_file.write(json.dumps(event) + '\n')
+
+
+def read_stream(path):
+    events, recorded_matches = [], None
+    with open(path) as stream_file:
+        for line in stream_file:
+            if not line.strip():
+                continue
+            event = json.loads(line)
+            if event.get('type') == 'header':
+                recorded_matches = event.get('recorded_matches')
+            else:
+                events.append(event)
+    return events, recorded_matches
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0
+    index = min(len(sorted_values) - 1, int(fraction * len(sorted_values)))
+    return sorted_values[index]
+
+
+class BenchmarkReport(object):
+    def __init__(self):
+        self.orders = 0
+        self.cancellations = 0
+        self.eons = 1
+        self.attempts = 0
+        self.matches = 0
+        self.queries = 0
+        self.latencies = []
+        self.matching_time = 0.0
+        self.total_time = 0.0
+        self.recorded_matches = None
+
+    def record_attempt(self, matched, latency, queries):
+        self.attempts += 1
+        self.matches += 1 if matched else 0
+        self.queries += queries
+        self.latencies.append(latency)
+        self.matching_time += latency
+
+    # batched writes of a sweep count towards matching time and queries, but not per match latency
+    def record_flush(self, latency, queries):
+        self.queries += queries
+        self.matching_time += latency
+
+    def summary(self):
+        latencies = sorted(self.latencies)
+        return {
+            'orders': self.orders,
+            'cancellations': self.cancellations,
+            'eons': self.eons,
+            'match_attempts': self.attempts,
+            'matches': self.matches,
+            'recorded_matches': self.recorded_matches,
+            'matches_per_second': self.matches / self.matching_time if self.matching_time else 0,
+            'p50_match_latency_ms': 1000 * percentile(latencies, 0.50),
+            'p99_match_latency_ms': 1000 * percentile(latencies, 0.99),
+            'queries_per_match': self.queries / self.matches if self.matches else 0,
+            'total_seconds': self.total_time,
+        }
+
+    def __str__(self):
+        return '\n'.join('{}: {}'.format(key, value) for key, value in self.summary().items())
+
+
+# Feeds an order stream through match_limit_to_limit using the same order book walk as process_swaps
+# Signature validation and voiding are skipped, all fixtures are written to the current database,
+# so this should run inside a transaction that is rolled back afterwards.
+class MatchingBenchmark(object):
+    def __init__(self, account_count=8):
+        self.account_count = account_count
+        self.tokens = {}
+        self.wallets = {}
+        self.wallet_fixtures = {}
+        self.orders = {}
+        self.order_books = {}
+        self.sorting_key = price_sorting_key()
+        self.eon_number = None
+        self.report = BenchmarkReport()
+
+    def prepare_fixtures(self, events):
+        labels = sorted({event[key] for event in events if event['type'] == 'order'
+                         for key in ('token', 'token_swapped')})
+        accounts = max([event['account'] for event in events if event['type'] == 'order'] +
+                       [self.account_count - 1]) + 1
+        next_trail = (Token.objects.order_by('trail').values_list(
+            'trail', flat=True).last() or 0) + 1
+
+        for index, label in enumerate(labels):
+            _, _, address = crypto.generate_wallet()
+            self.tokens[label] = Token.objects.create(
+                address=address,
+                name='Benchmark {}'.format(label),
+                short_name=label,
+                trail=next_trail + index,
+                block=0)
+
+        for account in range(accounts):
+            private_key, _, address = crypto.generate_wallet()
+            for label, token in self.tokens.items():
+                wallet = Wallet.objects.create(
+                    address=address,
+                    token=token,
+                    registration_eon_number=0)
+                self.wallets[(account, label)] = wallet
+                self.wallet_fixtures[wallet.id] = self.create_wallet_fixtures(
+                    wallet, private_key.to_string().hex())
+
+    # a signed placeholder active state and balance marker, shared by all orders of a wallet
+    @staticmethod
+    def create_wallet_fixtures(wallet, private_key):
+        signature = Signature.objects.create(
+            wallet=wallet,
+            checksum=ZERO_CHECKSUM,
+            value=encode_signature(sign_message(crypto.decode_hex(ZERO_CHECKSUM), private_key)))
+        active_state = ActiveState(
+            wallet=wallet,
+            updated_spendings=0,
+            updated_gains=0,
+            wallet_signature=signature,
+            eon_number=0,
+            tx_set_hash=ZERO_CHECKSUM,
+            tx_set_index=0)
+        active_state.save_dirty()
+        balance_marker = MinimumAvailableBalanceMarker(
+            wallet=wallet,
+            amount=0,
+            eon_number=0,
+            signature=signature)
+        balance_marker.save_dirty()
+        return active_state, balance_marker
+
+    def book_for(self, wallet, recipient):
+        return self.order_books.setdefault(
+            (wallet.token_id, recipient.token_id), SortedKeyList(key=self.sorting_key))
+
+    def place_order(self, event):
+        wallet = self.wallets[(event['account'], event['token'])]
+        recipient = self.wallets[(event['account'], event['token_swapped'])]
+        active_state, balance_marker = self.wallet_fixtures[wallet.id]
+        recipient_active_state, _ = self.wallet_fixtures[recipient.id]
+        tx_id = uuid.uuid4()
+        nonce = random.randint(1, 2 ** 64)
+
+        orders = [Transfer(
+            wallet=wallet,
+            amount=event['amount'],
+            eon_number=self.eon_number + eon_offset,
+            recipient=recipient,
+            amount_swapped=event['amount_swapped'],
+            nonce=nonce,
+            processed=False,
+            complete=False,
+            swap=True,
+            sell_order=event['sell_order'],
+            tx_id=tx_id,
+            sender_active_state=active_state,
+            recipient_active_state=recipient_active_state,
+            sender_balance_marker=balance_marker) for eon_offset in range(event.get('eon_count', 1))]
+        Transfer.objects.bulk_create(orders)
+
+        swap = Transfer.objects\
+            .select_related('wallet__token', 'recipient__token')\
+            .get(tx_id=tx_id, eon_number=self.eon_number)
+        self.orders[event['id']] = tx_id
+        self.report.orders += 1
+        return swap
+
+    def cancel_order(self, event):
+        tx_id = self.orders.get(event['id'])
+        if tx_id is None:
+            return
+        try:
+            swap = Transfer.objects.get(
+                tx_id=tx_id, eon_number=self.eon_number, processed=False)
+        except Transfer.DoesNotExist:
+            return
+        self.book_for(swap.wallet, swap.recipient).discard(swap)
+        swap.close(cancelled=True, appended=True)
+        self.report.cancellations += 1
+
+    # close all open orders of the ending eon and carry multi eon orders into the next one
+    def advance_eon(self, eon_number):
+        Transfer.objects\
+            .filter(
+                swap=True,
+                processed=False,
+                eon_number__lt=eon_number,
+                wallet__token__in=self.tokens.values())\
+            .update(processed=True, appended=True)
+
+        self.eon_number = eon_number
+        self.report.eons += 1
+        self.order_books = {}
+
+        carried_orders = Transfer.objects\
+            .filter(
+                swap=True,
+                processed=False,
+                complete=False,
+                voided=False,
+                cancelled=False,
+                eon_number=eon_number,
+                wallet__token__in=self.tokens.values())\
+            .select_related('wallet__token', 'recipient__token')
+        for order in carried_orders:
+            self.book_for(order.wallet, order.recipient).add(order)
+
+    def match_order(self, swap):
+        opposite_order_book = self.book_for(swap.recipient, swap.wallet)
+        opposite_orders_consumed = 0
+        matching_batch = MatchingBatch()
+
+        for opposite in opposite_order_book:
+            # The invariant is that the buy order price is greater than or equal to the sell order price
+            if swap.amount * opposite.amount < opposite.amount_swapped * swap.amount_swapped:
+                break
+
+            if opposite.is_fulfilled_swap():
+                opposite_orders_consumed += 1
+                continue
+
+            with CaptureQueriesContext(connection) as queries:
+                start = time.perf_counter()
+                matched_successfully = match_limit_to_limit(
+                    swap, opposite, matching_batch)
+                latency = time.perf_counter() - start
+            self.report.record_attempt(
+                matched_successfully, latency, len(queries))
+
+            if opposite.is_fulfilled_swap():
+                opposite_orders_consumed += 1
+
+            if swap.is_fulfilled_swap():
+                break
+
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            matching_batch.flush()
+            latency = time.perf_counter() - start
+        self.report.record_flush(latency, len(queries))
+
+        del opposite_order_book[:opposite_orders_consumed]
+
+        if not swap.is_fulfilled_swap():
+            self.book_for(swap.wallet, swap.recipient).add(swap)
+
+    def run(self, events, recorded_matches=None):
+        start = time.perf_counter()
+        self.report.recorded_matches = recorded_matches
+        self.prepare_fixtures(events)
+
+        if events:
+            self.eon_number = events[0]['eon_number']
+
+        for event in events:
+            if event['eon_number'] > self.eon_number:
+                self.advance_eon(event['eon_number'])
+
+            if event['type'] == 'order':
+                self.match_order(self.place_order(event))
+            elif event['type'] == 'cancel':
+                self.cancel_order(event)
+
+        self.report.total_time = time.perf_counter() - start
+        return self.report
@@ -0,0 +1,56 @@
+import logging
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from swapper.benchmark import MatchingBenchmark, synthetic_order_stream, export_swap_history, read_stream, write_stream
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the limit order matching engine on a synthetic or recorded order stream'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--orders', type=int, default=1000,
+                            help='number of synthetic orders')
+        parser.add_argument('--eons', type=int, default=1,
+                            help='number of eons spanned by synthetic orders')
+        parser.add_argument('--seed', type=int, default=None)
+        parser.add_argument('--accounts', type=int, default=8)
+        parser.add_argument('--replay', type=str, default=None,
+                            help='replay an order stream file instead of synthetic orders')
+        parser.add_argument('--export', type=str, default=None,
+                            help='export recorded swap history to an order stream file and exit')
+        parser.add_argument('--eon-from', type=int, default=None)
+        parser.add_argument('--eon-to', type=int, default=None)
+
+    def handle(self, *args, **options):
+        if options['export']:
+            events, recorded_matches = export_swap_history(
+                eon_from=options['eon_from'],
+                eon_to=options['eon_to'])
+            write_stream(options['export'], events, recorded_matches)
+            self.stdout.write('Exported {} events, {} recorded matches.'.format(
+                len(events), recorded_matches))
+            return
+
+        if options['replay']:
+            try:
+                events, recorded_matches = read_stream(options['replay'])
+            except (OSError, ValueError) as e:
+                raise CommandError(e)
+        else:
+            events, recorded_matches = synthetic_order_stream(
+                order_count=options['orders'],
+                seed=options['seed'],
+                eon_count=options['eons'],
+                account_count=options['accounts']), None
+
+        # matching logs every volume computation, which would dominate the measurement
+        logging.getLogger('swapper.matcher.limit_to_limit').setLevel(
+            logging.WARNING)
+
+        # all benchmark fixtures are discarded
+        with transaction.atomic():
+            report = MatchingBenchmark(account_count=options['accounts']).run(
+                events, recorded_matches=recorded_matches)
+            transaction.set_rollback(True)
+
+        self.stdout.write(str(report))
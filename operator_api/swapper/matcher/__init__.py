@@ -1,2 +1,3 @@
+from .matching_batch import MatchingBatch
 from .limit_to_limit import match_limit_to_limit
-from .order_sorting import price_comparison_function
+from .order_sorting import order_price, price_sorting_key
@@ -1,7 +1,8 @@
-from ledger.models import Transfer, Matching
+from ledger.models import Transfer
 import logging
 from celery.utils.log import get_task_logger
-from django.db import transaction, IntegrityError
+from django.db import IntegrityError
+from .matching_batch import MatchingBatch
 
 
 logger = get_task_logger(__name__)
@@ -11,7 +12,17 @@ logger.setLevel(logging.INFO)
 # The price of the right order is to be taken in this context, which means that the left order should be the more recent
 # order to align with the pricing strategy
 # returns true if orders were matched
-def match_limit_to_limit(left_order: Transfer, right_order: Transfer):
+# the matching and order state changes are queued on matching_batch, which is flushed right away if not provided
+def match_limit_to_limit(left_order: Transfer, right_order: Transfer, matching_batch: MatchingBatch = None):
+    if matching_batch is None:
+        matching_batch = MatchingBatch()
+        matched = match_limit_to_limit(left_order, right_order, matching_batch)
+        try:
+            matching_batch.flush()
+        except IntegrityError:
+            return False
+        return matched
+
     assert(left_order.wallet.token == right_order.recipient.token)
     assert(left_order.recipient.token == right_order.wallet.token)
 
@@ -19,10 +30,10 @@ def match_limit_to_limit(left_order: Transfer, right_order: Transfer):
             right_order.amount * left_order.amount)
 
     # fetch all past matches
-    left_matched_out, left_matched_in = left_order.matched_amounts(
-        all_eons=True)
-    right_matched_out, right_matched_in = right_order.matched_amounts(
-        all_eons=True)
+    left_matched_out, left_matched_in = matching_batch.matched_amounts(
+        left_order)
+    right_matched_out, right_matched_in = matching_batch.matched_amounts(
+        right_order)
 
     left_remaining_out = left_order.amount - left_matched_out
     left_remaining_in = left_order.amount_swapped - left_matched_in
@@ -101,52 +112,49 @@ def match_limit_to_limit(left_order: Transfer, right_order: Transfer):
         logger.error('Matching overspends buyer limit.')
         return False
 
-    try:
-        with transaction.atomic():
-            Matching.objects.create(
-                eon_number=left_order.eon_number,
-                left_order_tx_id=left_order.tx_id,
-                right_order_tx_id=right_order.tx_id,
-                left_deducted_right_granted_amount=left_to_right_token_volume_traded,
-                right_deducted_left_granted_amount=right_to_left_token_volume_traded,
-                left_token=left_order.wallet.token,
-                right_token=right_order.wallet.token)
-            logger.info('Match {}-{}: {}/{}'.format(
-                left_order.tx_id,
-                right_order.tx_id,
-                left_to_right_token_volume_traded,
-                right_to_left_token_volume_traded))
-
-            if new_left_matched_out == left_order.amount:
-                assert(new_left_matched_in >= left_order.amount_swapped)
-                logger.info('L-Order {} complete. (+{})'.format(left_order.id,
-                                                                new_left_matched_in - left_order.amount_swapped))
-                logger.info('L-Sell-Order {} complete. (+{})'.format(left_order.id,
-                                                                     new_left_matched_in - left_order.amount_swapped))
-                left_order.change_state(complete=True, appended=True)
-            elif (not left_order.sell_order) and new_left_matched_in == left_order.amount_swapped:
-                assert(new_left_matched_out <= left_order.amount)
-                logger.info('L-Buy-Order {} complete. (+{})'.format(left_order.id,
-                                                                    left_order.amount - new_left_matched_out))
-                left_order.change_state(complete=True, appended=True)
-            elif not left_order.sell_order:
-                assert(new_left_matched_in < left_order.amount_swapped)
-
-            if new_right_matched_out == right_order.amount:
-                assert(new_right_matched_in >= right_order.amount_swapped)
-                logger.info('R-Order {} complete. (+{})'.format(right_order.id,
-                                                                new_right_matched_in - right_order.amount_swapped))
-                logger.info('R-Sell-Order {} complete. (+{})'.format(right_order.id,
-                                                                     new_right_matched_in - right_order.amount_swapped))
-                right_order.change_state(complete=True, appended=True)
-            elif (not right_order.sell_order) and new_right_matched_in == right_order.amount_swapped:
-                assert(new_right_matched_out <= right_order.amount)
-                logger.info('R-Buy-Order {} complete. (+{})'.format(right_order.id,
-                                                                    right_order.amount - new_right_matched_out))
-                right_order.change_state(complete=True, appended=True)
-            elif not right_order.sell_order:
-                assert(new_right_matched_in < right_order.amount_swapped)
-    except IntegrityError:
-        return False
+    matching_batch.add_matching(
+        left_order,
+        right_order,
+        left_to_right_token_volume_traded,
+        right_to_left_token_volume_traded)
+    logger.info('Match {}-{}: {}/{}'.format(
+        left_order.tx_id,
+        right_order.tx_id,
+        left_to_right_token_volume_traded,
+        right_to_left_token_volume_traded))
+
+    if new_left_matched_out == left_order.amount:
+        assert(new_left_matched_in >= left_order.amount_swapped)
+        logger.info('L-Order {} complete. (+{})'.format(left_order.id,
+                                                        new_left_matched_in - left_order.amount_swapped))
+        logger.info('L-Sell-Order {} complete. (+{})'.format(left_order.id,
+                                                             new_left_matched_in - left_order.amount_swapped))
+        matching_batch.change_state(
+            left_order, complete=True, appended=True)
+    elif (not left_order.sell_order) and new_left_matched_in == left_order.amount_swapped:
+        assert(new_left_matched_out <= left_order.amount)
+        logger.info('L-Buy-Order {} complete. (+{})'.format(left_order.id,
+                                                            left_order.amount - new_left_matched_out))
+        matching_batch.change_state(
+            left_order, complete=True, appended=True)
+    elif not left_order.sell_order:
+        assert(new_left_matched_in < left_order.amount_swapped)
+
+    if new_right_matched_out == right_order.amount:
+        assert(new_right_matched_in >= right_order.amount_swapped)
+        logger.info('R-Order {} complete. (+{})'.format(right_order.id,
+                                                        new_right_matched_in - right_order.amount_swapped))
+        logger.info('R-Sell-Order {} complete. (+{})'.format(right_order.id,
+                                                             new_right_matched_in - right_order.amount_swapped))
+        matching_batch.change_state(
+            right_order, complete=True, appended=True)
+    elif (not right_order.sell_order) and new_right_matched_in == right_order.amount_swapped:
+        assert(new_right_matched_out <= right_order.amount)
+        logger.info('R-Buy-Order {} complete. (+{})'.format(right_order.id,
+                                                            right_order.amount - new_right_matched_out))
+        matching_batch.change_state(
+            right_order, complete=True, appended=True)
+    elif not right_order.sell_order:
+        assert(new_right_matched_in < right_order.amount_swapped)
 
     return True
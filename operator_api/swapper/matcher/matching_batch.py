@@ -0,0 +1,82 @@
+from django.db import transaction
+from django.db.models import Q
+from ledger.models import Transfer, Matching
+from operator_api.models import BulkCreateManager, BulkUpdateManager
+
+
+# Accumulates the matchings and order state changes of a taker's sweep through an order book
+# so they are written with a single bulk insert and update once the sweep is over.
+# Matched amounts are read from the database once per order and then tracked in memory.
+class MatchingBatch(object):
+    state_fields = ['processed', 'complete',
+                    'cancelled', 'appended', 'voided']
+
+    def __init__(self, chunk_size=500):
+        self.chunk_size = chunk_size
+        self.matched_amounts_cache = {}
+        self.matchings = []
+        self.changed_orders = {}
+
+    def matched_amounts(self, order: Transfer):
+        if order.tx_id not in self.matched_amounts_cache:
+            self.matched_amounts_cache[order.tx_id] = order.matched_amounts(
+                all_eons=True)
+        return self.matched_amounts_cache[order.tx_id]
+
+    def add_matching(self, left_order: Transfer, right_order: Transfer, left_to_right_volume, right_to_left_volume):
+        self.matchings.append(Matching(
+            eon_number=left_order.eon_number,
+            left_order_tx_id=left_order.tx_id,
+            right_order_tx_id=right_order.tx_id,
+            left_deducted_right_granted_amount=left_to_right_volume,
+            right_deducted_left_granted_amount=right_to_left_volume,
+            left_token=left_order.wallet.token,
+            right_token=right_order.wallet.token))
+
+        left_matched_out, left_matched_in = self.matched_amounts(left_order)
+        self.matched_amounts_cache[left_order.tx_id] = (
+            left_matched_out + left_to_right_volume, left_matched_in + right_to_left_volume)
+
+        right_matched_out, right_matched_in = self.matched_amounts(right_order)
+        self.matched_amounts_cache[right_order.tx_id] = (
+            right_matched_out + right_to_left_volume, right_matched_in + left_to_right_volume)
+
+    # same in-memory effect as Transfer.change_state, persisted on flush
+    def change_state(self, order: Transfer, processed=False, complete=False, cancelled=False, appended=False, voided=False):
+        order.processed = processed
+        order.complete = complete
+        order.cancelled = cancelled
+        order.appended = appended
+        order.voided = voided
+        self.changed_orders[order.id] = order
+
+    def flush(self):
+        if not self.matchings and not self.changed_orders:
+            return
+
+        with transaction.atomic():
+            bulk_create_manager = BulkCreateManager(chunk_size=self.chunk_size)
+            for matching in self.matchings:
+                bulk_create_manager.add(matching)
+            bulk_create_manager.done()
+
+            bulk_update_manager = BulkUpdateManager(chunk_size=self.chunk_size)
+            bulk_update_manager.set_fields_for(Transfer, self.state_fields)
+            for order in self.changed_orders.values():
+                bulk_update_manager.add(order)
+            bulk_update_manager.done()
+
+            # void the future eon instances of closed multi eon orders, as Transfer.change_state does
+            closed_orders = [order for order in self.changed_orders.values()
+                             if order.complete or order.cancelled or order.voided]
+            if closed_orders:
+                future_eons = Q()
+                for order in closed_orders:
+                    future_eons |= Q(tx_id=order.tx_id,
+                                     eon_number__gt=order.eon_number)
+                Transfer.objects\
+                    .filter(future_eons, swap=True, voided=False)\
+                    .update(processed=True, appended=False, voided=True)
+
+        self.matchings = []
+        self.changed_orders = {}
@@ -1,23 +1,24 @@
+from fractions import Fraction
 from ledger.models import Transfer
 
 
-def price_comparison_function(inverse=False, reverse=False):
-    def compare_orders_by_price(left_order: Transfer, right_order: Transfer):
-        assert (left_order.wallet.token == right_order.wallet.token)
-        assert (left_order.recipient.token == right_order.recipient.token)
+# exact price of an order as amount_swapped / amount (or amount / amount_swapped if inverse)
+def order_price(order: Transfer, inverse=False):
+    if not inverse:
+        return Fraction(int(order.amount_swapped), int(order.amount))
+    else:  # use 1/price
+        return Fraction(int(order.amount), int(order.amount_swapped))
 
-        if not inverse:
-            # left_order.amount_swapped / left_order.amount > right_order.amount_swapped / right_order.amount
-            lhs = left_order.amount_swapped * right_order.amount
-            rhs = right_order.amount_swapped * left_order.amount
-        else:  # use 1/price
-            # left_order.amount / left_order.amount_swapped > right_order.amount / right_order.amount_swapped
-            lhs = left_order.amount * right_order.amount_swapped
-            rhs = right_order.amount * left_order.amount_swapped
+
+# returns a key function to be used with sorted or SortedKeyList
+# the key is computed once per order, and ties in price are broken by time priority
+def price_sorting_key(inverse=False, reverse=False):
+    def order_price_key(order: Transfer):
+        price = order_price(order, inverse=inverse)
 
         if not reverse:
-            return lhs - rhs
+            return price, order.time, order.id
         else:
-            return rhs - lhs
+            return -price, order.time, order.id
 
-    return compare_orders_by_price
+    return order_price_key
@@ -0,0 +1,29 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ledger', '0071_transfer_open_swaps_index'),
+        ('swapper', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SwapCursor',
+            fields=[
+                ('id', models.AutoField(auto_created=True,
+                                        primary_key=True, serialize=False, verbose_name='ID')),
+                ('time', models.DateTimeField(blank=True, null=True)),
+                ('transfer_id', models.BigIntegerField(blank=True, null=True)),
+                ('left_token', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE,
+                                                 related_name='+', to='ledger.Token')),
+                ('right_token', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE,
+                                                  related_name='+', to='ledger.Token')),
+            ],
+            options={
+                'unique_together': {('left_token', 'right_token')},
+            },
+        ),
+    ]
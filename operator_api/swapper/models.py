@@ -1,6 +1,78 @@
+from django.db import models
+from django.db.models import Q
 from ledger.models.transfer import Transfer
 
 
 class Swap(Transfer):
     class Meta:
         proxy = True
+
+
+# (time, id) keyset position of the last swap of a token pair taken through the matcher
+# swaps of both directions of the pair share one cursor, keyed by the token with the lower id first
+class SwapCursor(models.Model):
+    left_token = models.ForeignKey(
+        to='ledger.Token',
+        related_name='+',
+        on_delete=models.CASCADE)
+
+    right_token = models.ForeignKey(
+        to='ledger.Token',
+        related_name='+',
+        on_delete=models.CASCADE)
+
+    time = models.DateTimeField(
+        blank=True,
+        null=True)
+
+    transfer_id = models.BigIntegerField(
+        blank=True,
+        null=True)
+
+    class Meta:
+        unique_together = (('left_token', 'right_token'),)
+
+    @staticmethod
+    def for_pair(token, other_token):
+        left_token, right_token = sorted(
+            [token, other_token], key=lambda t: t.id)
+        cursor, _ = SwapCursor.objects\
+            .select_for_update()\
+            .get_or_create(left_token=left_token, right_token=right_token)
+        return cursor
+
+    def is_behind(self, swap: Transfer):
+        return self.time is None or (swap.time, swap.id) > (self.time, self.transfer_id)
+
+    def advance(self, swap: Transfer):
+        if self.is_behind(swap):
+            self.time = swap.time
+            self.transfer_id = swap.id
+
+    # open swaps of this pair past the cursor, in (time, id) order
+    # served by the open swaps partial index on the transfer table
+    def pending_swaps(self, eon_number):
+        return self.unmatched_swaps(eon_number)\
+            .select_for_update()\
+            .order_by('time', 'id')
+
+    # the same swaps without locking them, to probe whether the pair has matching to do
+    def unmatched_swaps(self, eon_number):
+        queryset = Transfer.objects\
+            .filter(
+                Q(wallet__token_id=self.left_token_id, recipient__token_id=self.right_token_id) |
+                Q(wallet__token_id=self.right_token_id, recipient__token_id=self.left_token_id),
+                swap=True,
+                processed=False,
+                complete=False,
+                voided=False,
+                cancelled=False,
+                eon_number=eon_number,
+                sender_active_state__operator_signature__isnull=False,
+                recipient_active_state__operator_signature__isnull=False)
+
+        if self.time is not None:
+            queryset = queryset.filter(
+                Q(time__gt=self.time) | Q(time=self.time, id__gt=self.transfer_id))
+
+        return queryset
@@ -7,7 +7,7 @@ from ledger.models import Transfer, Signature, ActiveState
 from ledger.serializers import SignatureSerializer
 from operator_api.zero_merkle_root_cache import NODE_CACHE
 from contractor.interfaces import LocalViewInterface
-from operator_api.models import ErrorCode
+from operator_api.models import ErrorCode, MutexModel
 from auditor.serializers import ActiveStateSerializer
 from operator_api.celery import operator_celery
 
@@ -243,7 +243,7 @@ class SwapCancellationSerializer(serializers.ModelSerializer):
                 recipient_cancellation_active_state_signature_records
             )
 
-            with current_swap.lock(auto_renewal=False), current_swap.wallet.lock(auto_renewal=False), current_swap.recipient.lock(auto_renewal=False):
+            with MutexModel.lock_many(current_swap, current_swap.wallet, current_swap.recipient, auto_renewal=False):
                 for index in range(len(swap_set)):
                     sender_cancellation_active_state_records[
                         index].wallet_signature = sender_cancellation_active_state_signature_records[index]
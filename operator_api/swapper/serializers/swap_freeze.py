@@ -4,7 +4,7 @@ from operator_api import crypto
 from ledger.models import Transfer, Signature
 from ledger.serializers import SignatureSerializer
 from contractor.interfaces import LocalViewInterface
-from operator_api.models import ErrorCode
+from operator_api.models import ErrorCode, MutexModel
 from auditor.serializers import SwapMatchedAmountSerializer
 
 
@@ -61,7 +61,7 @@ class SwapFreezeSerializer(serializers.ModelSerializer):
             freezing_signature.save()
 
             # only current swap should be locked, future swaps are not matched
-            with current_swap.lock(auto_renewal=False), current_swap.wallet.lock(auto_renewal=False), current_swap.recipient.lock(auto_renewal=False):
+            with MutexModel.lock_many(current_swap, current_swap.wallet, current_swap.recipient, auto_renewal=False):
                 swap_set.update(cancelled=True,
                                 swap_freezing_signature=freezing_signature)
         return current_swap
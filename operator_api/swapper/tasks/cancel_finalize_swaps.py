@@ -4,6 +4,7 @@ from django.db import transaction
 from celery import shared_task
 from celery.utils.log import get_task_logger
 from contractor.interfaces import LocalViewInterface
+from ledger.accounting_partitions import BALANCES, StageBudget, ledger_partition, partition_pairs
 from ledger.models import Transfer, RootCommitment
 from operator_api.decorators import notification_on_error
 
@@ -13,7 +14,7 @@ logger.setLevel(logging.INFO)
 
 @shared_task
 @notification_on_error
-def cancel_finalize_swaps():
+def cancel_finalize_swaps(token_ids=None):
 
     if not LocalViewInterface.get_contract_parameters():
         logger.error('Contract parameters not yet populated.')
@@ -22,11 +23,14 @@ def cancel_finalize_swaps():
     latest_eon_number = LocalViewInterface.latest().eon_number()
 
     # This lock is required because the ledger will be mutated as the swaps are processed
-    with RootCommitment.global_lock():
-        cancel_finalize_swaps_for_eon(latest_eon_number)
+    for pair in partition_pairs(token_ids):
+        with ledger_partition(BALANCES, pair, latest_eon_number) as acquired:
+            if acquired:
+                with StageBudget('cancel_finalize_swaps', pair) as budget:
+                    cancel_finalize_swaps_for_eon(latest_eon_number, tokens=pair, budget=budget)
 
 
-def cancel_finalize_swaps_for_eon(operator_eon_number):
+def cancel_finalize_swaps_for_eon(operator_eon_number, tokens=None, budget=None):
     with transaction.atomic():
         # Countersign finalizations (full matching + extra credit)
         swaps_pending_operator_finalization = Transfer.objects \
@@ -39,8 +43,14 @@ def cancel_finalize_swaps_for_eon(operator_eon_number):
                 recipient_finalization_active_state__isnull=False) \
             .select_for_update() \
             .order_by('time')
+        if tokens is not None:
+            swaps_pending_operator_finalization = swaps_pending_operator_finalization.filter(
+                wallet__token__in=tokens, recipient__token__in=tokens)
 
         for swap in swaps_pending_operator_finalization:
+            # the remaining swaps are countersigned by the next heartbeat
+            if budget is not None and budget.exhausted():
+                break
             with transaction.atomic():
                 swap.sign_swap_finalization(
                     settings.HUB_OWNER_ACCOUNT_ADDRESS,
@@ -60,8 +70,13 @@ def cancel_finalize_swaps_for_eon(operator_eon_number):
                 recipient_cancellation_active_state__isnull=False) \
             .select_for_update() \
             .order_by('time')
+        if tokens is not None:
+            swaps_pending_operator_cancellation = swaps_pending_operator_cancellation.filter(
+                wallet__token__in=tokens, recipient__token__in=tokens)
 
         for swap in swaps_pending_operator_cancellation:
+            if budget is not None and budget.exhausted():
+                break
             with transaction.atomic():
                 if not swap.is_signed_by_operator():
                     swap.cancelled = False
@@ -4,18 +4,21 @@ from django.db import transaction
 from celery import shared_task
 from celery.utils.log import get_task_logger
 from contractor.interfaces import LocalViewInterface
+from ledger.accounting_partitions import BALANCES, StageBudget, ledger_partition, partition_pairs
 from ledger.context.wallet_transfer import WalletTransferContext
 from ledger.models import Transfer, RootCommitment
+from ledger.swap_rollover import SwapRollover
 from swapper.util import swap_expired, should_void_swap
 from operator_api.celery import operator_celery
 from operator_api.decorators import notification_on_error
+from operator_api.models import MutexModel
 logger = get_task_logger(__name__)
 logger.setLevel(logging.INFO)
 
 
 @shared_task
 @notification_on_error
-def confirm_swaps():
+def confirm_swaps(token_ids=None):
 
     if not LocalViewInterface.get_contract_parameters():
         logger.error('Contract parameters not yet populated.')
@@ -24,14 +27,20 @@ def confirm_swaps():
     latest_eon_number = LocalViewInterface.latest().eon_number()
 
     # This lock is required because the ledger will be mutated as the swaps are processed
-    with RootCommitment.global_lock():
-        confirm_swaps_for_eon(latest_eon_number)
+    for pair in partition_pairs(token_ids):
+        with ledger_partition(BALANCES, pair, latest_eon_number) as acquired:
+            if acquired:
+                with StageBudget('confirm_swaps', pair) as budget:
+                    confirm_swaps_for_eon(latest_eon_number, tokens=pair, budget=budget)
 
 
-def confirm_swaps_for_eon(operator_eon_number):
+def confirm_swaps_for_eon(operator_eon_number, tokens=None, budget=None):
     checkpoint_created = RootCommitment.objects.filter(
         eon_number=operator_eon_number).exists()
     with transaction.atomic():
+        # Store the matched totals of multi eon swaps once per eon, before they are countersigned
+        SwapRollover.carry_over_into(operator_eon_number)
+
         # Countersign swaps (no matching yet)
         swaps_pending_operator_confirmation = Transfer.objects \
             .filter(
@@ -47,9 +56,15 @@ def confirm_swaps_for_eon(operator_eon_number):
                 recipient_active_state__operator_signature__isnull=True) \
             .select_for_update() \
             .order_by('time')
+        if tokens is not None:
+            swaps_pending_operator_confirmation = swaps_pending_operator_confirmation.filter(
+                wallet__token__in=tokens, recipient__token__in=tokens)
 
         for swap in swaps_pending_operator_confirmation:
-            with swap.lock(auto_renewal=True), swap.wallet.lock(auto_renewal=True), swap.recipient.lock(auto_renewal=True):
+            # the remaining swaps are countersigned by the next heartbeat
+            if budget is not None and budget.exhausted():
+                break
+            with MutexModel.lock_many(swap, swap.wallet, swap.recipient, auto_renewal=True):
                 swap_wallet_view_context = WalletTransferContext(
                     wallet=swap.wallet, transfer=swap)
                 swap_recipient_view_context = WalletTransferContext(
@@ -1,5 +1,4 @@
 import logging
-from functools import cmp_to_key
 from itertools import combinations
 from django.conf import settings
 from django.db import transaction, IntegrityError
@@ -7,23 +6,27 @@ from celery import shared_task
 from celery.utils.log import get_task_logger
 from contractor.interfaces import LocalViewInterface
 from operator_api.decorators import notification_on_error
+from ledger.accounting_partitions import BALANCES, StageBudget, ledger_partition, partition_pairs
 from ledger.context.wallet_transfer import WalletTransferContext
 from ledger.models import Transfer, RootCommitment, Token
-from swapper.matcher import match_limit_to_limit, price_comparison_function
+from swapper.matcher import match_limit_to_limit, price_sorting_key, MatchingBatch
+from swapper.models import SwapCursor
 from swapper.util import should_void_swap, swap_expired
-from django.core.cache import cache
 from operator_api.celery import operator_celery
-from sortedcontainers import SortedList
-import datetime
-from django.utils import timezone
+from operator_api.models import MutexModel
+from sortedcontainers import SortedKeyList
 
 logger = get_task_logger(__name__)
 logger.setLevel(logging.INFO)
 
+# orders in a book are sorted ascending by amount_swapped / amount
+# which ranks highest priced buys and lowest priced sells first
+order_book_sorting_key = price_sorting_key(inverse=False, reverse=False)
+
 
 @shared_task
 @notification_on_error
-def process_swaps():
+def process_swaps(token_ids=None):
 
     if not LocalViewInterface.get_contract_parameters():
         logger.error('Contract parameters not yet populated.')
@@ -32,44 +35,39 @@ def process_swaps():
     latest_eon_number = LocalViewInterface.latest().eon_number()
 
     # This lock is required because the ledger will be mutated as the swaps are processed
-    with RootCommitment.global_lock():
-        logger.info('Start')
-        process_swaps_for_eon(latest_eon_number)
+    for pair in partition_pairs(token_ids):
+        with ledger_partition(BALANCES, pair, latest_eon_number) as acquired:
+            if acquired:
+                logger.info('Start {}'.format([token.short_name for token in pair]))
+                with StageBudget('process_swaps', pair) as budget:
+                    process_swaps_for_eon(latest_eon_number, tokens=pair, budget=budget)
+
 
+def process_swaps_for_eon(operator_eon_number, tokens=None, budget=None):
+    if tokens is None:
+        tokens = Token.objects.all()
 
-def process_swaps_for_eon(operator_eon_number):
     checkpoint_created = RootCommitment.objects.filter(
         eon_number=operator_eon_number).exists()
 
     notification_queue = []
 
     with transaction.atomic():
-        default_time = timezone.now() - datetime.timedelta(days=365000)
-        # Match swaps
-        last_unprocessed_swap_time = timezone.make_aware(datetime.datetime.fromtimestamp(
-            cache.get_or_set('last_unprocessed_swap_time', default_time.timestamp())))
-
-        unprocessed_swaps = Transfer.objects \
-            .filter(
-                time__gte=last_unprocessed_swap_time,
-                processed=False,
-                complete=False,
-                voided=False,
-                cancelled=False,
-                swap=True,
-                eon_number=operator_eon_number,
-                sender_active_state__operator_signature__isnull=False,
-                recipient_active_state__operator_signature__isnull=False) \
-            .select_for_update() \
-            .order_by('time')
+        # Match swaps of each token pair past its cursor, in (time, id) order
+        swap_cursors = [SwapCursor.for_pair(token, other_token)
+                        for token, other_token in combinations(sorted(tokens, key=lambda token: token.id), 2)]
+        unprocessed_swaps = ((cursor, swap) for cursor in swap_cursors
+                             for swap in cursor.pending_swaps(operator_eon_number))
 
         order_books_cache = {}
 
-        for swap in unprocessed_swaps:
-            last_unprocessed_swap_time = max(
-                last_unprocessed_swap_time, swap.time + datetime.timedelta(milliseconds=1))
+        for swap_cursor, swap in unprocessed_swaps:
+            # the cursor stays before the remaining swaps, they are matched by the next heartbeat
+            if budget is not None and budget.exhausted():
+                break
+            swap_cursor.advance(swap)
             matched_successfully = False
-            with transaction.atomic(), swap.lock(auto_renewal=True), swap.wallet.lock(auto_renewal=True), swap.recipient.lock(auto_renewal=True):
+            with transaction.atomic(), MutexModel.lock_many(swap, swap.wallet, swap.recipient, auto_renewal=True):
                 swap_wallet_view_context = WalletTransferContext(
                     wallet=swap.wallet, transfer=swap)
                 swap_recipient_view_context = WalletTransferContext(
@@ -92,8 +90,7 @@ def process_swaps_for_eon(operator_eon_number):
 
                 # If this is a sell order then the opposite orderbook is for buys, which should be sorted
                 # in decremental order by price such that the first element in the list is the highest priced
-                opposite_comparison_function = price_comparison_function(
-                    inverse=swap.sell_order, reverse=swap.sell_order)
+                # both directions reduce to the same ordering, so every cached book shares one sorting key
                 if opposite_order_book_name not in order_books_cache:
                     print("FETCHED")
                     opposite_swaps = Transfer.objects\
@@ -111,14 +108,16 @@ def process_swaps_for_eon(operator_eon_number):
                             recipient_active_state__operator_signature__isnull=False)\
                         .select_for_update()
 
-                    order_books_cache[opposite_order_book_name] = SortedList(
-                        opposite_swaps, key=cmp_to_key(opposite_comparison_function))
+                    order_books_cache[opposite_order_book_name] = SortedKeyList(
+                        opposite_swaps, key=order_book_sorting_key)
                 else:
                     print("CACHED")
 
-                opposite_order_book = SortedList(
-                    order_books_cache[opposite_order_book_name], key=cmp_to_key(opposite_comparison_function))
+                opposite_order_book = order_books_cache[opposite_order_book_name]
                 opposite_orders_consumed = 0
+                # matchings and state changes of this sweep are written in bulk once it is over
+                matching_batch = MatchingBatch()
+                fulfilled_orders = []
 
                 if len(opposite_order_book) == 0:
                     print("EMPTY")
@@ -158,7 +157,7 @@ def process_swaps_for_eon(operator_eon_number):
                     if not invariant:
                         break
 
-                    with opposite.lock(auto_renewal=True), opposite.wallet.lock(auto_renewal=True), opposite.recipient.lock(auto_renewal=True):
+                    with MutexModel.lock_many(opposite, opposite.wallet, opposite.recipient, auto_renewal=True):
                         opposite_wallet_view_context = WalletTransferContext(
                             wallet=opposite.wallet, transfer=opposite)
                         opposite_recipient_view_context = WalletTransferContext(
@@ -177,46 +176,38 @@ def process_swaps_for_eon(operator_eon_number):
                             continue
 
                         matched_successfully = match_limit_to_limit(
-                            swap, opposite)
+                            swap, opposite, matching_batch)
 
                         if opposite.is_fulfilled_swap():
                             opposite_orders_consumed += 1
-                            try:
-                                opposite.sign_swap_fulfillment(
-                                    settings.HUB_OWNER_ACCOUNT_ADDRESS,
-                                    settings.HUB_OWNER_ACCOUNT_KEY)
-                            except LookupError as e:
-                                logger.error(e)
-
-                        if swap.is_fulfilled_swap():
-                            try:
-                                swap.sign_swap_fulfillment(
-                                    settings.HUB_OWNER_ACCOUNT_ADDRESS,
-                                    settings.HUB_OWNER_ACCOUNT_KEY)
-                            except LookupError as e:
-                                logger.error(e)
+                            fulfilled_orders.append(opposite)
 
                         if swap.is_fulfilled_swap():
+                            fulfilled_orders.append(swap)
                             break
 
-                order_books_cache[opposite_order_book_name] = opposite_order_book.islice(
-                    opposite_orders_consumed)
+                matching_batch.flush()
+
+                # fulfillments are signed once the completion of their orders is written
+                for fulfilled_order in fulfilled_orders:
+                    try:
+                        fulfilled_order.sign_swap_fulfillment(
+                            settings.HUB_OWNER_ACCOUNT_ADDRESS,
+                            settings.HUB_OWNER_ACCOUNT_KEY)
+                    except LookupError as e:
+                        logger.error(e)
+                del opposite_order_book[:opposite_orders_consumed]
 
                 swap_order_book_name = '{}-{}'.format(
                     swap.wallet.token.short_name, swap.recipient.token.short_name)
                 if not swap.is_fulfilled_swap() and swap_order_book_name in order_books_cache:
-                    swap_comparison_function = price_comparison_function(
-                        inverse=not swap.sell_order, reverse=not swap.sell_order)
-                    swap_order_book = SortedList(
-                        order_books_cache[swap_order_book_name], key=cmp_to_key(swap_comparison_function))
-                    swap_order_book.add(swap)
-                    order_books_cache[swap_order_book_name] = swap_order_book
+                    order_books_cache[swap_order_book_name].add(swap)
 
             if matched_successfully:
                 notification_queue.append((swap.id, opposite.id))
 
-        cache.set('last_unprocessed_swap_time',
-                  last_unprocessed_swap_time.timestamp())
+        for swap_cursor in swap_cursors:
+            swap_cursor.save()
 
     for swap_id, opposite_id in notification_queue:
         operator_celery.send_task(
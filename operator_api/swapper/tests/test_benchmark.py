@@ -0,0 +1,16 @@
+from django.test import TestCase
+from ledger.models import Matching
+from swapper.benchmark import MatchingBenchmark, synthetic_order_stream
+
+
+class MatchingBenchmarkTests(TestCase):
+    def test_synthetic_stream(self):
+        events = synthetic_order_stream(order_count=60, seed=7, eon_count=2)
+        report = MatchingBenchmark().run(events)
+
+        self.assertEqual(report.orders, len(
+            [event for event in events if event['type'] == 'order']))
+        self.assertEqual(report.eons, 2)
+        self.assertEqual(report.matches, Matching.objects.count())
+        self.assertGreater(report.matches, 0)
+        self.assertGreater(report.summary().get('queries_per_match'), 0)
@@ -0,0 +1,49 @@
+import datetime
+from decimal import Decimal
+from fractions import Fraction
+from functools import cmp_to_key
+from django.test import TestCase
+from django.utils import timezone
+from operator_api.models import MockModel
+from swapper.matcher import order_price, price_sorting_key
+
+
+def compare_orders_by_price(left_order, right_order):
+    # reference cmp-style ordering by amount_swapped / amount
+    return left_order.amount_swapped * right_order.amount - right_order.amount_swapped * left_order.amount
+
+
+class OrderSortingTests(TestCase):
+    def setUp(self):
+        now = timezone.now()
+        self.orders = [
+            MockModel(id=index, time=now + datetime.timedelta(seconds=index),
+                      amount=Decimal(amount), amount_swapped=Decimal(amount_swapped))
+            for index, (amount, amount_swapped) in enumerate([
+                (3, 7), (10 ** 30, 10 ** 30 + 1), (2, 1), (6, 14), (1, 2), (10 ** 40, 3)
+            ])
+        ]
+
+    def test_exact_price(self):
+        self.assertEqual(order_price(self.orders[1]), Fraction(
+            10 ** 30 + 1, 10 ** 30))
+        self.assertEqual(order_price(self.orders[1], inverse=True), Fraction(
+            10 ** 30, 10 ** 30 + 1))
+
+    def test_matches_comparator_ordering(self):
+        by_key = sorted(self.orders, key=price_sorting_key())
+        by_comparator = sorted(
+            self.orders, key=cmp_to_key(compare_orders_by_price))
+        self.assertEqual([order_price(o) for o in by_key],
+                         [order_price(o) for o in by_comparator])
+
+        by_reverse_inverse_key = sorted(
+            self.orders, key=price_sorting_key(inverse=True, reverse=True))
+        self.assertEqual([o.id for o in by_key], [
+                         o.id for o in by_reverse_inverse_key])
+
+    def test_time_priority(self):
+        # (3, 7) and (6, 14) share a price, the older order comes first
+        ordered_ids = [o.id for o in sorted(
+            reversed(self.orders), key=price_sorting_key())]
+        self.assertLess(ordered_ids.index(0), ordered_ids.index(3))
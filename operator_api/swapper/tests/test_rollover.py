@@ -0,0 +1,75 @@
+import random
+
+from operator_api.simulation.swap import send_swap
+from ledger.models import Transfer
+from ledger.swap_rollover import SwapRollover
+from swapper.tasks.cancel_finalize_swaps import cancel_finalize_swaps_for_eon
+from swapper.tasks.confirm_swaps import confirm_swaps_for_eon
+from swapper.tasks.process_swaps import process_swaps_for_eon
+from operator_api.simulation.eon import commit_eon, advance_to_next_eon
+from .swap_test_case import SwapTestCase
+
+
+class SwapRolloverTests(SwapTestCase):
+    def test_rollover_matches_per_swap_queries(self):
+        commit_eon(
+            test_case=self,
+            eon_number=1)
+
+        send_swap(  # Buy LQD at 0.5 ETH
+            test_case=self,
+            eon_number=1,
+            account=self.testrpc_accounts[1],
+            token=self.eth_token,
+            token_swapped=self.lqd_token,
+            amount=2,
+            amount_swapped=4,
+            nonce=random.randint(1, 999999),
+            eon_count=4)
+        send_swap(  # Sell LQD at 0.5 ETH
+            test_case=self,
+            eon_number=1,
+            account=self.testrpc_accounts[2],
+            token=self.lqd_token,
+            token_swapped=self.eth_token,
+            amount=2,
+            amount_swapped=1,
+            nonce=random.randint(1, 999999),
+            eon_count=1)
+
+        for eon_number in range(1, 3):
+            confirm_swaps_for_eon(operator_eon_number=eon_number)
+            cancel_finalize_swaps_for_eon(operator_eon_number=eon_number)
+            process_swaps_for_eon(operator_eon_number=eon_number)
+
+            advance_to_next_eon(
+                test_case=self,
+                eon_number=eon_number)
+            if eon_number < 2:
+                commit_eon(
+                    test_case=self,
+                    eon_number=eon_number + 1)
+
+        # totals stored at the boundary, before the carried swap is countersigned
+        carried_swap = Transfer.objects.get(
+            swap=True, wallet__token=self.eth_token, eon_number=3)
+        self.assertFalse(carried_swap.appended)
+        SwapRollover(eon_number=3).carry_over()
+        self.assertEqual(SwapRollover.carried_matched_amounts(carried_swap),
+                         carried_swap.matched_amounts(all_eons=True))
+
+        commit_eon(
+            test_case=self,
+            eon_number=3)
+
+        # retired at the checkpoint of eon 3
+        swap = Transfer.objects.get(
+            swap=True, wallet__token=self.eth_token, eon_number=2)
+        self.assertTrue(swap.processed)
+
+        swap_rollover = SwapRollover(eon_number=3).load()
+        self.assertTrue(swap_rollover.is_multi_eon_swap(swap))
+        self.assertEqual(swap_rollover.matched_amounts(swap, all_eons=True),
+                         swap.matched_amounts(all_eons=True))
+        self.assertEqual(swap_rollover.matched_amounts(swap, all_eons=False),
+                         swap.matched_amounts(all_eons=False))
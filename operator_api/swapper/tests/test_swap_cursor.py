@@ -0,0 +1,29 @@
+import datetime
+from django.test import TestCase
+from django.utils import timezone
+from operator_api.models import MockModel
+from swapper.models import SwapCursor
+
+
+class SwapCursorTests(TestCase):
+    def test_advance_by_time_then_id(self):
+        now = timezone.now()
+        cursor = SwapCursor()
+        first = MockModel(id=7, time=now)
+        same_time = MockModel(id=8, time=now)
+        earlier_id = MockModel(id=3, time=now + datetime.timedelta(seconds=1))
+
+        self.assertTrue(cursor.is_behind(first))
+        cursor.advance(first)
+        self.assertFalse(cursor.is_behind(first))
+
+        # swaps sharing a timestamp are told apart by id instead of skipped
+        self.assertTrue(cursor.is_behind(same_time))
+        cursor.advance(same_time)
+        self.assertEqual((cursor.time, cursor.transfer_id), (now, 8))
+
+        cursor.advance(earlier_id)
+        self.assertEqual(cursor.transfer_id, 3)
+
+        cursor.advance(first)
+        self.assertEqual(cursor.transfer_id, 3)
@@ -6,6 +6,7 @@ from rest_framework import serializers
 from operator_api import crypto
 from ledger.context.wallet_transfer import WalletTransferContext
 from ledger.models import Transfer, ActiveState, MinimumAvailableBalanceMarker, Signature
+from ledger.swap_rollover import SwapRollover
 from enum import Enum
 from operator_api.models import ErrorCode
 
@@ -83,7 +84,12 @@ def should_void_swap(
         only_appended=True)
 
     # sender remaining funds should be more than remaining amount in order
-    matched_out, matched_in = swap.matched_amounts(all_eons=True)
+    # swaps carried into this eon have their totals stored at the eon boundary
+    carried_matched_amounts = SwapRollover.carried_matched_amounts(swap)
+    if carried_matched_amounts is not None:
+        matched_out, matched_in = carried_matched_amounts
+    else:
+        matched_out, matched_in = swap.matched_amounts(all_eons=True)
     if sender_funds_remaining < swap.amount - matched_out:
         logger.error('Swap {} overspending.'.format(swap.id))
         return True
@@ -110,7 +116,7 @@ def should_void_swap(
         only_appended=True)
 
     # if this is a multi eon swap
-    if Transfer.objects.filter(eon_number=swap.eon_number-1, tx_id=swap.tx_id).exists():
+    if carried_matched_amounts is not None or Transfer.objects.filter(eon_number=swap.eon_number-1, tx_id=swap.tx_id).exists():
         # set balances to initial fixed balances stored in transfer eon state
         sender_starting_balance = swap.sender_starting_balance
         recipient_starting_balance = swap.recipient_starting_balance
@@ -10,16 +10,18 @@ from celery.utils.log import get_task_logger
 from contractor.interfaces import LocalViewInterface
 from operator_api.crypto import hex_value
 from operator_api.email import send_admin_email
+from ledger.accounting_partitions import BALANCES, ledger_partition, partition_tokens
 from ledger.context.wallet_transfer import WalletTransferContext
 from ledger.models import Transfer, ActiveState, RootCommitment, MinimumAvailableBalanceMarker
 from operator_api.celery import operator_celery
+from operator_api.models import MutexModel
 
 logger = get_task_logger(__name__)
 logger.setLevel(logging.INFO)
 
 
 @shared_task
-def process_passive_transfer_finalizations():
+def process_passive_transfer_finalizations(token_id=None):
     raise NotImplemented()  # TODO Implement
 
     logger.info('Processing passive transfers')
@@ -31,12 +33,14 @@ def process_passive_transfer_finalizations():
     latest_eon_number = LocalViewInterface.latest().eon_number()
 
     # This lock is required because the ledger will be mutated as the transfers are processed
-    with RootCommitment.global_lock():
-        logger.info('Start')
-        process_passive_transfer_finalizations_for_eon(latest_eon_number)
+    for token in partition_tokens(token_id):
+        with ledger_partition(BALANCES, [token], latest_eon_number) as acquired:
+            if acquired:
+                logger.info('Start {}'.format(token.short_name))
+                process_passive_transfer_finalizations_for_eon(latest_eon_number, tokens=[token])
 
 
-def process_passive_transfer_finalizations_for_eon(operator_eon_number):
+def process_passive_transfer_finalizations_for_eon(operator_eon_number, tokens=None):
     checkpoint_created = RootCommitment.objects.filter(
         eon_number=operator_eon_number).exists()
     with transaction.atomic():
@@ -44,6 +48,8 @@ def process_passive_transfer_finalizations_for_eon(operator_eon_number):
             .filter(processed=False, swap=False, passive=True)\
             .select_for_update()\
             .order_by('eon_number', 'id')
+        if tokens is not None:
+            transfers = transfers.filter(wallet__token__in=tokens)
 
         for transfer in transfers:
             try:
@@ -156,7 +162,7 @@ def process_passive_transfer(transfer, operator_eon_number, checkpoint_created):
         transfer.close(voided=True)
         return
 
-    with transfer.lock(auto_renewal=True), transfer.wallet.lock(auto_renewal=True), transfer.recipient.lock(auto_renewal=True):
+    with MutexModel.lock_many(transfer, transfer.wallet, transfer.recipient, auto_renewal=True):
         wallet_view_context = WalletTransferContext(
             wallet=transfer.wallet, transfer=transfer)
         recipient_view_context = WalletTransferContext(